@@ -0,0 +1,177 @@
+import gzip
+import json
+import re
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# printed by FakeLxd into Job output, monotonic time of sending in nanoseconds
+STAMP = re.compile(rb'::bench:(\d+)::')
+
+
+class JobRecord:
+
+    def __init__(self, job: Dict[str, Any], queued: float) -> None:
+        self.job = job
+        self.queued = queued
+        self.picked = None  # type: Optional[float]
+        self.running = None  # type: Optional[float]
+        self.finished = None  # type: Optional[float]
+        self.status = None  # type: Optional[str]
+        self.log = bytearray()
+        self.log_latencies = list()  # type: List[float]
+
+
+class FakeCore:
+    """
+    PiperCore serving queued Jobs to a runner (with batches and long polling) and collecting its reports,
+    including chunked log uploads.
+    """
+
+    class _Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request: Any, client_address: Any) -> None:
+            # the runner is stopped once all Jobs are reported, possibly before it reads the last response
+            if not isinstance(sys.exc_info()[1], ConnectionError):
+                super().handle_error(request, client_address)
+
+    def __init__(self, host: str='127.0.0.1', port: int=0) -> None:
+        self.records = OrderedDict()  # type: Dict[str, JobRecord]
+        self._queue = list()  # type: List[str]
+        # set once the runner asks for a Job
+        self.polled = threading.Event()
+        self._condition = threading.Condition()
+        core = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                if not url.path.startswith('/jobs/queue/'):
+                    self._respond(HTTPStatus.NOT_FOUND, b'')
+                    return
+
+                query = parse_qs(url.query)
+                limit = int(query.get('limit', ['1'])[0])
+                wait = int(query.get('wait', ['0'])[0])
+                jobs = core.take(limit, wait)
+                if not jobs:
+                    self._respond(HTTPStatus.OK, b'')
+                elif 'limit' in query:
+                    self._respond(HTTPStatus.OK, json.dumps(jobs).encode())
+                else:
+                    self._respond(HTTPStatus.OK, json.dumps(jobs[0]).encode())
+
+            def do_POST(self) -> None:
+                url = urlparse(self.path)
+                secret = url.path.split('/')[-1]
+                status = parse_qs(url.query)['status'][0]
+                body = self.rfile.read(int(self.headers.get('content-length', 0)))
+                response = core.report(secret, status, body, self.headers)
+                self._respond(HTTPStatus.OK, json.dumps(response).encode())
+
+            def _respond(self, status: HTTPStatus, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header('content-type', 'application/json')
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = self._Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-core', daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self._server.server_address)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push(self, job: Dict[str, Any]) -> None:
+        with self._condition:
+            self.records[job['secret']] = JobRecord(job, monotonic())
+            self._queue.append(job['secret'])
+            self._condition.notify_all()
+
+    def take(self, limit: int, wait: int) -> List[Dict[str, Any]]:
+        self.polled.set()
+        deadline = monotonic() + wait
+        with self._condition:
+            while not self._queue and monotonic() < deadline:
+                self._condition.wait(deadline - monotonic())
+            secrets, self._queue = self._queue[:limit], self._queue[limit:]
+            now = monotonic()
+            for secret in secrets:
+                self.records[secret].picked = now
+
+            return [self.records[secret].job for secret in secrets]
+
+    def report(self, secret: str, status: str, body: bytes, headers: Any) -> Dict[str, Any]:
+        now = monotonic()
+        with self._condition:
+            record = self.records[secret]
+            if status == 'RUNNING' and record.running is None:
+                record.running = now
+
+            response = {'status': 'OK'}  # type: Dict[str, Any]
+            if 'x-piper-offset' in headers:
+                data = self._decode(body, headers.get('content-encoding'))
+                offset = int(headers['x-piper-offset'])
+                del record.log[offset:]
+                record.log += data
+                record.log_latencies.extend(now - int(stamp) / 1e9 for stamp in STAMP.findall(data))
+                response['offset'] = len(record.log)
+            elif body:
+                record.log += body
+
+            if status in ('COMPLETED', 'ERROR'):
+                record.finished = now
+                record.status = status
+                self._condition.notify_all()
+
+            return response
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits until all pushed Jobs are finished, returns False on timeout.
+        """
+        deadline = monotonic() + timeout
+        with self._condition:
+            while any(record.finished is None for record in self.records.values()):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+
+        return True
+
+    @staticmethod
+    def _decode(body: bytes, encoding: Optional[str]) -> bytes:
+        if encoding == 'gzip':
+            return gzip.decompress(body)
+        if encoding == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+
+        return body
@@ -0,0 +1,370 @@
+import json
+import re
+import socketserver
+import threading
+import time
+import uuid
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server
+
+from ws4py.server.wsgirefserver import WSGIServer, WebSocketWSGIRequestHandler
+from ws4py.server.wsgiutils import WebSocketWSGIApplication
+from ws4py.websocket import WebSocket
+
+
+MARKER = re.compile(r'::piper:command:(\d+):start:')
+
+
+class Operation:
+
+    def __init__(self, delay: Optional[float], on_done: Optional[Callable[['Operation'], None]]=None,
+                 metadata: Optional[Dict[str, Any]]=None) -> None:
+        """
+        :param delay: seconds until the operation finishes, None if it is finished explicitly
+        :param on_done: called with the operation once it finishes
+        """
+        self.id = str(uuid.uuid4())
+        self.metadata = metadata
+        self.done = threading.Event()
+        self.fds = dict()  # type: Dict[str, str]
+        self.output = b''
+        self.closed = 0
+        self._on_done = on_done
+        if delay is not None and delay > 0:
+            threading.Timer(delay, self.finish).start()
+        elif delay is not None:
+            self.finish()
+
+    def finish(self) -> None:
+        self.done.set()
+        if self._on_done is not None:
+            self._on_done(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        finished = self.done.is_set()
+        return {
+            'id': self.id,
+            'class': 'websocket' if self.fds else 'task',
+            'status': 'Success' if finished else 'Running',
+            'status_code': 200 if finished else 103,
+            'resources': {},
+            'metadata': self.metadata,
+            'may_cancel': False,
+            'err': '',
+        }
+
+
+class FakeLxd:
+    """
+    LXD REST API good enough for the runner: containers are only names, `exec` streams `output_size` bytes of
+    output (in messages of `message_size` bytes) with ::piper:command markers of the Job script and time stamps
+    read by FakeCore. Container create/start/stop/delete take `create_latency`, `start_latency`... seconds,
+    network of a started container is configured after `network_latency` seconds. Finished operations are announced
+    on /1.0/events. Images can be pulled from a remote server offering `remote` (alias: fingerprint), a pull takes
+    `pull_latency` seconds.
+    """
+
+    class _Server(socketserver.ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+        def __init__(self, *args, **kwargs) -> None:
+            self._websockets = set()  # type: set
+            super().__init__(*args, **kwargs)
+
+        def link_websocket_to_server(self, ws: WebSocket) -> None:
+            self._websockets.add(ws.sock)
+            super().link_websocket_to_server(ws)
+
+        def shutdown_request(self, request: Any) -> None:
+            # plain HTTP requests are closed, upgraded sockets belong to the websocket manager
+            if request not in self._websockets:
+                socketserver.TCPServer.shutdown_request(self, request)
+
+    def __init__(self, host: str='127.0.0.1', port: int=0, create_latency: float=0.0, start_latency: float=0.0,
+                 stop_latency: float=0.0, delete_latency: float=0.0, network_latency: float=0.0,
+                 output_size: int=0, message_size: int=4096, output_rate: Optional[float]=None,
+                 remote: Optional[Dict[str, str]]=None, pull_latency: float=0.0) -> None:
+        self.containers = dict()  # type: Dict[str, Dict[str, Any]]
+        # local images by fingerprint, aliases point to fingerprints
+        self.images = dict()  # type: Dict[str, Dict[str, Any]]
+        self.aliases = dict()  # type: Dict[str, str]
+        self.remote = remote if remote is not None else dict()
+        self.pulls = 0
+        self._pull_latency = pull_latency
+        self.created = 0
+        self.deleted = 0
+        # bytes of memory reported by the resources API
+        self.memory_used = 0
+        self._operations = dict()  # type: Dict[str, Operation]
+        self._subscribers = set()  # type: Set[WebSocket]
+        self._lock = threading.Lock()
+        self._latency = {
+            'create': create_latency,
+            'start': start_latency,
+            'stop': stop_latency,
+            'delete': delete_latency,
+        }
+        self._network_latency = network_latency
+        self._output_size = output_size
+        self._message_size = message_size
+        self._output_rate = output_rate
+        lxd = self
+
+        class Stream(WebSocket):
+
+            def opened(self) -> None:
+                threading.Thread(target=lxd.stream, args=(self,), daemon=True).start()
+
+        class Events(WebSocket):
+
+            def opened(self) -> None:
+                with lxd._lock:
+                    lxd._subscribers.add(self)
+
+            def closed(self, code: int, reason: Optional[str]=None) -> None:
+                with lxd._lock:
+                    lxd._subscribers.discard(self)
+
+        self._websocket_app = WebSocketWSGIApplication(handler_cls=Stream)
+        self._events_app = WebSocketWSGIApplication(handler_cls=Events)
+        self._server = make_server(
+            host, port, server_class=self._Server, handler_class=WebSocketWSGIRequestHandler, app=self._app,
+        )
+        self._server.initialize_websockets_manager()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-lxd', daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://{}:{}'.format(*self._server.server_address)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _app(self, environ: Dict[str, Any], start_response: Callable) -> List[bytes]:
+        path = environ['PATH_INFO'].rstrip('/').split('/')[1:]
+        method = environ['REQUEST_METHOD']
+        if path == ['1.0', 'events']:
+            return self._events_app(environ, start_response)
+        if path[-1:] == ['websocket']:
+            return self._websocket_app(environ, start_response)
+
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = json.loads(environ['wsgi.input'].read(length).decode()) if length else None
+        status, response = self._route(method, path, body)
+
+        data = json.dumps(response).encode()
+        # every request gets its own connection, the server closes it after response
+        headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(data))), ('Connection', 'close')]
+        start_response(status, headers)
+        return [data]
+
+    def _route(self, method: str, path: List[str], body: Any) -> Tuple[str, Dict[str, Any]]:
+        if path == ['1.0']:
+            return self._sync({'auth': 'trusted', 'api_extensions': [], 'environment': {}})
+        if path == ['1.0', 'resources']:
+            return self._sync({'cpu': {'total': 4}, 'memory': {'used': self.memory_used, 'total': 1024 ** 3}})
+
+        if path[:2] == ['1.0', 'operations']:
+            with self._lock:
+                operation = self._operations.get(path[2])
+            if operation is None:
+                return self._error(404)
+            if path[3:] == ['wait']:
+                operation.done.wait()
+            return self._sync(operation.to_dict())
+
+        if path[:2] == ['1.0', 'images']:
+            return self._image(method, path[2:], body)
+
+        if path[:2] not in (['1.0', 'containers'], ['1.0', 'instances']):
+            return self._error(404)
+
+        if len(path) == 2 and method == 'POST':
+            with self._lock:
+                self.containers[body['name']] = {
+                    'name': body['name'], 'status': 'Stopped', 'devices': {}, 'config': body.get('config', {}),
+                }
+                self.created += 1
+            return self._async(self._latency['create'])
+
+        with self._lock:
+            container = self.containers.get(path[2])
+        if container is None:
+            return self._error(404)
+
+        if len(path) == 3 and method == 'GET':
+            return self._sync(dict(container, profiles=[], ephemeral=False))
+        if len(path) == 3 and method == 'PUT':
+            container['devices'] = body.get('devices', {})
+            container['config'] = body.get('config', {})
+            return self._async(0)
+        if len(path) == 3 and method == 'DELETE':
+            with self._lock:
+                del self.containers[path[2]]
+                self.deleted += 1
+            return self._async(self._latency['delete'])
+        if path[3:] == ['state'] and method == 'GET':
+            return self._sync(self._state(container))
+        if path[3:] == ['state'] and method == 'PUT':
+            container['status'] = 'Running' if body['action'] == 'start' else 'Stopped'
+            container['started'] = monotonic() + self._latency['start'] if body['action'] == 'start' else None
+            return self._async(self._latency[body['action']] if body['action'] in self._latency else 0)
+        if path[3:] == ['exec'] and method == 'POST':
+            return self._exec(body)
+
+        return self._error(404)
+
+    def _image(self, method: str, path: List[str], body: Any) -> Tuple[str, Dict[str, Any]]:
+        if path == [] and method == 'POST':
+            source = body['source']
+            fingerprint = self.remote.get(source.get('alias') or source.get('fingerprint'))
+            if fingerprint is None:
+                return self._error(404)
+            with self._lock:
+                self.pulls += 1
+                self.images.setdefault(fingerprint, {'fingerprint': fingerprint, 'size': 1024 ** 2})
+            return self._async(self._pull_latency, {'fingerprint': fingerprint})
+
+        with self._lock:
+            if path == ['aliases'] and method == 'POST':
+                self.aliases[body['name']] = body['target']
+                return self._sync({})
+            if path[:1] == ['aliases'] and len(path) > 1:
+                # aliases contain slashes (alpine/3.5)
+                name = '/'.join(path[1:])
+                if name not in self.aliases:
+                    return self._error(404)
+                if method == 'PUT':
+                    self.aliases[name] = body['target']
+                return self._sync({'name': name, 'target': self.aliases[name], 'description': ''})
+
+            image = self.images.get(path[0]) if len(path) == 1 else None
+            if image is None:
+                return self._error(404)
+            if method != 'DELETE':
+                aliases = [{'name': name, 'description': ''} for name, fp in self.aliases.items() if fp == path[0]]
+                return self._sync(dict(image, aliases=aliases))
+            del self.images[path[0]]
+            self.aliases = {k: v for k, v in self.aliases.items() if v != path[0]}
+
+        return self._async(0)
+
+    def _state(self, container: Dict[str, Any]) -> Dict[str, Any]:
+        addresses = [{'family': 'inet', 'address': '127.0.0.1', 'netmask': '8', 'scope': 'local'}]
+        network = {'lo': {'addresses': addresses, 'state': 'up', 'type': 'loopback'}}
+        started = container.get('started')
+        if started is not None and monotonic() >= started + self._network_latency:
+            addresses = [{'family': 'inet', 'address': '10.0.3.2', 'netmask': '24', 'scope': 'global'}]
+            network['eth0'] = {'addresses': addresses, 'state': 'up', 'type': 'broadcast'}
+
+        return {'status': container['status'], 'status_code': 103 if started else 102, 'network': network}
+
+    def _exec(self, body: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        operation = Operation(None, self._announce)
+        operation.output = self._output(body['command'][-1])
+        operation.fds = {fd: uuid.uuid4().hex for fd in ('0', '1', '2', 'control')}
+        operation.metadata = {'fds': operation.fds}
+        with self._lock:
+            self._operations[operation.id] = operation
+
+        return self._accepted(operation)
+
+    def _output(self, script: str) -> bytes:
+        """
+        Output of Job `script` with its markers and about `output_size` bytes of time stamped lines.
+        """
+        commands = [int(idx) for idx in MARKER.findall(script)] or [0]
+        per_command = self._output_size // len(commands)
+        line = b'x' * 71 + b'\n'
+        output = bytearray()
+        for idx in commands:
+            output += '::piper:command:{}:start:{}::\n'.format(idx, int(time.time())).encode()
+            output += line * (per_command // len(line))
+            output += '::piper:command:{}:end:{}:0::\n'.format(idx, int(time.time())).encode()
+
+        return bytes(output)
+
+    def stream(self, ws: WebSocket) -> None:
+        query = parse_qs(ws.environ.get('QUERY_STRING', ''))
+        secret = query.get('secret', [''])[0]
+        with self._lock:
+            found = [(op, fd) for op in self._operations.values() for fd, s in op.fds.items() if s == secret]
+        if not found:
+            ws.close()
+            return
+
+        operation, fd = found[0]
+        if fd == '1':
+            started = monotonic()
+            sent = 0
+            offset = 0
+            output = operation.output
+            while offset < len(output):
+                # messages end with whole lines, so time stamps do not split markers
+                end = output.rfind(b'\n', offset, offset + self._message_size) + 1
+                if end <= offset:
+                    end = offset + self._message_size
+                stamp = '::bench:{}::\n'.format(int(monotonic() * 1e9)).encode()
+                data = stamp + output[offset:end]
+                offset = end
+                ws.send(data, binary=True)
+                sent += len(data)
+                if self._output_rate:
+                    delay = started + sent / self._output_rate - monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            # empty message tells the runner the stream ended
+            ws.send(b'', binary=True)
+        if fd in ('1', '2'):
+            ws.close()
+            with self._lock:
+                operation.closed += 1
+                finished = operation.closed == 2
+            if finished:
+                operation.metadata['return'] = 0
+                operation.finish()
+
+    def _async(self, delay: float, metadata: Optional[Dict[str, Any]]=None) -> Tuple[str, Dict[str, Any]]:
+        operation = Operation(delay, self._announce, metadata)
+        with self._lock:
+            self._operations[operation.id] = operation
+
+        return self._accepted(operation)
+
+    def _announce(self, operation: Operation) -> None:
+        event = {
+            'type': 'operation',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'metadata': operation.to_dict(),
+        }
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for ws in subscribers:
+            try:
+                ws.send(json.dumps(event))
+            except OSError:
+                pass
+
+    @staticmethod
+    def _accepted(operation: Operation) -> Tuple[str, Dict[str, Any]]:
+        return '202 Accepted', {
+            'type': 'async',
+            'status': 'Operation created',
+            'status_code': 100,
+            'operation': '/1.0/operations/' + operation.id,
+            'metadata': operation.to_dict(),
+        }
+
+    @staticmethod
+    def _sync(metadata: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        return '200 OK', {'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata}
+
+    @staticmethod
+    def _error(code: int) -> Tuple[str, Dict[str, Any]]:
+        return '{} Error'.format(code), {'type': 'error', 'error': 'not found', 'error_code': code}
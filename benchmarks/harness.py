@@ -0,0 +1,234 @@
+"""
+End to end benchmark of the runner against FakeCore and FakeLxd, no LXD needed:
+
+    python -m benchmarks.harness --jobs 100 --instances 8 --output-size 1048576 --create-latency 0.2
+
+Runs `piper-lxd` in a subprocess and reports jobs per second, pickup latency (Job queued to reported running),
+log latency (output sent by LXD to received by PiperCore) and CPU time and memory of the runner processes.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+
+from benchmarks.fake_core import FakeCore
+from benchmarks.fake_lxd import FakeLxd
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': values[-1]}
+
+
+class ProcessTree:
+    """
+    Samples CPU time and resident memory of a process and its live descendants from /proc.
+    """
+
+    TICKS = os.sysconf('SC_CLK_TCK')
+
+    PAGE = os.sysconf('SC_PAGE_SIZE')
+
+    def __init__(self, pid: int) -> None:
+        self._pid = pid
+        self.cpu = 0.0
+        self.peak_rss = 0
+
+    def sample(self) -> None:
+        cpu = 0.0
+        rss = 0
+        for pid in self._tree(self._pid):
+            try:
+                stat = Path('/proc/{}/stat'.format(pid)).read_text()
+                statm = Path('/proc/{}/statm'.format(pid)).read_text()
+            except OSError:
+                continue
+            fields = stat.rsplit(')', 1)[1].split()
+            # utime, stime, cutime, cstime (reaped children are included in the latter two)
+            cpu += sum(int(value) for value in fields[11:15]) / self.TICKS
+            rss += int(statm.split()[1]) * self.PAGE
+        self.cpu = max(self.cpu, cpu)
+        self.peak_rss = max(self.peak_rss, rss)
+
+    def _tree(self, pid: int) -> List[int]:
+        pids = [pid]
+        try:
+            tasks = os.listdir('/proc/{}/task'.format(pid))
+        except OSError:
+            return pids
+        for task in tasks:
+            try:
+                children = Path('/proc/{}/task/{}/children'.format(pid, task)).read_text().split()
+            except OSError:
+                continue
+            for child in children:
+                pids.extend(self._tree(int(child)))
+
+        return pids
+
+
+def _origin(directory: Path) -> Dict[str, str]:
+    origin = directory / 'origin'
+    origin.mkdir()
+    commands = [
+        ['git', 'init', '-q'],
+        ['git', 'checkout', '-q', '-b', 'master'],
+        ['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost', 'commit', '-q', '--allow-empty',
+         '-m', 'bench'],
+    ]
+    for command in commands:
+        subprocess.check_call(command, cwd=str(origin))
+    commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=str(origin)).decode().strip()
+
+    return {'origin': 'file://{}'.format(origin), 'branch': 'master', 'commit': commit}
+
+
+def run(jobs: int=20, commands: int=3, instances: int=4, mode: str='process', create_latency: float=0.0,
+        start_latency: float=0.0, network_latency: float=0.0, output_size: int=64 * 1024, message_size: int=4096,
+        output_rate: Optional[float]=None, timeout: float=300.0,
+        runner: Optional[Dict[str, Any]]=None) -> Dict[str, Any]:
+    """
+    Runs `jobs` Jobs of `commands` commands each through the runner, `runner` overrides its configuration.
+    """
+    core = FakeCore()
+    lxd = FakeLxd(
+        create_latency=create_latency, start_latency=start_latency, network_latency=network_latency,
+        output_size=output_size, message_size=message_size, output_rate=output_rate,
+    )
+    core.start()
+    lxd.start()
+
+    with tempfile.TemporaryDirectory() as td:
+        directory = Path(td)
+        repository = _origin(directory)
+        for name in ('client.crt', 'client.key'):
+            (directory / name).touch()
+
+        config = {
+            'lxd': {
+                'endpoint': lxd.url,
+                'cert': str(directory / 'client.crt'),
+                'key': str(directory / 'client.key'),
+                'verify': False,
+                'profiles': ['default'],
+            },
+            'runner': {
+                'token': 'bench',
+                'endpoint': core.url,
+                'instances': instances,
+                'mode': mode,
+                'interval': 1,
+                'state_dir': str(directory / 'state'),
+            },
+            'logging': {
+                'version': 1,
+                'disable_existing_loggers': False,
+                'handlers': {'console': {'class': 'logging.StreamHandler'}},
+                'root': {'level': os.environ.get('PIPER_BENCH_LOG', 'WARNING'), 'handlers': ['console']},
+            },
+        }
+        config['runner'].update(runner or {})
+        (directory / 'config.yml').write_text(yaml.safe_dump(config))
+
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'piper_lxd.run', str(directory / 'config.yml')],
+            cwd=str(Path(__file__).resolve().parent.parent),
+            # Executor processes are stopped together with the runner
+            start_new_session=True,
+        )
+        tree = ProcessTree(process.pid)
+        finished = False
+        try:
+            # Jobs are queued once the runner is up, its start-up is not measured
+            core.polled.wait(timeout)
+            started = time.monotonic()
+            deadline = started + timeout
+            for idx in range(jobs):
+                core.push({
+                    'secret': 'bench{}'.format(idx),
+                    'image': 'bench',
+                    'commands': ['true'] * commands,
+                    'repository': repository,
+                })
+
+            while time.monotonic() < deadline and process.poll() is None:
+                tree.sample()
+                if core.wait(0.1):
+                    finished = True
+                    break
+            # Jobs are reported finished before their containers are deleted
+            while lxd.containers and time.monotonic() < deadline and process.poll() is None:
+                tree.sample()
+                time.sleep(0.05)
+            tree.sample()
+        finally:
+            # SIGTERM would drain the runner
+            os.killpg(process.pid, signal.SIGINT)
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+            core.stop()
+            lxd.stop()
+
+    records = list(core.records.values())
+    done = [record for record in records if record.finished is not None]
+    elapsed = max(record.finished for record in done) - started if done else None
+    log_latencies = [latency for record in records for latency in record.log_latencies]
+
+    return {
+        'finished': finished,
+        'jobs': jobs,
+        'completed': sum(1 for record in done if record.status == 'COMPLETED'),
+        'errors': sum(1 for record in done if record.status == 'ERROR'),
+        'elapsed': elapsed,
+        'jobs_per_second': len(done) / elapsed if elapsed else None,
+        'pickup_latency': percentiles([r.running - r.queued for r in records if r.running is not None]),
+        'job_latency': percentiles([r.finished - r.queued for r in done]),
+        'log_latency': percentiles(log_latencies),
+        'log_bytes': sum(len(record.log) for record in records),
+        'containers_left': len(lxd.containers),
+        'cpu_seconds': tree.cpu,
+        'peak_rss': tree.peak_rss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the runner against fake PiperCore and LXD.')
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--commands', type=int, default=3, help='commands per Job')
+    parser.add_argument('--instances', type=int, default=4)
+    parser.add_argument('--mode', choices=['process', 'thread'], default='process')
+    parser.add_argument('--create-latency', type=float, default=0.0, help='seconds to create a container')
+    parser.add_argument('--start-latency', type=float, default=0.0, help='seconds to start a container')
+    parser.add_argument('--network-latency', type=float, default=0.0,
+                        help='seconds until network of a started container is configured')
+    parser.add_argument('--output-size', type=int, default=64 * 1024, help='bytes of output per Job')
+    parser.add_argument('--message-size', type=int, default=4096, help='bytes per websocket message')
+    parser.add_argument('--output-rate', type=float, default=None, help='bytes of output per second per Job')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--runner', type=json.loads, default=None,
+                        help='JSON object overriding "runner" section of the configuration')
+    parsed = vars(parser.parse_args())
+
+    print(json.dumps(run(**parsed), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import random
+from datetime import timedelta
+
+
+class Backoff:
+    """
+    Exponentially growing delay with "equal jitter", so runners polling or reconnecting do not do it in lockstep.
+    Never shorter than `initial`.
+    """
+
+    def __init__(self, initial: timedelta, maximum: timedelta, factor: float=2.0) -> None:
+        self._initial = initial
+        self._maximum = max(initial, maximum)
+        self._factor = factor
+        self._attempt = 0
+
+    def reset(self) -> None:
+        self._attempt = 0
+
+    def next(self) -> timedelta:
+        delay = min(self._maximum, self._initial * (self._factor ** self._attempt))
+        if delay < self._maximum:
+            self._attempt += 1
+
+        return max(self._initial, delay / 2 + delay / 2 * random.random())
@@ -0,0 +1,139 @@
+import mmap
+import tempfile
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, IO, List, Optional, Tuple
+
+from piper_lxd.models.job import Job
+
+
+class SegmentBuffer:
+    """
+    Byte buffer of Job output between two flushes.
+
+    Received segments are kept as they are (no copying) until `memory_limit` is reached, more output is spilled
+    to a temporary file and handed over as a view of its memory mapping. At most `size_limit` bytes are kept:
+    the head of the output and its last `memory_limit / 2` bytes, bytes in between are dropped and replaced by
+    a truncation `marker` telling how many of them there were.
+
+    Output is written in records. A record of a single part may be cut, a record of more parts (e.g. a header
+    and data) is kept or dropped as a whole.
+    """
+
+    TRUNCATED = '::' + Job.COMMAND_PREFIX + ':truncated:{}::\n'
+
+    def __init__(self, memory_limit: int, size_limit: int, spill_dir: Optional[Path]=None,
+                 marker: Optional[Callable[[int], bytes]]=None) -> None:
+        self._tail_limit = memory_limit // 2
+        self._head_memory_limit = memory_limit - self._tail_limit
+        self._head_limit = max(size_limit, memory_limit) - self._tail_limit
+        self._spill_dir = spill_dir
+        self._marker = marker if marker is not None else lambda dropped: self.TRUNCATED.format(dropped).encode()
+        self._head = list()  # type: List[memoryview]
+        self._head_memory = 0
+        self._spill = None  # type: Optional[IO[bytes]]
+        self._spilled = 0
+        self._tail = deque()  # type: Deque[List[memoryview]]
+        self._tail_size = 0
+        self._dropped = 0
+        self._handed_over = None  # type: Optional[Tuple[IO[bytes], mmap.mmap]]
+
+    def __len__(self) -> int:
+        return self._head_memory + self._spilled + self._tail_size
+
+    @property
+    def dropped(self) -> int:
+        return self._dropped
+
+    def write(self, *parts: bytes) -> None:
+        """
+        Appends a record made of `parts`.
+        """
+        views = [memoryview(part) for part in parts]
+        size = sum(len(view) for view in views)
+        head = self._head_memory + self._spilled
+        if not self._tail and head < self._head_limit:
+            room = self._head_limit - head
+            if size <= room:
+                self._keep(views, size)
+                return
+            if len(views) == 1:
+                self._keep([views[0][:room]], room)
+                views = [views[0][room:]]
+                size -= room
+
+        self._tail.append(views)
+        self._tail_size += size
+        while self._tail_size > self._tail_limit:
+            excess = self._tail_size - self._tail_limit
+            record = self._tail[0]
+            if len(record) == 1 and len(record[0]) > excess:
+                self._tail[0] = [record[0][excess:]]
+                dropped = excess
+            elif len(record) > 1 and len(self._tail) == 1:
+                # the last record is kept whole
+                break
+            else:
+                self._tail.popleft()
+                dropped = sum(len(view) for view in record)
+            self._tail_size -= dropped
+            self._dropped += dropped
+
+    def pop(self) -> List[memoryview]:
+        """
+        Returns buffered output as a list of segments and empties the buffer. Segments are valid until the next
+        call of `pop` or `close`.
+        """
+        self._release()
+
+        segments = self._head
+        if self._spill is not None:
+            self._spill.flush()
+            mapping = mmap.mmap(self._spill.fileno(), self._spilled, access=mmap.ACCESS_READ)
+            self._handed_over = (self._spill, mapping)
+            segments.append(memoryview(mapping))
+        if self._dropped:
+            segments.append(memoryview(self._marker(self._dropped)))
+        for record in self._tail:
+            segments.extend(record)
+
+        self._head = list()
+        self._head_memory = 0
+        self._spill = None
+        self._spilled = 0
+        self._tail = deque()
+        self._tail_size = 0
+        self._dropped = 0
+
+        return segments
+
+    def close(self) -> None:
+        self._release()
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def _release(self) -> None:
+        if self._handed_over is None:
+            return
+
+        spill, mapping = self._handed_over
+        self._handed_over = None
+        try:
+            mapping.close()
+        except BufferError:
+            # somebody still holds a view, mapping is released with it
+            pass
+        spill.close()
+
+    def _keep(self, views: List[memoryview], size: int) -> None:
+        if self._spill is None and self._head_memory + size <= self._head_memory_limit:
+            self._head.extend(views)
+            self._head_memory += size
+            return
+
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=str(self._spill_dir) if self._spill_dir else None)
+        for view in views:
+            self._spill.write(view)
+        self._spilled += size
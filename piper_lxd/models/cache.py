@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+from piper_lxd.models.errors import PScriptException
+from piper_lxd.models.git import directory_size
+from piper_lxd.models.lock import FileLock
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class CacheWorkspace:
+    """
+    Private copy of a cache entry used by one Job, `volumes` maps container paths to host directories.
+
+    `commit` replaces the entry with the workspace, `release` throws the workspace away unless it was committed.
+    """
+
+    def __init__(self, cache: 'DependencyCache', key: str, path: Path, volumes: Dict[str, Path]) -> None:
+        self._cache = cache
+        self._key = key
+        self._path = path
+        self._committed = False
+        self.volumes = volumes
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def commit(self) -> None:
+        self._cache.commit(self._key, self._path)
+        self._committed = True
+
+    def release(self) -> None:
+        if not self._committed:
+            shutil.rmtree(str(self._path), ignore_errors=True)
+
+
+class DependencyCache:
+    """
+    Directories (pip, npm, maven... caches) persisted between Jobs with the same cache key.
+
+    Every Job works on its own copy of the entry in the `.work` directory (copy-on-write where the filesystem
+    supports reflinks), the copy becomes a new version of the entry only after the Job succeeded. Current version
+    is pointed to by a symlink that is swapped atomically, so a crashed Job never leaves a half-written entry behind.
+    Least recently used entries are evicted once the cache exceeds `max_size` bytes.
+    """
+
+    _CURRENT = 'current'
+
+    _WORK = '.work'
+
+    _LOCK_SUFFIX = '.lock'
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        self._path = path
+        self._max_size = max_size
+
+    def checkout(self, key: str, paths: List[str]) -> CacheWorkspace:
+        """
+        Returns workspace with directories for container `paths`, filled from the entry of `key` if there is one.
+
+        :raises PScriptException:
+        """
+        entry = self._entry(key)
+        entry.mkdir(parents=True, exist_ok=True)
+        workspace = self._path / self._WORK / uuid.uuid4().hex
+        workspace.mkdir(parents=True)
+
+        lock = FileLock(entry.with_suffix(self._LOCK_SUFFIX))
+        lock.acquire(shared=True)
+        try:
+            current = entry / self._CURRENT
+            if current.exists():
+                os.utime(str(entry))
+                self._copy(current.resolve(), workspace)
+        except (OSError, PScriptException):
+            shutil.rmtree(str(workspace), ignore_errors=True)
+            raise
+        finally:
+            lock.release()
+
+        volumes = dict()  # type: Dict[str, Path]
+        for path in paths:
+            directory = workspace / hashlib.sha1(path.encode()).hexdigest()[:16]
+            directory.mkdir(exist_ok=True)
+            volumes[path] = directory
+
+        return CacheWorkspace(self, key, workspace, volumes)
+
+    def commit(self, key: str, workspace: Path) -> None:
+        """
+        Makes `workspace` the entry of `key`.
+        """
+        entry = self._entry(key)
+        lock = FileLock(entry.with_suffix(self._LOCK_SUFFIX))
+        lock.acquire()
+        try:
+            # the entry may have been evicted in the meantime
+            entry.mkdir(exist_ok=True)
+            workspace.rename(entry / workspace.name)
+            link = entry / '.{}.link'.format(workspace.name)
+            link.symlink_to(workspace.name)
+            current = entry / self._CURRENT
+            previous = current.resolve() if current.exists() else None
+            os.replace(str(link), str(current))
+            if previous is not None:
+                shutil.rmtree(str(previous), ignore_errors=True)
+        finally:
+            lock.release()
+
+        LOG.debug('Saved dependency cache "{}"'.format(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes least recently used entries until the cache fits into its size budget. Entries in use are skipped.
+        """
+        entries = [
+            (p, p.stat().st_mtime, directory_size(p)) for p in self._path.iterdir()
+            if p.is_dir() and p.name != self._WORK
+        ]
+        total = sum(size for _, _, size in entries)
+
+        for entry, _, size in sorted(entries, key=lambda x: x[1]):
+            if total <= self._max_size:
+                break
+
+            lock = FileLock(entry.with_suffix(self._LOCK_SUFFIX))
+            if not lock.acquire(blocking=False):
+                continue
+
+            try:
+                LOG.debug('Evicting dependency cache {} ({} bytes)'.format(entry, size))
+                shutil.rmtree(str(entry), ignore_errors=True)
+                total -= size
+            finally:
+                lock.release()
+
+    def _entry(self, key: str) -> Path:
+        return self._path / hashlib.sha1(key.encode()).hexdigest()
+
+    @staticmethod
+    def _copy(source: Path, destination: Path) -> None:
+        # reflinks make the copy nearly free on btrfs and XFS, other filesystems get a regular copy
+        command = ['cp', '-a', '--reflink=auto', str(source) + '/.', str(destination)]
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise PScriptException('Failed to copy dependency cache. Raw: ' + process.stderr.decode())
@@ -1,30 +1,136 @@
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import timedelta
-import collections
+import collections.abc
+import copy
 
 from pykwalify.core import Core as Validator
 
 import piper_lxd.schemas as schemas
+from piper_lxd.models.git import CloneStrategy
 
 
 class LxdConfig:
 
-    def __init__(self, verify: bool, profiles: List[str], endpoint: str, cert: Path, key: Path) -> None:
+    def __init__(self, verify: bool, profiles: List[str], endpoint: str, cert: Path, key: Path,
+                 pool_size: int=10, capacity: int=1) -> None:
         self.verify = verify
         self.profiles = profiles
         self.endpoint = endpoint
         self.cert = cert
         self.key = key
+        self.pool_size = pool_size
+        # maximum number of concurrent jobs on the host
+        self.capacity = capacity
 
 
 class RunnerConfig:
 
-    def __init__(self, token: str, interval: timedelta, instances: int, endpoint: str) -> None:
+    def __init__(self, token: str, interval: timedelta, instances: int, endpoint: str, state_dir: Path,
+                 mode: str, http_pool_size: int, http_retries: int, http_backoff: float, long_poll: timedelta,
+                 max_interval: timedelta, flush_size: int, flush_latency: timedelta, log_compression: Optional[str],
+                 log_spool: int, buffer_memory: int, buffer_size: int, log_format: str,
+                 metrics: Optional[str]) -> None:
         self.token = token
         self.interval = interval
         self.instances = instances
         self.endpoint = endpoint
+        self.state_dir = state_dir
+        self.mode = mode
+        self.http_pool_size = http_pool_size
+        self.http_retries = http_retries
+        self.http_backoff = http_backoff
+        self.long_poll = long_poll
+        self.max_interval = max_interval
+        self.flush_size = flush_size
+        self.flush_latency = flush_latency
+        self.log_compression = log_compression
+        self.log_spool = log_spool
+        self.buffer_memory = buffer_memory
+        self.buffer_size = buffer_size
+        self.log_format = log_format
+        self.metrics = metrics
+
+
+class GitConfig:
+
+    def __init__(self, cache: Optional[Path], cache_size: int, strategy: CloneStrategy, sparse: List[str],
+                 jobs: int) -> None:
+        self.cache = cache
+        self.cache_size = cache_size
+        self.strategy = strategy
+        self.sparse = sparse
+        self.jobs = jobs
+
+
+class CacheConfig:
+
+    def __init__(self, path: Optional[Path], size: int) -> None:
+        self.path = path
+        self.size = size
+
+
+class ResourceClass:
+
+    def __init__(self, name: str, cpu: int, memory: int) -> None:
+        self.name = name
+        self.cpu = cpu
+        # bytes
+        self.memory = memory
+
+    @property
+    def limits(self) -> Dict[str, str]:
+        """
+        LXD container configuration limiting the container to the class.
+        """
+        return {
+            'limits.cpu': str(self.cpu),
+            'limits.memory': '{}MiB'.format(self.memory // 1024 // 1024),
+        }
+
+
+class ResourceConfig:
+
+    def __init__(self, classes: Dict[str, ResourceClass], default: Optional[str], reserve: int) -> None:
+        self.classes = classes
+        self.default = default
+        # bytes of host memory never handed out to jobs
+        self.reserve = reserve
+
+    def get(self, name: Optional[str]) -> Optional[ResourceClass]:
+        """
+        Returns class `name`, the default class for unknown or missing name. None means the Job is not limited.
+        """
+        if name is not None and name in self.classes:
+            return self.classes[name]
+
+        return self.classes.get(self.default) if self.default is not None else None
+
+
+class PoolConfig:
+
+    def __init__(self, image: str, size: int, rate: int) -> None:
+        self.image = image
+        self.size = size
+        self.rate = rate
+
+
+class ImageConfig:
+
+    def __init__(self, server: Optional[str], protocol: str, refresh: timedelta, budget: int,
+                 pinned: List[str]) -> None:
+        self.server = server
+        self.protocol = protocol
+        self.refresh = refresh
+        self.budget = budget
+        self.pinned = pinned
+
+
+class TemplateConfig:
+
+    def __init__(self, image: str, commands: List[str]) -> None:
+        self.image = image
+        self.commands = commands
 
 
 class LoggingConfig:
@@ -39,12 +145,56 @@ class Config:
         'lxd': {
             'profiles': [],
             'verify': False,
+            'cert': '~/.config/lxc/client.crt',
+            'key': '~/.config/lxc/client.key',
+            'pool_size': 10,
+            'hosts': [],
         },
         'runner': {
             'interval': 3,
             'instances': 1,
             'repository_dir': '/tmp',
+            'state_dir': '~/.cache/piper-lxd',
+            'mode': 'process',
+            'http_pool_size': 10,
+            'http_retries': 3,
+            'http_backoff': 0.5,
+            'long_poll': 30,
+            'max_interval': 30,
+            'flush_size': 64,
+            'flush_latency': 500,
+            'log_compression': 'none',
+            'log_spool': 64,
+            'buffer_memory': 8,
+            'buffer_size': 256,
+            'log_format': 'raw',
+            'metrics': 'none',
+        },
+        'git': {
+            'cache': None,
+            'cache_size': 10240,
+            'strategy': CloneStrategy.FULL.value,
+            'sparse': [],
+            'jobs': 1,
+        },
+        'cache': {
+            'path': None,
+            'size': 10240,
+        },
+        'images': {
+            'server': 'none',
+            'protocol': 'simplestreams',
+            'refresh': 3600,
+            'budget': 10240,
+            'pinned': [],
         },
+        'resources': {
+            'default': 'none',
+            'reserve': 512,
+            'classes': {},
+        },
+        'pool': [],
+        'templates': [],
         'logging': {
             'version': 1,
         },
@@ -53,26 +203,89 @@ class Config:
     def __init__(self, d: Dict[Any, Any]) -> None:
         validator = Validator(schema_data=schemas.config, source_data=d)
         validator.validate()
-        config = self._merge_dicts(self._DEFAULTS, d)
+        config = self._merge_dicts(copy.deepcopy(self._DEFAULTS), d)
 
         self.logging = LoggingConfig(config['logging'])
-        self.lxd = LxdConfig(
-            verify=config['lxd']['verify'],
-            profiles=config['lxd']['profiles'],
-            endpoint=config['lxd']['endpoint'],
-            cert=Path(config['lxd']['cert']),
-            key=Path(config['lxd']['key']),
-        )
+        # first host is configured by the lxd section itself, other hosts inherit its settings
+        self.lxd = self._lxd(config['lxd'], config['lxd'], config['runner']['instances'])
+        self.hosts = [self.lxd] + [
+            self._lxd(host, config['lxd'], config['runner']['instances']) for host in config['lxd']['hosts']
+        ]
         self.runner = RunnerConfig(
             token=config['runner']['token'],
             interval=timedelta(seconds=config['runner']['interval']),
             instances=config['runner']['instances'],
             endpoint=config['runner']['endpoint'],
+            state_dir=Path(config['runner']['state_dir']).expanduser(),
+            mode=config['runner']['mode'],
+            http_pool_size=config['runner']['http_pool_size'],
+            http_retries=config['runner']['http_retries'],
+            http_backoff=config['runner']['http_backoff'],
+            long_poll=timedelta(seconds=config['runner']['long_poll']),
+            max_interval=timedelta(seconds=config['runner']['max_interval']),
+            flush_size=config['runner']['flush_size'] * 1024,
+            flush_latency=timedelta(milliseconds=config['runner']['flush_latency']),
+            log_compression=self._optional(config['runner']['log_compression']),
+            log_spool=config['runner']['log_spool'] * 1024 * 1024,
+            buffer_memory=config['runner']['buffer_memory'] * 1024 * 1024,
+            buffer_size=config['runner']['buffer_size'] * 1024 * 1024,
+            log_format=config['runner']['log_format'],
+            metrics=self._optional(config['runner']['metrics']),
+        )
+        self.git = GitConfig(
+            cache=Path(config['git']['cache']).expanduser() if config['git']['cache'] else None,
+            cache_size=config['git']['cache_size'] * 1024 * 1024,
+            strategy=CloneStrategy(config['git']['strategy']),
+            sparse=config['git']['sparse'],
+            jobs=config['git']['jobs'],
+        )
+        self.cache = CacheConfig(
+            path=Path(config['cache']['path']).expanduser() if config['cache']['path'] else None,
+            size=config['cache']['size'] * 1024 * 1024,
+        )
+        self.images = ImageConfig(
+            server=self._optional(config['images']['server']),
+            protocol=config['images']['protocol'],
+            refresh=timedelta(seconds=config['images']['refresh']),
+            budget=config['images']['budget'] * 1024 * 1024,
+            pinned=config['images']['pinned'],
         )
+        self.resources = ResourceConfig(
+            classes={
+                name: ResourceClass(name=name, cpu=c['cpu'], memory=c['memory'] * 1024 * 1024)
+                for name, c in config['resources']['classes'].items()
+            },
+            default=self._optional(config['resources']['default']),
+            reserve=config['resources']['reserve'] * 1024 * 1024,
+        )
+        self.pool = [
+            PoolConfig(image=pool['image'], size=pool['size'], rate=pool.get('rate', pool['size']))
+            for pool in config['pool']
+        ]
+        self.templates = [
+            TemplateConfig(image=template['image'], commands=template.get('commands', []))
+            for template in config['templates']
+        ]
+
+    @staticmethod
+    def _lxd(host: Dict[str, Any], defaults: Dict[str, Any], instances: int) -> LxdConfig:
+        return LxdConfig(
+            verify=host.get('verify', defaults['verify']),
+            profiles=defaults['profiles'],
+            endpoint=host['endpoint'],
+            cert=Path(host.get('cert', defaults['cert'])),
+            key=Path(host.get('key', defaults['key'])),
+            pool_size=host.get('pool_size', defaults['pool_size']),
+            capacity=host.get('capacity', defaults.get('capacity', instances)),
+        )
+
+    @staticmethod
+    def _optional(value: str) -> Optional[str]:
+        return None if value == 'none' else value
 
     def _merge_dicts(self, d, u):
         for k, v in u.items():
-            if isinstance(v, collections.Mapping):
+            if isinstance(v, collections.abc.Mapping):
                 r = self._merge_dicts(d.get(k, {}), v)
                 d[k] = r
             else:
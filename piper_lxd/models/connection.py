@@ -1,33 +1,134 @@
-from typing import Optional
+import json
+import logging
+import os
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
 from http import HTTPStatus
 from datetime import timedelta
 
 import requests
+import requests.adapters
 import requests.exceptions
+from pykwalify.core import Core as Validator
+from pykwalify.errors import SchemaError
+from urllib3.util.retry import Retry
 
+import piper_lxd.schemas as schemas
 from piper_lxd.models.job import Job, RequestJobStatus, ResponseJobStatus
-from piper_lxd.models.errors import PConnectionRequestError, PConnectionInvalidResponseError
+from piper_lxd.models import metrics
+from piper_lxd.models.errors import PConnectionException, PConnectionRequestError, PConnectionInvalidResponseError
+from piper_lxd.models.log import LogChunk
+from piper_lxd.models.steps import Step
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+def _measured(request: str):
+    """
+    Records round-trip time and failures of `request` to PiperCore.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            with metrics.CORE_REQUESTS.time(request=request):
+                try:
+                    return func(*args, **kwargs)
+                except PConnectionException:
+                    metrics.CORE_ERRORS.inc(request=request)
+                    raise
+
+        return wrapped
+
+    return decorator
 
 
 class Connection:
 
     _DEFAULT_TIMEOUT = timedelta(seconds=30)
 
-    def __init__(self, core_base_url: str, timeout: Optional[timedelta]=None) -> None:
+    # statuses of piper-core (or proxy in front of it) that are worth repeating idempotent request for
+    _RETRY_STATUSES = (HTTPStatus.BAD_GATEWAY, HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.GATEWAY_TIMEOUT)
+
+    def __init__(self, core_base_url: str, timeout: Optional[timedelta]=None, pool_size: int=10, retries: int=3,
+                 backoff: float=0.5) -> None:
+        """
+        Requests share a keep-alive session with up to `pool_size` connections. Failed connection attempts are
+        repeated up to `retries` times with exponential `backoff` (in seconds), GET requests are repeated also
+        on 502, 503 and 504 responses. Session is created lazily and again in every forked process.
+        """
         self._timeout = self._DEFAULT_TIMEOUT if timeout is None else timeout
         self._core_base_url = core_base_url
+        self._pool_size = pool_size
+        self._retries = retries
+        self._backoff = backoff
+        self._session = None  # type: Optional[requests.Session]
+        self._session_pid = None  # type: Optional[int]
 
-    def fetch_job(self, token: str) -> Optional[Job]:
+    @_measured('fetch')
+    def fetch_job(self, token: str, wait: Optional[timedelta]=None) -> Optional[Job]:
         """
         Fetches new Job from PiperCore if available, returns None otherwise.
+        With `wait`, PiperCore supporting long polling holds the request until Job is queued or `wait` elapses.
 
         :raises PConnectionInvalidResponseError:
         :raises PConnectionRequestError:
         :raises pykwalify.errors.SchemaError: on invalid Job definition
         """
+        js = self._fetch(token, dict(), wait)
+        if js is None:
+            return None
+
+        return Job(js)
+
+    @_measured('fetch')
+    def fetch_jobs(self, token: str, limit: int, wait: Optional[timedelta]=None) -> List[Job]:
+        """
+        Fetches up to `limit` Jobs from PiperCore in one request. Jobs with invalid definition, and Jobs over
+        `limit`, are reported as failed. With `wait`, PiperCore supporting long polling holds the request until
+        a Job is queued or `wait` elapses.
+
+        :raises PConnectionInvalidResponseError:
+        :raises PConnectionRequestError:
+        """
+        js = self._fetch(token, {'limit': limit}, wait)
+        if js is None:
+            return []
+
+        # PiperCore without batch support responds with single Job
+        if not isinstance(js, list):
+            js = [js]
+
+        for item in js[limit:]:
+            self._reject(item, 'runner asked for {} jobs only'.format(limit))
+        js = js[:limit]
+
+        try:
+            Validator(source_data=js, schema_data=schemas.jobs).validate()
+        except SchemaError:
+            # find out which ones are broken, the rest is still ours to run
+            jobs = list()
+            for item in js:
+                try:
+                    jobs.append(Job(item))
+                except SchemaError as e:
+                    self._reject(item, 'invalid schema: {}'.format(e))
+            return jobs
+
+        return [Job(item, validate=False) for item in js]
+
+    def _fetch(self, token: str, params: Dict[str, int], wait: Optional[timedelta]) -> Optional[Any]:
+        """
+        Returns decoded response of the fetch request, None when PiperCore has no Job.
+        """
         url = self._fetch_job_url(token)
+        timeout = self._timeout
+        if wait is not None:
+            params['wait'] = int(wait.total_seconds())
+            timeout += wait
+
         try:
-            response = requests.get(url, timeout=self._timeout.total_seconds())
+            response = self._http.get(url, params=params, timeout=timeout.total_seconds())
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             raise PConnectionRequestError(str(e))
@@ -39,27 +140,42 @@ class Connection:
             return None
 
         try:
-            js = response.json()
+            return response.json()
         except ValueError:
             raise PConnectionInvalidResponseError('Response is not valid JSON')
 
-        job = Job(js)
+    def _reject(self, item: Any, reason: str) -> None:
+        """
+        Reports fetched Job that will not run as failed, so it does not stay assigned to the runner.
+        """
+        secret = item.get('secret') if isinstance(item, dict) else None
+        if not isinstance(secret, str):
+            LOG.warning('Fetched job without secret is dropped, {}'.format(reason))
+            return
 
-        return job
+        LOG.warning('Fetched job "{}" is rejected, {}'.format(secret, reason))
+        try:
+            self.report(secret, RequestJobStatus.ERROR)
+        except PConnectionException as e:
+            LOG.warning('Failed to report rejected job "{}". Raw: {}'.format(secret, e))
 
-    def report(self, secret: str, status: RequestJobStatus, log: Optional[str]=None) -> ResponseJobStatus:
+    @_measured('report')
+    def report(self, secret: str, status: RequestJobStatus, log: Optional[str]=None,
+               steps: Optional[List[Step]]=None) -> ResponseJobStatus:
         """
-        Reports Job status to PiperCore with optional Streaming Log contents.
+        Reports Job status to PiperCore with optional Streaming Log contents and status of Job steps that changed.
         Returns response status from PiperCore.
 
         :raises PConnectionRequestError:
         :raises PConnectionInvalidResponseError:
         """
         url = self._report_url(secret, status)
+        headers = {'content-type': 'text/plain'}
+        headers.update(self._steps_header(steps))
         try:
-            response = requests.post(
+            response = self._http.post(
                 url,
-                headers={'content-type': 'text/plain'},
+                headers=headers,
                 data=log.encode() if log else None,
                 timeout=self._timeout.total_seconds()
             )
@@ -82,12 +198,89 @@ class Connection:
 
         return response_status
 
+    @_measured('report_chunk')
+    def report_chunk(self, secret: str, status: RequestJobStatus, chunk: LogChunk,
+                     steps: Optional[List[Step]]=None) -> Tuple[ResponseJobStatus, Optional[int]]:
+        """
+        Reports Job status to PiperCore with a chunk of Streaming Log and status of Job steps that changed.
+        Returns response status from PiperCore and offset of Streaming Log it acknowledged, if it told.
+
+        :raises PConnectionRequestError:
+        :raises PConnectionInvalidResponseError:
+        """
+        url = self._report_url(secret, status)
+        headers = {
+            'content-type': 'text/plain' if chunk.log_format == 'raw' else 'application/octet-stream',
+            'x-piper-log-format': chunk.log_format,
+            'x-piper-offset': str(chunk.offset),
+            'x-piper-length': str(chunk.length),
+            'x-piper-sequence': str(chunk.sequence),
+        }
+        if chunk.encoding is not None:
+            headers['content-encoding'] = chunk.encoding
+        headers.update(self._steps_header(steps))
+
+        try:
+            response = self._http.post(url, headers=headers, data=chunk.data, timeout=self._timeout.total_seconds())
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise PConnectionRequestError(e)
+
+        if response.status_code != HTTPStatus.OK:
+            raise PConnectionRequestError('Expected {}, got {}.'.format(HTTPStatus.OK, response.status_code))
+
+        try:
+            js = response.json()
+        except ValueError:
+            raise PConnectionInvalidResponseError('Response is not valid JSON')
+
+        try:
+            response_status = ResponseJobStatus[js['status']]
+        except KeyError:
+            raise PConnectionInvalidResponseError('Invalid status in JSON response')
+
+        offset = js.get('offset')
+        if offset is not None and not isinstance(offset, int):
+            raise PConnectionInvalidResponseError('Invalid offset in JSON response')
+
+        return response_status, offset
+
     @property
     def core_base_url(self) -> str:
         return self._core_base_url
 
+    @property
+    def _http(self) -> requests.Session:
+        # connections of the parent must not be used after fork
+        if self._session is None or self._session_pid != os.getpid():
+            retry = Retry(
+                total=self._retries,
+                backoff_factor=self._backoff,
+                status_forcelist=self._RETRY_STATUSES,
+                raise_on_status=False,
+            )
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self._pool_size,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._session_pid = os.getpid()
+
+        return self._session
+
     def _fetch_job_url(self, token: str) -> str:
         return '{}/jobs/queue/{}'.format(self.core_base_url, token)
 
+    @staticmethod
+    def _steps_header(steps: Optional[List[Step]]) -> Dict[str, str]:
+        if not steps:
+            return {}
+
+        return {'x-piper-steps': json.dumps([step.to_dict() for step in steps], separators=(',', ':'))}
+
     def _report_url(self, secret: str, status: RequestJobStatus) -> str:
         return '{}/jobs/report/{}?status={}'.format(self.core_base_url, secret, status.value)
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic
+from typing import Any, Dict, Optional, Set
+
+import pylxd
+from ws4py.client import WebSocketBaseClient
+from ws4py.exc import HandshakeError
+import ws4py.messaging
+
+from piper_lxd.models.backoff import Backoff
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class EventListener:
+    """
+    Single subscription to LXD operation events shared by all Scripts of the runner, so a Script learns how its
+    command finished without asking LXD for it.
+
+    Only operations `register`ed by Scripts are kept until someone waits for them. Operation may finish before its
+    Script gets to register it, so the last RECENT finished unregistered operations are kept too. Once the
+    subscription is lost, or in a forked process, `wait` returns None and callers fall back to the REST API;
+    lost subscription is renewed with exponential backoff between RECONNECT and MAX_RECONNECT.
+    """
+
+    RECENT = 64
+
+    RECONNECT = timedelta(seconds=1)
+
+    MAX_RECONNECT = timedelta(seconds=60)
+
+    # LXD status codes from 200 (Success, Failure, Cancelled...) are final
+    FINAL_STATUS = 200
+
+    class _Socket(WebSocketBaseClient):
+
+        def __init__(self, listener: 'EventListener', *args, **kwargs) -> None:
+            self.listener = listener
+            super(EventListener._Socket, self).__init__(*args, **kwargs)
+
+        def received_message(self, message: ws4py.messaging.Message) -> None:
+            self.listener.dispatch(message.data)
+
+        def closed(self, code: int, reason: Optional[str]=None) -> None:
+            self.listener.disconnected(code, reason)
+
+    def __init__(self, client: pylxd.Client) -> None:
+        self._client = client
+        self._registered = set()  # type: Set[str]
+        self._finished = dict()  # type: Dict[str, Dict[str, Any]]
+        self._recent = OrderedDict()  # type: OrderedDict[str, Dict[str, Any]]
+        self._condition = threading.Condition()
+        self._connected = False
+        self._stopped = threading.Event()
+        self._pid = os.getpid()
+        self._socket = None  # type: Optional[EventListener._Socket]
+        self._thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    def start(self) -> bool:
+        """
+        Subscribes to LXD events, returns False if that failed. Failed subscription is retried in background.
+        """
+        if self._subscribe():
+            return True
+
+        threading.Thread(target=self._reconnect, name='lxd-events-reconnect', daemon=True).start()
+
+        return False
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._socket is not None:
+            self._socket.close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def register(self, operation_id: str) -> None:
+        """
+        Keeps final state of operation `operation_id` for `wait`.
+        """
+        with self._condition:
+            self._registered.add(operation_id)
+            if operation_id in self._recent:
+                self._finished[operation_id] = self._recent.pop(operation_id)
+
+    def wait(self, operation_id: str, timeout: timedelta) -> Optional[Dict[str, Any]]:
+        """
+        Returns final state of registered operation `operation_id` once LXD announces it, None on timeout or when
+        events are not available. The operation is forgotten afterwards.
+        """
+        if os.getpid() != self._pid:
+            return None
+
+        deadline = monotonic() + timeout.total_seconds()
+        with self._condition:
+            try:
+                while operation_id not in self._finished:
+                    remaining = deadline - monotonic()
+                    if not self._connected or remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+                return self._finished.pop(operation_id)
+            finally:
+                self._registered.discard(operation_id)
+                self._finished.pop(operation_id, None)
+
+    def dispatch(self, data: bytes) -> None:
+        try:
+            event = json.loads(data.decode())
+        except ValueError:
+            LOG.warning('Malformed LXD event: {!r}'.format(data))
+            return
+
+        operation = event.get('metadata') or {}
+        if event.get('type') != 'operation' or operation.get('status_code', 0) < self.FINAL_STATUS:
+            return
+
+        with self._condition:
+            if operation['id'] in self._registered:
+                self._finished[operation['id']] = operation
+                self._condition.notify_all()
+                return
+
+            self._recent[operation['id']] = operation
+            while len(self._recent) > self.RECENT:
+                self._recent.popitem(last=False)
+
+    def disconnected(self, code: int, reason: Optional[str]=None) -> None:
+        with self._condition:
+            self._connected = False
+            self._condition.notify_all()
+
+        if self._stopped.is_set():
+            return
+
+        message = 'Subscription to LXD events was closed ({}: {}), falling back to REST API'
+        LOG.warning(message.format(code, reason))
+        threading.Thread(target=self._reconnect, name='lxd-events-reconnect', daemon=True).start()
+
+    def _subscribe(self) -> bool:
+        socket = self._client.events(websocket_client=lambda *args, **kwargs: self._Socket(self, *args, **kwargs))
+        socket.resource = socket.resource.split('?')[0] + '?type=operation'
+        try:
+            # socket is read by the thread only after events received with the handshake response were dispatched
+            socket.connect()
+        except (OSError, HandshakeError) as e:
+            LOG.warning('Failed to subscribe to LXD events, falling back to REST API. Raw: {}'.format(e))
+            return False
+
+        with self._condition:
+            self._connected = True
+        self._socket = socket
+        self._thread = threading.Thread(target=socket.run, name='lxd-events', daemon=True)
+        self._thread.start()
+
+        return True
+
+    def _reconnect(self) -> None:
+        backoff = Backoff(self.RECONNECT, self.MAX_RECONNECT)
+        while not self._stopped.wait(backoff.next().total_seconds()):
+            if self._subscribe():
+                LOG.info('Subscribed to LXD events again')
+                return
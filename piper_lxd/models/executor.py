@@ -1,18 +1,27 @@
 import logging
 import multiprocessing
+import time
 from datetime import timedelta
 from functools import wraps
 import tempfile
 from pathlib import Path
+from typing import List, Optional
 
 import pylxd
 
+from piper_lxd.models.log import LogShipper
+from piper_lxd.models.cache import CacheWorkspace, DependencyCache
+from piper_lxd.models.events import EventListener
+from piper_lxd.models.image import ImageManager
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.journal import Journal
 from piper_lxd.models.script import Script
+from piper_lxd.models.template import TemplateManager
 from piper_lxd.models.connection import Connection
-from piper_lxd.models.config import LxdConfig
-from piper_lxd.models import git
+from piper_lxd.models.config import CacheConfig, LxdConfig, GitConfig, ResourceClass, TemplateConfig
+from piper_lxd.models import git, lxd, metrics
 from piper_lxd.models.job import Job, RequestJobStatus, ResponseJobStatus
-from piper_lxd.models.errors import PStopException, PConnectionException, PScriptException
+from piper_lxd.models.errors import PStopException, PConnectionException, PScriptException, PCloneException
 
 
 LOG = logging.getLogger('piper-lxd')
@@ -26,10 +35,11 @@ def _catch(func):
             func(*args, **kwargs)
         except PConnectionException as e:
             LOG.error(str(e))
-        except PScriptException as e:
-            self._report_status(self._job.secret, RequestJobStatus.ERROR)
+        except (PScriptException, PCloneException) as e:
+            self._report_status(RequestJobStatus.ERROR)
             LOG.error(str(e))
         except PStopException:
+            metrics.JOBS.inc(status='STOPPED')
             LOG.debug('Received status != ResponseJobStatus.OK from PiperCore, stopping container')
 
     return wrapped
@@ -37,36 +47,173 @@ def _catch(func):
 
 class Executor(multiprocessing.Process):
 
-    def __init__(self, connection: Connection, interval: timedelta, lxd_config: LxdConfig, job: Job, **kwargs) -> None:
-        cert = (str(lxd_config.cert.expanduser()), str(lxd_config.key.expanduser()))
-        self._client = pylxd.Client(cert=cert, endpoint=lxd_config.endpoint, verify=lxd_config.verify)
+    def __init__(self, connection: Connection, interval: timedelta, lxd_config: LxdConfig, job: Job, *,
+                 git_config: Optional[GitConfig]=None, container: Optional[str]=None,
+                 templates: Optional[List[TemplateConfig]]=None, state_dir: Optional[Path]=None,
+                 client: Optional[pylxd.Client]=None, flush_size: int=Script.FLUSH_SIZE,
+                 flush_latency: timedelta=Script.FLUSH_LATENCY, log_compression: Optional[str]=None,
+                 log_spool: int=64 * 1024 * 1024, buffer_memory: int=Script.BUFFER_MEMORY,
+                 buffer_size: int=Script.BUFFER_SIZE, log_format: str='raw',
+                 events: Optional[EventListener]=None, images: Optional[ImageManager]=None,
+                 cache_config: Optional[CacheConfig]=None, resources: Optional[ResourceClass]=None,
+                 janitor: Optional[Janitor]=None, journal: Optional[Journal]=None, acquired: Optional[float]=None,
+                 **kwargs) -> None:
+        # connects in `run`, a forked process must not share connections with the parent
+        self._client = client
         self._lxd_config = lxd_config
+        if git_config is None:
+            git_config = GitConfig(cache=None, cache_size=0, strategy=git.CloneStrategy.FULL, sparse=[], jobs=1)
+        self._git_config = git_config
+        self._git_cache = None  # type: Optional[git.MirrorCache]
+        if git_config.cache is not None:
+            self._git_cache = git.MirrorCache(git_config.cache, git_config.cache_size)
+        self._cache = None  # type: Optional[DependencyCache]
+        if cache_config is not None and cache_config.path is not None:
+            self._cache = DependencyCache(cache_config.path, cache_config.size)
+        self._container = container
+        self._state_dir = state_dir if state_dir is not None else Path(tempfile.gettempdir()) / 'piper-lxd'
+        self._template_configs = templates
+        self._templates = None  # type: Optional[TemplateManager]
         self._job = job
         self._interval = interval
+        self._flush_size = flush_size
+        self._flush_latency = flush_latency
+        self._log_compression = log_compression
+        self._log_spool = log_spool
+        self._buffer_memory = buffer_memory
+        self._buffer_size = buffer_size
+        self._log_format = log_format
+        self._events = events
+        self._images = images
+        self._resources = resources
+        self._janitor = janitor
+        self._journal = journal
         self._connection = connection
+        # Job waits in the queue of the runner before its Executor is created
+        self._acquired = acquired if acquired is not None else time.monotonic()
         super().__init__(**kwargs)
 
-    @_catch
+    @property
+    def endpoint(self) -> str:
+        """
+        LXD host the job runs on.
+        """
+        return self._lxd_config.endpoint
+
+    @property
+    def resources(self) -> Optional[ResourceClass]:
+        """
+        Resources reserved for the job on its host, None when the job is not limited.
+        """
+        return self._resources
+
     def run(self) -> None:
-        self._report_status(RequestJobStatus.RUNNING)
+        metrics.QUEUE_WAIT.observe(time.monotonic() - self._acquired)
+        metrics.ACTIVE_SLOTS.inc()
+        try:
+            self._execute()
+        finally:
+            metrics.ACTIVE_SLOTS.dec()
+            if self._journal is not None:
+                self._journal.finish(self._job.secret)
+
+    def _connect(self) -> None:
+        if self._client is None:
+            try:
+                self._client = lxd.client(self._lxd_config)
+            except pylxd.exceptions.ClientConnectionFailed as e:
+                raise PScriptException('Failed to connect to LXD. Raw: ' + str(e))
+        if self._template_configs:
+            lock_dir = self._state_dir / 'templates'
+            self._templates = TemplateManager(self._client, self._lxd_config.profiles, self._template_configs, lock_dir)
+
+    @_catch
+    def _execute(self) -> None:
+        workspace = None  # type: Optional[CacheWorkspace]
+        try:
+            self._report_status(RequestJobStatus.RUNNING)
+            self._connect()
+
+            if self._cache is not None and self._job.cache_key is not None:
+                workspace = self._cache.checkout(self._job.cache_key, self._job.cache_paths)
+                if self._journal is not None:
+                    self._journal.workspace(self._job.secret, workspace.path)
+        except Exception:
+            # pooled container belongs to the Executor until Script takes it over
+            self._discard_container()
+            raise
 
         with tempfile.TemporaryDirectory() as td:
             path = Path(td)
-            git.clone(self._job.origin, self._job.branch, self._job.commit, path)
-
-            with Script(self._job, path, self._client, self._lxd_config.profiles) as script:
-                while script.status == 103:  # running
+            if self._journal is not None:
+                self._journal.workspace(self._job.secret, path)
+            script = Script(
+                self._job, path, self._client, self._lxd_config.profiles, container_name=self._container,
+                templates=self._templates, flush_size=self._flush_size, flush_latency=self._flush_latency,
+                buffer_memory=self._buffer_memory, buffer_size=self._buffer_size, spill_dir=self._state_dir / 'spool',
+                log_format=self._log_format, events=self._events, images=self._images,
+                volumes=workspace.volumes if workspace is not None else None,
+                limits=self._resources.limits if self._resources is not None else None, janitor=self._janitor,
+            )
+            shipper = LogShipper(
+                self._connection, self._job.secret, self._state_dir / 'spool', self._log_spool, self._log_compression,
+                log_format=self._log_format,
+            )
+            # container is provisioned while the repository is being cloned
+            clone = git.CloneTask(
+                self._job.origin, self._job.branch, self._job.commit, path, self._git_cache,
+                strategy=self._git_config.strategy, sparse=self._git_config.sparse, jobs=self._git_config.jobs,
+            )
+            clone.start()
+            try:
+                with script:
+                    with metrics.SCRIPT.time(phase='clone'):
+                        clone.result()
+                    script.start()
+                    while script.running:
+                        output = script.poll(self._interval)
+                        self._check_status(shipper.send(*output, steps=script.steps))
                     output = script.poll(self._interval)
-                    self._report_status(RequestJobStatus.RUNNING, output)
-                output = script.poll(self._interval)
+                    # output of a failed script is needed the most
+                    self._check_status(shipper.send(*output, steps=script.steps))
+                    if shipper.pending or not shipper.reported(script.steps):
+                        self._check_status(shipper.flush(script.steps))
+
+                    if script.status == 200:  # success
+                        if workspace is not None:
+                            workspace.commit()
+                        self._report_status(RequestJobStatus.COMPLETED)
+                    else:
+                        self._report_status(RequestJobStatus.ERROR)
+            finally:
+                clone.cancel()
+                shipper.close()
+                if workspace is not None:
+                    workspace.release()
+
+    def _discard_container(self) -> None:
+        if self._container is None:
+            return
+
+        if self._janitor is not None:
+            self._janitor.discard(self._container)
+            return
 
-                if script.status == 200:  # success
-                    self._report_status(RequestJobStatus.COMPLETED, output)
-                else:
-                    self._report_status(RequestJobStatus.ERROR)
+        try:
+            client = self._client if self._client is not None else lxd.client(self._lxd_config)
+            Janitor.delete(client, [self._container])
+        except pylxd.exceptions.ClientConnectionFailed as e:
+            LOG.warning('Failed to delete pooled LXD container "{}". Raw: {}'.format(self._container, e))
 
     def _report_status(self, status: RequestJobStatus, data=None) -> ResponseJobStatus:
         response = self._connection.report(self._job.secret, status, data)
+        if status is not RequestJobStatus.RUNNING:
+            metrics.JOBS.inc(status=status.value)
+
+        return self._check_status(response)
+
+    @staticmethod
+    def _check_status(response: ResponseJobStatus) -> ResponseJobStatus:
         if response is not ResponseJobStatus.OK:
             raise PStopException
 
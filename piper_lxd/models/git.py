@@ -1,30 +1,374 @@
+import hashlib
+import logging
+import os
+import shutil
+import signal
 import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from enum import Enum
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional
 
+from piper_lxd.models import metrics
 from piper_lxd.models.errors import PCloneException
+from piper_lxd.models.lock import FileLock
 
 
-def clone(origin: str, branch: str, commit: str, destination: Path) -> None:
-    command = ['git', 'clone', '--recursive', '--branch', branch, origin, '.']
-    process = subprocess.Popen(
-        command,
-        cwd=str(destination),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        start_new_session=True,
-    )
-    out, err = process.communicate()
-    if process.returncode != 0:
-        raise PCloneException(err)
+LOG = logging.getLogger('piper-lxd')
+
+# CloneTask of the current thread, its git commands can be killed from other threads
+_local = threading.local()
+
+
+class CloneStrategy(Enum):
+    # whole history of the branch
+    FULL = 'full'
+    # single commit fetched by its SHA
+    SHALLOW = 'shallow'
+    # single commit fetched by its SHA, blobs downloaded lazily for (sparse) checkout only
+    PARTIAL = 'partial'
 
-    command = ['git', 'checkout', '-f', commit]
+
+def _run(command: List[str], cwd: Path) -> str:
+    task = getattr(_local, 'task', None)  # type: Optional[CloneTask]
     process = subprocess.Popen(
         command,
-        cwd=str(destination),
+        cwd=str(cwd),
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         start_new_session=True,
     )
-    out, err = process.communicate()
+    if task is not None:
+        task.track(process)
+    try:
+        out, err = process.communicate()
+    finally:
+        if task is not None:
+            task.track(None)
+
+    if task is not None and task.cancelled:
+        raise PCloneException('Clone was cancelled')
     if process.returncode != 0:
         raise PCloneException(err)
+
+    return out.decode()
+
+
+def _has_commit(repository: Path, commit: str) -> bool:
+    try:
+        _run(['git', 'cat-file', '-e', commit + '^{commit}'], repository)
+    except PCloneException:
+        return False
+
+    return True
+
+
+def _jobs(jobs: int) -> List[str]:
+    # parallel submodule fetching requires git >= 2.9
+    return ['--jobs', str(jobs)] if jobs > 1 else []
+
+
+def directory_size(path: Path) -> int:
+    size = 0
+    for root, dirs, files in os.walk(str(path)):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+
+    return size
+
+
+class MirrorCache:
+    """
+    Persistent cache of bare mirrors, one per origin URL (submodule URLs included).
+
+    A mirror is updated with an incremental fetch under an exclusive per-origin lock, so concurrent Executors
+    wait for a single fetch instead of racing. Workdirs are cloned from the mirror locally (objects are hardlinked
+    when the cache lives on the same filesystem) and do not depend on the mirror afterwards, which keeps them usable
+    inside the container. Least recently used mirrors are evicted once the cache exceeds `max_size` bytes.
+    """
+
+    _MIRROR_SUFFIX = '.git'
+
+    _LOCK_SUFFIX = '.lock'
+
+    def __init__(self, path: Path, max_size: int) -> None:
+        self._path = path
+        self._max_size = max_size
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @contextmanager
+    def mirror(self, origin: str, commit: str) -> Iterator[Path]:
+        """
+        Yields path to a mirror of `origin` containing `commit`. The mirror is protected from eviction
+        until the context is left.
+
+        :raises PCloneException:
+        """
+        self._path.mkdir(parents=True, exist_ok=True)
+        key = hashlib.sha1(origin.encode()).hexdigest()
+        mirror = self._path / (key + self._MIRROR_SUFFIX)
+        lock = FileLock(self._path / (key + self._LOCK_SUFFIX))
+
+        requested = time.time()
+        lock.acquire()
+        try:
+            if not mirror.exists():
+                self._create(origin, mirror)
+            elif not _has_commit(mirror, commit):
+                self._update(origin, mirror, requested)
+            os.utime(str(mirror))
+        finally:
+            lock.release()
+
+        # eviction needs an exclusive lock, shared one keeps the mirror alive while it is being cloned
+        lock.acquire(shared=True)
+        try:
+            yield mirror
+        finally:
+            lock.release()
+
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes least recently used mirrors until the cache fits into its size budget. Mirrors that are in use
+        are skipped.
+        """
+        mirrors = [(p, p.stat().st_mtime, directory_size(p)) for p in self._path.glob('*' + self._MIRROR_SUFFIX)]
+        total = sum(size for _, _, size in mirrors)
+
+        for mirror, _, size in sorted(mirrors, key=lambda x: x[1]):
+            if total <= self._max_size:
+                break
+
+            lock = FileLock(mirror.with_suffix(self._LOCK_SUFFIX))
+            if not lock.acquire(blocking=False):
+                continue
+
+            try:
+                LOG.debug('Evicting git mirror {} ({} bytes)'.format(mirror, size))
+                shutil.rmtree(str(mirror), ignore_errors=True)
+                total -= size
+            finally:
+                lock.release()
+
+    def _create(self, origin: str, mirror: Path) -> None:
+        LOG.debug('Creating git mirror of {}'.format(origin))
+        # clone into temporary name so an interrupted clone never looks like a valid mirror
+        tmp = mirror.with_name('.{}.tmp'.format(uuid.uuid4().hex))
+        try:
+            _run(['git', 'clone', '--mirror', origin, str(tmp)], self._path)
+            tmp.rename(mirror)
+        finally:
+            if tmp.exists():
+                shutil.rmtree(str(tmp), ignore_errors=True)
+
+    def _update(self, origin: str, mirror: Path, requested: float) -> None:
+        fetch_head = mirror / 'FETCH_HEAD'
+        if fetch_head.exists() and fetch_head.stat().st_mtime >= requested:
+            # someone else fetched while we were waiting for the lock
+            return
+
+        LOG.debug('Updating git mirror of {}'.format(origin))
+        _run(['git', 'fetch', '--prune', 'origin'], mirror)
+
+
+def clone(origin: str, branch: str, commit: str, destination: Path, cache: Optional[MirrorCache]=None,
+          strategy: CloneStrategy=CloneStrategy.FULL, sparse: Optional[List[str]]=None, jobs: int=1) -> None:
+    """
+    Clones `commit` of `origin` into `destination` with its submodules.
+
+    When `cache` is given, repository is cloned from a local mirror and `strategy` is ignored. Shallow and partial
+    strategies fall back to full clone if `origin` refuses fetching by commit SHA. `sparse` limits checked out paths
+    of partial clone, `jobs` is number of submodules fetched in parallel.
+
+    :raises PCloneException:
+    """
+    started = time.monotonic()
+    if cache is not None:
+        _clone_cached(origin, branch, commit, destination, cache)
+        strategy_used = 'cache'
+    elif strategy is not CloneStrategy.FULL and _clone_shallow(origin, commit, destination, strategy, sparse, jobs):
+        strategy_used = strategy.value
+    else:
+        _clone_full(origin, branch, commit, destination, jobs)
+        strategy_used = CloneStrategy.FULL.value
+
+    elapsed = time.monotonic() - started
+    metrics.CLONE.observe(elapsed, strategy=strategy_used)
+    LOG.info('Cloned {} at {} ({}) in {:.2f}s, {} bytes in .git'.format(
+        origin, commit, strategy_used, elapsed, directory_size(destination / '.git')
+    ))
+
+
+def _clone_full(origin: str, branch: str, commit: str, destination: Path, jobs: int) -> None:
+    _run(['git', 'clone', '--recursive'] + _jobs(jobs) + ['--branch', branch, origin, '.'], destination)
+    _run(['git', 'checkout', '-f', commit], destination)
+
+
+def _clone_shallow(origin: str, commit: str, destination: Path, strategy: CloneStrategy,
+                   sparse: Optional[List[str]], jobs: int) -> bool:
+    """
+    Fetches only `commit` into `destination`, returns False if `origin` refused it. `destination` is left empty
+    in that case.
+    """
+    _run(['git', 'init'], destination)
+    _run(['git', 'remote', 'add', 'origin', origin], destination)
+
+    command = ['git', 'fetch', '--depth=1']
+    if strategy is CloneStrategy.PARTIAL:
+        command.append('--filter=blob:none')
+    try:
+        _run(command + ['origin', commit], destination)
+    except PCloneException as e:
+        LOG.warning('Fetching commit {} from {} failed, falling back to full clone: {}'.format(commit, origin, e))
+        shutil.rmtree(str(destination / '.git'))
+        return False
+
+    if strategy is CloneStrategy.PARTIAL and sparse:
+        _run(['git', 'config', 'core.sparseCheckout', 'true'], destination)
+        (destination / '.git' / 'info').mkdir(exist_ok=True)
+        (destination / '.git' / 'info' / 'sparse-checkout').write_text('\n'.join(sparse) + '\n')
+
+    _run(['git', 'checkout', '-f', 'FETCH_HEAD'], destination)
+
+    command = ['git', 'submodule', 'update', '--init', '--recursive'] + _jobs(jobs)
+    try:
+        _run(command + ['--depth=1'], destination)
+    except PCloneException as e:
+        LOG.warning('Shallow submodule update of {} failed, fetching full history: {}'.format(origin, e))
+        _run(command, destination)
+
+    return True
+
+
+def _clone_cached(origin: str, branch: str, commit: str, destination: Path, cache: MirrorCache) -> None:
+    with cache.mirror(origin, commit) as mirror:
+        _run(['git', 'clone', '--no-checkout', '--branch', branch, str(mirror), '.'], destination)
+    _run(['git', 'remote', 'set-url', 'origin', origin], destination)
+    _run(['git', 'checkout', '-f', commit], destination)
+    _update_submodules(destination, cache)
+
+
+def _submodules(repository: Path) -> Dict[str, str]:
+    """
+    Returns mapping of submodule name to its path in `repository`.
+    """
+    if not (repository / '.gitmodules').exists():
+        return {}
+
+    try:
+        out = _run(['git', 'config', '-f', '.gitmodules', '--get-regexp', r'^submodule\..*\.path$'], repository)
+    except PCloneException:
+        # no submodule has path configured
+        return {}
+
+    submodules = dict()
+    for line in out.splitlines():
+        key, path = line.split(' ', 1)
+        submodules[key[len('submodule.'):-len('.path')]] = path
+
+    return submodules
+
+
+def _update_submodules(repository: Path, cache: MirrorCache) -> None:
+    submodules = _submodules(repository)
+    if not submodules:
+        return
+
+    # resolves relative URLs against the origin
+    _run(['git', 'submodule', 'init'], repository)
+
+    for name, path in submodules.items():
+        url_key = 'submodule.{}.url'.format(name)
+        url = _run(['git', 'config', '--get', url_key], repository).strip()
+        commit = _run(['git', 'rev-parse', 'HEAD:' + path], repository).strip()
+
+        with cache.mirror(url, commit) as mirror:
+            _run(['git', 'config', url_key, str(mirror)], repository)
+            try:
+                command = ['git', '-c', 'protocol.file.allow=always', 'submodule', 'update', '--', path]
+                _run(command, repository)
+            finally:
+                _run(['git', 'config', url_key, url], repository)
+
+        _run(['git', 'remote', 'set-url', 'origin', url], repository / path)
+        _update_submodules(repository / path, cache)
+
+
+class CloneTask:
+    """
+    `clone` running in a background thread, so the container can be provisioned in the meantime.
+
+    `cancel` kills the git command being run (with its process group), the clone then fails with PCloneException.
+    """
+
+    def __init__(self, origin: str, branch: str, commit: str, destination: Path, cache: Optional[MirrorCache]=None,
+                 strategy: CloneStrategy=CloneStrategy.FULL, sparse: Optional[List[str]]=None, jobs: int=1) -> None:
+        self._args = (origin, branch, commit, destination, cache, strategy, sparse, jobs)
+        self._thread = threading.Thread(target=self._clone, name='clone', daemon=True)
+        self._lock = threading.Lock()
+        self._process = None  # type: Optional[subprocess.Popen]
+        self._error = None  # type: Optional[Exception]
+        self.cancelled = False
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def result(self) -> None:
+        """
+        Waits for the clone to finish.
+
+        :raises PCloneException:
+        """
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def cancel(self) -> None:
+        """
+        Stops the clone and waits for its thread, does nothing if the clone already finished.
+        """
+        with self._lock:
+            self.cancelled = True
+            self._kill()
+
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def track(self, process: Optional[subprocess.Popen]) -> None:
+        with self._lock:
+            self._process = process
+            if self.cancelled:
+                self._kill()
+
+    def _kill(self) -> None:
+        if self._process is None or self._process.poll() is not None:
+            return
+
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _clone(self) -> None:
+        _local.task = self
+        try:
+            clone(*self._args)
+        except Exception as e:
+            self._error = e
+        finally:
+            _local.task = None
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import pylxd
+import requests
+from pylxd.exceptions import ClientConnectionFailed, LXDAPIException, NotFound
+
+from piper_lxd.models import lxd
+from piper_lxd.models.config import ImageConfig, LxdConfig
+from piper_lxd.models.job import lxd_source
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class ImageManager:
+    """
+    Keeps images used by Jobs present on the LXD host, so no Job waits for an image download.
+
+    Every `ImageConfig.refresh` (and soon after an image is used for the first time) a background thread pulls used
+    and pinned images from `ImageConfig.server` (LXD downloads only new fingerprints) and points the local alias to
+    them. Images fetched this way are evicted least recently used first once they exceed `ImageConfig.budget` bytes,
+    pinned images and images used since the last refresh are kept.
+
+    `source` only reads what the thread found out, it never talks to LXD.
+    """
+
+    def __init__(self, host: LxdConfig, config: ImageConfig) -> None:
+        if config.server is None:
+            raise ValueError('ImageManager needs ImageConfig.server to pull images from')
+        self._host = host
+        self._config = config
+        self._server = config.server  # type: str
+        self._used = {image: 0.0 for image in config.pinned}  # type: Dict[str, float]
+        self._fingerprints = dict()  # type: Dict[str, str]
+        self._sizes = dict()  # type: Dict[str, int]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='image-manager', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def use(self, image: str) -> None:
+        """
+        Records that a Job of `image` is about to run.
+        """
+        with self._lock:
+            known = image in self._used
+            self._used[image] = time.time()
+        if not known:
+            self._wakeup.set()
+
+    def source(self, image: str) -> Dict[str, str]:
+        """
+        Returns LXD container source of `image`: fingerprint of its pulled image, the remote image until it is pulled.
+        """
+        with self._lock:
+            fingerprint = self._fingerprints.get(image)
+        if fingerprint is not None:
+            return {'type': 'image', 'fingerprint': fingerprint}
+
+        source = lxd_source(image)
+        source.update(mode='pull', server=self._server, protocol=self._config.protocol)
+
+        return source
+
+    def refresh(self) -> None:
+        """
+        :raises ClientConnectionFailed:
+        """
+        client = lxd.client(self._host)
+        with self._lock:
+            images = list(self._used)
+
+        for image in images:
+            if self._stopped.is_set():
+                return
+
+            try:
+                fingerprint = self._pull(client, image)
+            except (LXDAPIException, requests.RequestException, KeyError, ValueError) as e:
+                LOG.warning('Failed to refresh LXD image "{}". Raw: {}'.format(image, e))
+                continue
+
+            with self._lock:
+                self._fingerprints[image] = fingerprint
+
+        self.evict(client)
+
+    def evict(self, client: pylxd.Client) -> None:
+        """
+        Deletes least recently used images fetched by the manager until they fit into the budget.
+        """
+        hot_since = time.time() - self._config.refresh.total_seconds()
+        with self._lock:
+            fetched = [(image, self._used.get(image, 0.0)) for image in self._sizes]
+            total = sum(self._sizes.values())
+
+        for image, used in sorted(fetched, key=lambda x: x[1]):
+            if total <= self._config.budget:
+                break
+            if image in self._config.pinned or used >= hot_since:
+                continue
+
+            with self._lock:
+                fingerprint = self._fingerprints.pop(image, None)
+                size = self._sizes.pop(image)
+                self._used.pop(image, None)
+            total -= size
+            if fingerprint is None:
+                continue
+
+            LOG.info('Evicting LXD image "{}" ({}, {} bytes)'.format(image, fingerprint, size))
+            try:
+                client.images.get(fingerprint).delete(wait=True)
+            except (LXDAPIException, requests.RequestException) as e:
+                LOG.warning('Failed to delete LXD image "{}". Raw: {}'.format(image, e))
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except ClientConnectionFailed as e:
+                LOG.warning('Failed to connect to LXD host {}. Raw: {}'.format(self._host.endpoint, e))
+            except Exception:
+                # refresh is retried next time
+                LOG.exception('Refresh of LXD images failed')
+            self._wakeup.wait(self._config.refresh.total_seconds())
+
+    def _pull(self, client: pylxd.Client, image: str) -> str:
+        """
+        Pulls `image` from the server and points the local alias to it, returns its fingerprint. Image the alias
+        pointed to before is deleted.
+        """
+        source = lxd_source(image)
+        current = self._resolve(client, image)
+        source.update(mode='pull', server=self._server, protocol=self._config.protocol)
+        started = time.monotonic()
+        response = client.api.images.post(json={'source': source})
+        operation = client.operations.wait_for_operation(response.json()['operation'])
+        fingerprint = operation.metadata['fingerprint']
+        fetched = client.images.get(fingerprint)
+        with self._lock:
+            self._sizes[image] = fetched.size
+
+        if fingerprint == current:
+            return fingerprint
+
+        LOG.info('Fetched LXD image "{}" ({}) in {:.2f}s'.format(image, fingerprint, time.monotonic() - started))
+        if 'alias' in source:
+            self._point_alias(client, source['alias'], fingerprint, current is not None)
+        if current is not None:
+            try:
+                outdated = client.images.get(current)
+                if not outdated.aliases:
+                    outdated.delete(wait=True)
+            except (LXDAPIException, requests.RequestException) as e:
+                LOG.warning('Failed to delete outdated LXD image {}. Raw: {}'.format(current, e))
+
+        return fingerprint
+
+    def _resolve(self, client: pylxd.Client, image: str) -> Optional[str]:
+        """
+        Returns fingerprint of local `image`, None if it is not present.
+        """
+        source = lxd_source(image)
+        try:
+            if 'fingerprint' in source:
+                return client.images.get(source['fingerprint']).fingerprint
+
+            return client.images.get_by_alias(source['alias']).fingerprint
+        except NotFound:
+            return None
+
+    @staticmethod
+    def _point_alias(client: pylxd.Client, alias: str, fingerprint: str, exists: bool) -> None:
+        if exists:
+            client.api.images.aliases[alias].put(json={'target': fingerprint, 'description': ''})
+        else:
+            client.api.images.aliases.post(json={'name': alias, 'target': fingerprint, 'description': ''})
@@ -0,0 +1,137 @@
+import logging
+import multiprocessing
+import queue
+import threading
+from typing import List, Optional
+
+import pylxd
+import requests
+from pylxd.exceptions import ClientConnectionFailed, LXDAPIException
+
+from piper_lxd.models import lxd, metrics
+from piper_lxd.models.config import LxdConfig
+from piper_lxd.models.journal import Journal
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class Janitor:
+    """
+    Deletes containers of finished Jobs in a background thread, so a Job does not wait for its container to stop
+    and its slot is free right away.
+
+    Containers handed over meanwhile are deleted in one batch: stopped (forcibly, the Job is over) and then deleted
+    all at once, LXD runs operations of different containers concurrently. The queue is shared with forked Executor
+    processes, so the thread runs in the runner process only.
+
+    With a `journal`, containers are recorded there from `track` until they are deleted, so containers of a dead
+    runner are deleted by `Reaper` of the next one.
+    """
+
+    BATCH = 32
+
+    def __init__(self, host: LxdConfig, journal: Optional[Journal]=None) -> None:
+        self._host = host
+        self._journal = journal
+        self._queue = multiprocessing.Queue()  # type: multiprocessing.Queue
+        self._thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Deletes containers handed over so far and stops the thread.
+        """
+        self._queue.put(None)
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def track(self, name: str, secret: Optional[str]=None) -> None:
+        """
+        Records container `name` (of Job `secret`) before it is created.
+        """
+        if self._journal is not None:
+            self._journal.track(name, self._host.endpoint, secret)
+
+    def untrack(self, name: str) -> None:
+        """
+        Forgets container `name` that was deleted by someone else.
+        """
+        if self._journal is not None:
+            self._journal.forget([name])
+
+    def discard(self, name: str) -> None:
+        """
+        Hands container `name` over for deletion.
+        """
+        self._queue.put(name)
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            names = [self._queue.get()]
+            while len(names) < self.BATCH:
+                try:
+                    names.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in names:
+                stopped = True
+                names = [name for name in names if name is not None]
+            if not names:
+                continue
+
+            try:
+                gone = self.delete(lxd.client(self._host), names)
+                if self._journal is not None:
+                    self._journal.forget(gone)
+            except ClientConnectionFailed as e:
+                LOG.warning('Failed to connect to LXD host {}, containers {} are left behind. Raw: {}'.format(
+                    self._host.endpoint, ', '.join(names), e
+                ))
+            except Exception:
+                LOG.exception('Deleting LXD containers {} failed'.format(', '.join(names)))
+
+    @staticmethod
+    def delete(client: pylxd.Client, names: List[str]) -> List[str]:
+        """
+        Stops and deletes containers `names` concurrently, returns those that are gone (also the ones that did not
+        exist).
+        """
+        with metrics.CONTAINER.time(operation='stop'):
+            Janitor._all(client, names, lambda name: client.api.containers[name].state.put(
+                json={'action': 'stop', 'force': True, 'timeout': -1}
+            ))
+        with metrics.CONTAINER.time(operation='delete'):
+            gone = Janitor._all(client, names, lambda name: client.api.containers[name].delete())
+        LOG.debug('Deleted LXD containers {}'.format(', '.join(gone)))
+
+        return gone
+
+    @staticmethod
+    def _all(client: pylxd.Client, names: List[str], request) -> List[str]:
+        """
+        Sends `request` for every container and waits for all operations, returns containers LXD answered for.
+        """
+        answered = list()
+        operations = list()
+        for name in names:
+            try:
+                operations.append((name, request(name).json()['operation']))
+            except LXDAPIException as e:
+                # stop of already stopped container fails, so does anything on a missing one
+                LOG.debug('LXD request for container "{}" failed. Raw: {}'.format(name, e))
+                answered.append(name)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                LOG.warning('LXD request for container "{}" failed. Raw: {}'.format(name, e))
+
+        for name, operation in operations:
+            try:
+                client.operations.wait_for_operation(operation)
+                answered.append(name)
+            except (LXDAPIException, requests.RequestException) as e:
+                LOG.warning('LXD operation on container "{}" failed. Raw: {}'.format(name, e))
+
+        return answered
@@ -19,26 +19,28 @@ class RequestJobStatus(Enum):
     ERROR = 'ERROR'
 
 
+def lxd_source(image: str) -> Dict[str, str]:
+    """
+    Returns LXD container source of `image` given either as alias or as "fingerprint:<fingerprint>".
+    """
+    if image.startswith('fingerprint:'):
+        return {
+            'type': 'image',
+            'fingerprint': image[len('fingerprint:'):]
+        }
+
+    return {
+        'type': 'image',
+        'alias': image
+    }
+
+
 class Job:
 
     COMMAND_PREFIX = 'piper'
 
     COMMAND_CWD = 'cd "{}"'
 
-    COMMAND_WAIT_FOR_NETWORK = '\n'.join([
-        'i=1; d=0',
-        'while [ $i -le 300 ]; do',
-        'i=$(($i + 1))',
-        'if [ -z "$(ip route get 8.8.8.8 2>/dev/null | grep -v unreachable)" ]; then',
-        'sleep 0.1; continue',
-        'fi',
-        'd=1; break;',
-        'done',
-        'if [ $d -eq 0 ]; then',
-        'exit 1',
-        'fi',
-    ])
-
     COMMAND_FIRST = 'PIPER_GLOB_EXIT=0'
 
     COMMAND_START = '\n'.join([
@@ -74,9 +76,14 @@ class Job:
         'fi;',
     ])
 
-    def __init__(self, job: Dict[str, Any]) -> None:
-        validator = Validator(source_data=job, schema_data=schemas.job)
-        validator.validate()
+    def __init__(self, job: Dict[str, Any], validate: bool=True) -> None:
+        """
+        :param validate: False if `job` was already validated (e.g. in a batch)
+        :raises pykwalify.errors.SchemaError:
+        """
+        if validate:
+            validator = Validator(source_data=job, schema_data=schemas.job)
+            validator.validate()
 
         self._secret = job['secret']
         self._after_failure = job['after_failure'] if 'after_failure' in job else []
@@ -88,6 +95,10 @@ class Job:
         self._commit = job['repository']['commit']
         self._cwd = '/piper'
         self._private_key = Path(job['repository']['private_key']) if 'private_key' in job['repository'] else None
+        self._cache_key = job['cache']['key'] if 'cache' in job else None
+        self._cache_paths = job['cache']['paths'] if 'cache' in job else []
+        self._resources = job['resources'] if 'resources' in job else None
+        self._priority = job['priority'] if 'priority' in job else 0
 
         self._env = {k: str(v) for k, v in self._env.items()}
 
@@ -124,23 +135,38 @@ class Job:
         return self._private_key
 
     @property
-    def lxd_source(self) -> Dict[str, str]:
-        if self.image.startswith('fingerprint:'):
-            return {
-                'type': 'image',
-                'fingerprint': self.image[len('fingerprint:'):]
-            }
+    def cache_key(self) -> Optional[str]:
+        return self._cache_key
 
-        return {
-            'type': 'image',
-            'alias': self.image
-        }
+    @property
+    def cache_paths(self) -> List[str]:
+        """
+        Container paths persisted between Jobs with the same `cache_key`.
+        """
+        return self._cache_paths
+
+    @property
+    def resources(self) -> Optional[str]:
+        """
+        Name of the resource class (see `ResourceConfig`) the Job asked for.
+        """
+        return self._resources
+
+    @property
+    def priority(self) -> int:
+        """
+        Jobs with higher priority are started first.
+        """
+        return self._priority
+
+    @property
+    def lxd_source(self) -> Dict[str, str]:
+        return lxd_source(self.image)
 
     @property
     def script(self) -> str:
         script = list()
         script.append(self.COMMAND_CWD.format(self._cwd))
-        script.append(self.COMMAND_WAIT_FOR_NETWORK)
 
         script.append(self.COMMAND_FIRST)
 
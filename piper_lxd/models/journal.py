@@ -0,0 +1,97 @@
+import contextlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+JournalJob = NamedTuple('JournalJob', [('secret', str), ('workspaces', List[Path])])
+
+JournalContainer = NamedTuple('JournalContainer', [('name', str), ('endpoint', str), ('secret', Optional[str])])
+
+
+class Journal:
+    """
+    Jobs acquired by the runner and containers it created, persisted in SQLite, so a runner (or Executor process)
+    that died does not leak them. Jobs are recorded before they start with directories they create on the host,
+    containers before they are created; both are removed once they are cleaned up.
+
+    Every call opens its own connection, so the journal is shared by threads and forked Executor processes.
+    """
+
+    TIMEOUT = 30
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._db() as db:
+            # readers do not block writers of other processes
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'secret TEXT PRIMARY KEY, workspaces TEXT NOT NULL, started REAL NOT NULL)'
+            )
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS containers (name TEXT PRIMARY KEY, endpoint TEXT NOT NULL, secret TEXT)'
+            )
+
+    def begin(self, secret: str) -> None:
+        with self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO jobs (secret, workspaces, started) VALUES (?, ?, ?)',
+                (secret, '[]', time.time()),
+            )
+
+    def workspace(self, secret: str, path: Path) -> None:
+        """
+        Records directory `path` of Job `secret`, deleted when the Job is interrupted.
+        """
+        with self._db() as db:
+            row = db.execute('SELECT workspaces FROM jobs WHERE secret = ?', (secret,)).fetchone()
+            if row is None:
+                return
+            workspaces = json.loads(row[0]) + [str(path)]
+            db.execute('UPDATE jobs SET workspaces = ? WHERE secret = ?', (json.dumps(workspaces), secret))
+
+    def finish(self, secret: str) -> None:
+        with self._db() as db:
+            db.execute('DELETE FROM jobs WHERE secret = ?', (secret,))
+
+    def jobs(self) -> List[JournalJob]:
+        with self._db() as db:
+            rows = db.execute('SELECT secret, workspaces FROM jobs ORDER BY started').fetchall()
+
+        return [JournalJob(secret, [Path(p) for p in json.loads(workspaces)]) for secret, workspaces in rows]
+
+    def track(self, name: str, endpoint: str, secret: Optional[str]=None) -> None:
+        """
+        Records container `name` on LXD host `endpoint`, belonging to Job `secret` if it is given.
+        """
+        with self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO containers (name, endpoint, secret) VALUES (?, ?, ?)', (name, endpoint, secret)
+            )
+
+    def forget(self, names: List[str]) -> None:
+        with self._db() as db:
+            db.executemany('DELETE FROM containers WHERE name = ?', [(name,) for name in names])
+
+    def containers(self) -> List[JournalContainer]:
+        with self._db() as db:
+            rows = db.execute('SELECT name, endpoint, secret FROM containers').fetchall()
+
+        return [JournalContainer(*row) for row in rows]
+
+    @contextlib.contextmanager
+    def _db(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(str(self._path), timeout=self.TIMEOUT)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
@@ -0,0 +1,48 @@
+import fcntl
+from pathlib import Path
+from typing import Optional, IO
+
+
+class FileLock:
+    """
+    Advisory lock backed by flock(2), shared between processes using the same lock file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._file = None  # type: Optional[IO[str]]
+
+    def acquire(self, shared: bool=False, blocking: bool=True) -> bool:
+        """
+        Acquires the lock, returns False if it is held by someone else and `blocking` is False.
+        """
+        if self._file is None:
+            self._file = open(str(self._path), 'a')
+
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+
+        try:
+            fcntl.flock(self._file, operation)
+        except BlockingIOError:
+            self._file.close()
+            self._file = None
+            return False
+
+        return True
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -0,0 +1,238 @@
+import gzip
+import json
+import logging
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING, Union
+
+from piper_lxd.models import metrics
+from piper_lxd.models.errors import PConnectionException, PConnectionInvalidResponseError
+from piper_lxd.models.job import RequestJobStatus, ResponseJobStatus
+from piper_lxd.models.steps import Step
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if TYPE_CHECKING:
+    from piper_lxd.models.connection import Connection
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class LogRecord:
+    """
+    Output received from one stream of a Job command in "framed" log format. Serialized as a header of stream id,
+    monotonic timestamp in nanoseconds, offset of `data` in output of the stream and its length, followed by `data`.
+    """
+
+    RUNNER = 0
+
+    STDOUT = 1
+
+    STDERR = 2
+
+    HEADER = struct.Struct('!BQQI')
+
+    def __init__(self, stream: int, timestamp: int, offset: int, data: bytes) -> None:
+        self.stream = stream
+        self.timestamp = timestamp
+        self.offset = offset
+        self.data = data
+
+    @classmethod
+    def header(cls, stream: int, timestamp: int, offset: int, length: int) -> bytes:
+        return cls.HEADER.pack(stream, timestamp, offset, length)
+
+    @classmethod
+    def parse(cls, data: bytes) -> List['LogRecord']:
+        records = list()
+        position = 0
+        while position < len(data):
+            stream, timestamp, offset, length = cls.HEADER.unpack_from(data, position)
+            position += cls.HEADER.size
+            records.append(cls(stream, timestamp, offset, data[position:position + length]))
+            position += length
+
+        return records
+
+
+class LogChunk:
+    """
+    Part of Job output starting at byte `offset` of the whole output, `data` is compressed with `encoding`.
+    Output is plain text in "raw" `log_format`, LogRecords in "framed" format.
+    """
+
+    def __init__(self, data: bytes, offset: int, length: int, sequence: int, encoding: Optional[str],
+                 log_format: str='raw') -> None:
+        self.data = data
+        self.offset = offset
+        self.length = length
+        self.sequence = sequence
+        self.encoding = encoding
+        self.log_format = log_format
+
+    def decode(self) -> bytes:
+        if self.encoding == 'gzip':
+            return gzip.decompress(self.data)
+        if self.encoding == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(self.data, max_output_size=self.length)
+
+        return self.data
+
+
+class LogShipper:
+    """
+    Uploads Job output in sequenced, optionally compressed chunks.
+
+    Output is spooled to a file first and removed only after PiperCore acknowledges it. While PiperCore is
+    unreachable the output keeps accumulating (up to `spool_size` bytes) and is sent on the next successful
+    report. If PiperCore acknowledges less than it was sent, upload resumes from the acknowledged offset.
+
+    Only steps that changed since they were reported are sent with a request, at most STEPS_SIZE bytes of them
+    (they travel in a header); the rest follow with next requests.
+    """
+
+    STEPS_SIZE = 4 * 1024
+
+    def __init__(self, connection: 'Connection', secret: str, spool_dir: Path, spool_size: int,
+                 compression: Optional[str]=None, chunk_size: int=1024 * 1024, log_format: str='raw') -> None:
+        if compression == 'zstd' and zstandard is None:
+            LOG.warning('zstandard is not installed, compressing log with gzip')
+            compression = 'gzip'
+
+        self._connection = connection
+        self._secret = secret
+        self._spool_size = spool_size
+        self._compression = compression
+        self._chunk_size = chunk_size
+        self._log_format = log_format
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        self._spool = tempfile.TemporaryFile(dir=str(spool_dir))
+        # spool contains output from offset `_base` up to `_written`
+        self._base = 0
+        self._written = 0
+        self._acknowledged = 0
+        self._sequence = 0
+        # last reported state of every step
+        self._steps = dict()  # type: Dict[Tuple[str, int], Dict[str, Any]]
+
+    @property
+    def pending(self) -> int:
+        return self._written - self._acknowledged
+
+    def reported(self, steps: List[Step]) -> bool:
+        """
+        Returns True if current state of all `steps` was reported.
+        """
+        return not self._changed(steps)
+
+    def send(self, *segments: Union[bytes, memoryview], steps: Optional[List[Step]]=None) -> ResponseJobStatus:
+        """
+        Spools `segments` and uploads everything that was not acknowledged yet, reporting current `steps`. With
+        nothing to upload, just reports that the Job is running. Failed upload is retried on next call.
+
+        :raises PConnectionException: when PiperCore is unreachable and the spool is full
+        """
+        self._spool.seek(0, 2)
+        size = 0
+        for segment in segments:
+            self._spool.write(segment)
+            size += len(segment)
+        self._written += size
+        metrics.OUTPUT_BYTES.inc(size)
+
+        try:
+            return self.flush(steps)
+        except PConnectionException as e:
+            if self.pending > self._spool_size:
+                raise PConnectionException('Log spool is full, {} bytes were not delivered'.format(self.pending))
+
+            LOG.warning('Log upload failed, {} bytes spooled: {}'.format(self.pending, e))
+            return ResponseJobStatus.OK
+
+    def flush(self, steps: Optional[List[Step]]=None) -> ResponseJobStatus:
+        """
+        Uploads all spooled output and all changed `steps`.
+
+        :raises PConnectionException:
+        """
+        changed = self._changed(steps)
+        uploaded = self.pending > 0
+        while self.pending > 0:
+            chunk = self._chunk()
+            status, acknowledged = self._connection.report_chunk(
+                self._secret, RequestJobStatus.RUNNING, chunk, steps=[step for step, _ in changed]
+            )
+            self._sequence += 1
+            self._reported(changed)
+            metrics.UPLOADED_BYTES.inc(len(chunk.data))
+            if status is not ResponseJobStatus.OK:
+                return status
+
+            if acknowledged is None:
+                acknowledged = chunk.offset + chunk.length
+            if acknowledged <= self._acknowledged:
+                raise PConnectionInvalidResponseError('PiperCore did not acknowledge any output')
+            self._acknowledged = min(acknowledged, self._written)
+            changed = self._changed(steps)
+
+        self._compact()
+
+        # with no output the Job is just reported running, steps that did not fit follow in the same way
+        while changed or not uploaded:
+            uploaded = True
+            status = self._connection.report(
+                self._secret, RequestJobStatus.RUNNING, steps=[step for step, _ in changed]
+            )
+            self._reported(changed)
+            if status is not ResponseJobStatus.OK:
+                return status
+            changed = self._changed(steps)
+
+        return ResponseJobStatus.OK
+
+    def close(self) -> None:
+        self._spool.close()
+
+    def _changed(self, steps: Optional[List[Step]]) -> List[Tuple[Step, Dict[str, Any]]]:
+        """
+        Returns steps changed since they were reported with their current state, as many as fit STEPS_SIZE.
+        """
+        changed = list()
+        size = 2
+        for step in steps or []:
+            state = step.to_dict()
+            if self._steps.get((step.kind, step.index)) == state:
+                continue
+            size += len(json.dumps(state, separators=(',', ':'))) + 1
+            if size > self.STEPS_SIZE:
+                break
+            changed.append((step, state))
+
+        return changed
+
+    def _reported(self, changed: List[Tuple[Step, Dict[str, Any]]]) -> None:
+        for step, state in changed:
+            self._steps[(step.kind, step.index)] = state
+
+    def _chunk(self) -> LogChunk:
+        self._spool.seek(self._acknowledged - self._base)
+        data = self._spool.read(self._chunk_size)
+        if self._compression == 'gzip':
+            payload = gzip.compress(data)
+        elif self._compression == 'zstd':
+            payload = zstandard.ZstdCompressor().compress(data)
+        else:
+            payload = data
+
+        return LogChunk(payload, self._acknowledged, len(data), self._sequence, self._compression, self._log_format)
+
+    def _compact(self) -> None:
+        if self.pending == 0:
+            self._spool.seek(0)
+            self._spool.truncate()
+            self._base = self._written
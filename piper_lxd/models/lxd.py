@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Tuple
+
+import pylxd
+import requests.adapters
+from pylxd.models import Container
+
+from piper_lxd.models import metrics
+from piper_lxd.models.config import LxdConfig
+
+
+NETWORK_POLL = timedelta(milliseconds=100)
+
+# pylxd Clients of this process by their endpoint
+_clients = dict()  # type: Dict[Tuple[int, str], pylxd.Client]
+_clients_lock = threading.Lock()
+
+
+def is_unix_socket(endpoint: str) -> bool:
+    return endpoint.startswith('/')
+
+
+def client(config: LxdConfig) -> pylxd.Client:
+    """
+    Returns pylxd Client shared by all jobs of this process, so TLS handshakes and the API probe are paid once
+    and keep-alive connections (up to `config.pool_size`) are reused. Forked process creates its own Client,
+    connections of the parent are never touched.
+
+    Endpoint starting with / is path to the LXD unix socket, cert and key are not used then.
+    """
+    key = (os.getpid(), config.endpoint)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _connect(config)
+
+        return _clients[key]
+
+
+def _connect(config: LxdConfig) -> pylxd.Client:
+    if is_unix_socket(config.endpoint):
+        return pylxd.Client(endpoint=config.endpoint)
+
+    cert = (str(config.cert.expanduser()), str(config.key.expanduser()))
+    lxd_client = pylxd.Client(cert=cert, endpoint=config.endpoint, verify=config.verify)
+    # requests keeps only 10 connections per host by default, the rest is closed after every request
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=config.pool_size)
+    lxd_client.api.session.mount('https://', adapter)
+
+    return lxd_client
+
+
+def has_network(container: Container) -> bool:
+    """
+    Returns True if any non-loopback interface of running `container` has a global address.
+    """
+    network = container.state().network or {}
+    for name, interface in network.items():
+        if name == 'lo':
+            continue
+
+        for address in interface.get('addresses', []):
+            if address.get('scope') == 'global':
+                return True
+
+    return False
+
+
+def wait_for_network(container: Container, timeout: timedelta) -> bool:
+    """
+    Waits until `container` has network configured, returns False on timeout. State is read from LXD, nothing is
+    executed in the container.
+    """
+    started = time.monotonic()
+    deadline = started + timeout.total_seconds()
+    while not has_network(container):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(NETWORK_POLL.total_seconds())
+    metrics.NETWORK.observe(time.monotonic() - started)
+
+    return True
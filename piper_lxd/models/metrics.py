@@ -0,0 +1,290 @@
+import abc
+import logging
+import multiprocessing
+import os
+import socketserver
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class Registry:
+    """
+    Collection of metrics of the runner.
+
+    Once `enable`d, updates made in other processes (forked Executors) are sent over a queue and applied by
+    a collector thread of the enabling process, so the metrics are aggregated over all Executors. Updates made
+    in other processes of a registry that is not enabled are dropped.
+    """
+
+    def __init__(self) -> None:
+        self._metrics = dict()  # type: Dict[str, Metric]
+        self._pid = os.getpid()
+        self._queue = None  # type: Optional[multiprocessing.Queue]
+        self._collector = None  # type: Optional[threading.Thread]
+
+    def register(self, metric: 'Metric') -> None:
+        self._metrics[metric.name] = metric
+
+    def enable(self) -> None:
+        if self._queue is not None:
+            return
+
+        self._pid = os.getpid()
+        queue = multiprocessing.Queue()  # type: multiprocessing.Queue
+        self._queue = queue
+        self._collector = threading.Thread(target=self._collect, args=(queue,), name='metrics-collector', daemon=True)
+        self._collector.start()
+
+    def update(self, name: str, operation: str, labels: Tuple[str, ...], value: float) -> None:
+        if os.getpid() == self._pid:
+            self._metrics[name].apply(operation, labels, value)
+        elif self._queue is not None:
+            self._queue.put((name, operation, labels, value))
+
+    def render(self) -> str:
+        """
+        Returns all metrics in Prometheus text exposition format.
+        """
+        lines = list()  # type: List[str]
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+
+        return '\n'.join(lines) + '\n'
+
+    def _collect(self, queue: multiprocessing.Queue) -> None:
+        while True:
+            try:
+                name, operation, labels, value = queue.get()
+            except (EOFError, OSError):
+                return
+            self._metrics[name].apply(operation, labels, value)
+
+
+REGISTRY = Registry()
+
+
+class Metric(metaclass=abc.ABCMeta):
+
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]=(),
+                 registry: Optional[Registry]=None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = dict()  # type: Dict[Tuple[str, ...], Any]
+        self._lock = threading.Lock()
+        self._registry = registry if registry is not None else REGISTRY
+        self._registry.register(self)
+
+    @abc.abstractmethod
+    def apply(self, operation: str, labels: Tuple[str, ...], value: float) -> None:
+        """
+        Applies `operation` with `value` to the sample of `labels`, in the process serving the metrics.
+        """
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} {}'.format(self.name, self.TYPE),
+        ]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._samples(labels, value))
+
+        return lines
+
+    def _samples(self, labels: Tuple[str, ...], value: Any) -> List[str]:
+        return ['{}{} {}'.format(self.name, self._format_labels(labels), _format_value(value))]
+
+    def _update(self, operation: str, value: float, labels: Dict[str, Any]) -> None:
+        if set(labels) != set(self.labels):
+            raise ValueError('Metric {} expects labels {}, got {}'.format(self.name, self.labels, sorted(labels)))
+        self._registry.update(self.name, operation, tuple(str(labels[label]) for label in self.labels), value)
+
+    def _format_labels(self, labels: Tuple[str, ...], extra: Optional[Tuple[str, str]]=None) -> str:
+        pairs = list(zip(self.labels, labels))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+
+        return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, amount: float=1, **labels: Any) -> None:
+        self._update('inc', amount, labels)
+
+    def apply(self, operation: str, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+
+    TYPE = 'gauge'
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._update('set', value, labels)
+
+    def inc(self, amount: float=1, **labels: Any) -> None:
+        self._update('inc', amount, labels)
+
+    def dec(self, amount: float=1, **labels: Any) -> None:
+        self._update('inc', -amount, labels)
+
+    def apply(self, operation: str, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            if operation == 'set':
+                self._values[labels] = value
+            else:
+                self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str]=(),
+                 buckets: Sequence[float]=BUCKETS, registry: Optional[Registry]=None) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, registry)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        self._update('observe', value, labels)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """
+        Observes how long the block took, also when it raised.
+        """
+        started = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - started, **labels)
+
+    def apply(self, operation: str, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            counts, total, count = self._values.get(labels, ([0] * len(self.buckets), 0.0, 0))
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def _samples(self, labels: Tuple[str, ...], value: Any) -> List[str]:
+        counts, total, count = value
+        samples = list()
+        for bound, bucket in zip(self.buckets, counts):
+            name_labels = self._format_labels(labels, ('le', _format_value(bound)))
+            samples.append('{}_bucket{} {}'.format(self.name, name_labels, bucket))
+        samples.append('{}_bucket{} {}'.format(self.name, self._format_labels(labels, ('le', '+Inf')), count))
+        samples.append('{}_sum{} {}'.format(self.name, self._format_labels(labels), _format_value(total)))
+        samples.append('{}_count{} {}'.format(self.name, self._format_labels(labels), count))
+
+        return samples
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class MetricsServer:
+    """
+    Serves metrics of `registry` on http://`host`:`port`/metrics from a background thread.
+    """
+
+    class _Server(socketserver.ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    def __init__(self, host: str, port: int, registry: Optional[Registry]=None) -> None:
+        # bound for the handler, a closure does not see the narrowed argument
+        served = registry if registry is not None else REGISTRY
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(HTTPStatus.NOT_FOUND)
+                    return
+
+                body = served.render().encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header('content-type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                LOG.debug('Metrics request: ' + format % args)
+
+        self._server = self._Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+JOBS = Counter('piper_jobs_total', 'Jobs finished by the runner, by result.', ['status'])
+
+QUEUE_WAIT = Histogram('piper_queue_wait_seconds', 'Time from acquiring a Job to starting its execution.')
+
+ACTIVE_SLOTS = Gauge('piper_active_slots', 'Jobs being executed.')
+
+SLOTS = Gauge('piper_slots', 'Jobs the runner executes concurrently at most.')
+
+QUEUED = Gauge('piper_queued_jobs', 'Acquired Jobs waiting for a host with free resources.')
+
+CLONE = Histogram('piper_clone_seconds', 'Time to clone a Job repository, by used strategy.', ['strategy'])
+
+CONTAINER = Histogram(
+    'piper_container_seconds', 'Latency of LXD container operations.', ['operation'],
+)
+
+SCRIPT = Histogram(
+    'piper_script_seconds', 'Time spent in Script phases: provision (container running), clone (waiting for '
+    'the repository once the container is running), start (repository attached and command started), exit '
+    '(container removed) and poll (waiting for output).', ['phase'],
+)
+
+NETWORK = Histogram('piper_network_ready_seconds', 'Time from container start until its network is configured.')
+
+CORE_REQUESTS = Histogram('piper_core_request_seconds', 'Round-trip time of PiperCore requests.', ['request'])
+
+CORE_ERRORS = Counter('piper_core_request_errors_total', 'Failed PiperCore requests.', ['request'])
+
+OUTPUT_BYTES = Counter('piper_output_bytes_total', 'Bytes of Job output received from containers and spooled.')
+
+UPLOADED_BYTES = Counter('piper_uploaded_bytes_total', 'Bytes of (compressed) Job output sent to PiperCore.')
+
+STEPS = Histogram(
+    'piper_step_seconds', 'Duration of Job script commands, by kind and result.', ['kind', 'status'],
+)
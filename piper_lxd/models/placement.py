@@ -0,0 +1,173 @@
+import logging
+from datetime import timedelta
+from time import monotonic
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+from pylxd.exceptions import ClientConnectionFailed, LXDAPIException
+
+from piper_lxd.models import lxd
+from piper_lxd.models.config import LxdConfig, ResourceClass
+from piper_lxd.models.executor import Executor
+from piper_lxd.models.job import lxd_source
+from piper_lxd.models.pool import ContainerPool
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class Placement:
+    """
+    Picks LXD host for every Job.
+
+    Job is admitted to hosts with a free slot (less running Jobs than `LxdConfig.capacity`) that have the resources
+    of its class: cores and memory not reserved by running Jobs, and memory actually free on the host (less
+    `reserve` bytes). Host running no Job admits any Job, so classes bigger than the host do not wait forever.
+    Admitting hosts are preferred by image locality: a ready pooled container of the image first, then the image
+    being present on the host. Ties are broken by load, the fraction of used slots plus the fraction of used memory
+    reported by the LXD resources API.
+
+    Resources and image presence are read from LXD at most once per `CACHE_TTL`. Host that could not be connected
+    to has no slots until a later read succeeds.
+    """
+
+    CACHE_TTL = timedelta(seconds=10)
+
+    def __init__(self, hosts: List[LxdConfig], pools: Optional[Dict[str, ContainerPool]]=None,
+                 reserve: int=0) -> None:
+        self._hosts = hosts
+        self._pools = pools if pools is not None else dict()
+        self._reserve = reserve
+        self._resources = dict()  # type: Dict[str, Tuple[float, Optional[Dict[str, Any]]]]
+        self._unreachable = set()  # type: Set[str]
+        self._images = dict()  # type: Dict[Tuple[str, str], Tuple[float, bool]]
+
+    def free(self, running: List[Executor]) -> int:
+        """
+        Returns number of Jobs the hosts can take on top of `running`.
+        """
+        counts = self._counts(running)
+
+        return sum(max(host.capacity - counts.get(host.endpoint, 0), 0) for host in self._reachable())
+
+    def select(self, image: str, running: List[Executor], resources: Optional[ResourceClass]=None) -> \
+            Optional[LxdConfig]:
+        """
+        Returns host for Job of `image` needing `resources`, None when no host admits it now.
+        """
+        counts = self._counts(running)
+        free = [
+            host for host in self._reachable()
+            if counts.get(host.endpoint, 0) < host.capacity and self._fits(host, resources, running)
+        ]
+        if len(free) <= 1:
+            return free[0] if free else None
+
+        host = min(free, key=lambda host: (-self._locality(host, image), self._load(host, counts)))
+        LOG.debug('Placing job of "{}" on LXD host {}'.format(image, host.endpoint))
+
+        return host
+
+    def _reachable(self) -> List[LxdConfig]:
+        for host in self._hosts:
+            # refreshes reachability once the cached resources expire
+            self._host_resources(host)
+
+        return [host for host in self._hosts if host.endpoint not in self._unreachable]
+
+    @staticmethod
+    def _counts(running: List[Executor]) -> Dict[str, int]:
+        counts = dict()  # type: Dict[str, int]
+        for executor in running:
+            counts[executor.endpoint] = counts.get(executor.endpoint, 0) + 1
+
+        return counts
+
+    def _fits(self, host: LxdConfig, resources: Optional[ResourceClass], running: List[Executor]) -> bool:
+        on_host = [e for e in running if e.endpoint == host.endpoint]
+        if resources is None or not on_host:
+            return True
+
+        info = self._host_resources(host)
+        if info is None:
+            # nothing to account against, slots still apply
+            return True
+
+        reserved = [e.resources for e in on_host if e.resources is not None]
+        cpu = sum(r.cpu for r in reserved) + resources.cpu
+        memory = sum(r.memory for r in reserved) + resources.memory
+        available = info['memory']['total'] - info['memory']['used'] - self._reserve
+
+        return cpu <= info['cpu']['total'] and memory <= info['memory']['total'] - self._reserve and \
+            resources.memory <= available
+
+    def _locality(self, host: LxdConfig, image: str) -> int:
+        pool = self._pools.get(host.endpoint)
+        if pool is not None and pool.available(image) > 0:
+            return 2
+
+        return 1 if self._has_image(host, image) else 0
+
+    def _load(self, host: LxdConfig, counts: Dict[str, int]) -> float:
+        return counts.get(host.endpoint, 0) / host.capacity + self._memory_used(host)
+
+    def _memory_used(self, host: LxdConfig) -> float:
+        info = self._host_resources(host)
+        if info is None:
+            # unknown host looks fully loaded, so others are preferred
+            return 1.0
+        memory = info['memory']
+
+        return memory['used'] / memory['total'] if memory['total'] else 0.0
+
+    def _host_resources(self, host: LxdConfig) -> Optional[Dict[str, Any]]:
+        """
+        Returns CPU and memory of `host` as reported by the LXD resources API, None when it is not available.
+        """
+        cached = self._resources.get(host.endpoint)
+        if cached is not None and monotonic() - cached[0] < self.CACHE_TTL.total_seconds():
+            return cached[1]
+
+        info = None
+        reachable = True
+        try:
+            info = lxd.client(host).api.resources.get().json()['metadata']
+            info = {
+                'cpu': {'total': int(info['cpu']['total'])},
+                'memory': {'used': int(info['memory']['used']), 'total': int(info['memory']['total'])},
+            }
+        except (ClientConnectionFailed, requests.ConnectionError, requests.Timeout) as e:
+            LOG.warning('Failed to connect to LXD host {}. Raw: {}'.format(host.endpoint, e))
+            info = None
+            reachable = False
+        except (LXDAPIException, requests.RequestException, KeyError, TypeError, ValueError) as e:
+            LOG.debug('Failed to get resources of LXD host {}. Raw: {}'.format(host.endpoint, e))
+            info = None
+        self._resources[host.endpoint] = (monotonic(), info)
+        if reachable and host.endpoint in self._unreachable:
+            LOG.info('LXD host {} is reachable again'.format(host.endpoint))
+            self._unreachable.discard(host.endpoint)
+        elif not reachable:
+            self._unreachable.add(host.endpoint)
+
+        return info
+
+    def _has_image(self, host: LxdConfig, image: str) -> bool:
+        key = (host.endpoint, image)
+        cached = self._images.get(key)
+        if cached is not None and monotonic() - cached[0] < self.CACHE_TTL.total_seconds():
+            return cached[1]
+
+        source = lxd_source(image)
+        exists = False
+        try:
+            client = lxd.client(host)
+            if 'alias' in source:
+                exists = client.images.exists(source['alias'], alias=True)
+            else:
+                exists = client.images.exists(source['fingerprint'])
+        except (ClientConnectionFailed, LXDAPIException, requests.RequestException) as e:
+            LOG.debug('Failed to look up image "{}" on LXD host {}. Raw: {}'.format(image, host.endpoint, e))
+        self._images[key] = (monotonic(), exists)
+
+        return exists
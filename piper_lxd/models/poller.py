@@ -0,0 +1,85 @@
+import logging
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from piper_lxd.models.backoff import Backoff
+from piper_lxd.models.connection import Connection
+from piper_lxd.models.job import Job
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class JobPoller:
+    """
+    Acquires Jobs from PiperCore.
+
+    With `long_poll`, the fetch request is held by PiperCore until a Job is queued, so it is picked up immediately.
+    PiperCore that answers an empty queue right away `FALLBACK_AFTER` times in a row does not support long polling
+    and the poller falls back to polling with exponential backoff between `interval` and `max_interval`. Long
+    polling is tried again every `PROBE_INTERVAL`, PiperCore may have been upgraded meanwhile.
+    """
+
+    FALLBACK_AFTER = 3
+
+    PROBE_INTERVAL = timedelta(minutes=10)
+
+    def __init__(self, connection: Connection, token: str, interval: timedelta, max_interval: timedelta,
+                 long_poll: Optional[timedelta]=None) -> None:
+        self._connection = connection
+        self._token = token
+        self._long_poll = long_poll
+        self._backoff = Backoff(interval, max_interval)
+        self._fast_answers = 0
+        # monotonic time of the next long polling probe while polling
+        self._probe_at = None  # type: Optional[float]
+        self._waited = False
+
+    @property
+    def long_poll(self) -> bool:
+        return self._long_poll is not None and self._probe_at is None
+
+    def fetch(self, limit: int=1) -> List[Job]:
+        """
+        Acquires up to `limit` Jobs in one request.
+
+        :raises PConnectionException:
+        """
+        if self._probe_at is not None and time.monotonic() >= self._probe_at:
+            LOG.debug('Trying long polling again')
+            self._probe_at = None
+            # single fast answer is enough to fall back again
+            self._fast_answers = self.FALLBACK_AFTER - 1
+
+        self._waited = False
+        wait = self._long_poll if self.long_poll else None
+        if wait is None:
+            jobs = self._connection.fetch_jobs(self._token, limit)
+        else:
+            started = time.monotonic()
+            jobs = self._connection.fetch_jobs(self._token, limit, wait)
+            elapsed = timedelta(seconds=time.monotonic() - started)
+            if not jobs and elapsed < wait / 2:
+                self._fast_answers += 1
+                if self._fast_answers >= self.FALLBACK_AFTER:
+                    LOG.info('PiperCore does not support long polling, falling back to polling')
+                    self._probe_at = time.monotonic() + self.PROBE_INTERVAL.total_seconds()
+            elif not jobs:
+                self._fast_answers = 0
+                self._waited = True
+
+        if jobs:
+            self._backoff.reset()
+
+        return jobs
+
+    def idle(self, failed: bool=False) -> None:
+        """
+        Waits before next fetch after no Job was acquired, `failed` if the fetch raised.
+        """
+        if self._waited and not failed:
+            # the request itself was waiting
+            return
+
+        time.sleep(self._backoff.next().total_seconds())
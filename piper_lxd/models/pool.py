@@ -0,0 +1,153 @@
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import pylxd
+from pylxd.exceptions import LXDAPIException
+
+from piper_lxd.models.config import PoolConfig
+from piper_lxd.models.errors import PScriptException
+from piper_lxd.models.image import ImageManager
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.job import lxd_source
+from piper_lxd.models.lxd import wait_for_network
+from piper_lxd.models.template import TemplateManager
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class ContainerPool:
+    """
+    Keeps pre-created, running containers per image, so Jobs do not wait for image unpacking and boot.
+
+    Pools are refilled in a background thread, at most `PoolConfig.rate` containers per image every `interval`.
+    A claimed container belongs to the Job from then on and is deleted by its Script, the pool replaces it.
+    Containers are pooled only once they have network, so Jobs skip waiting for it.
+    """
+
+    NETWORK_TIMEOUT = timedelta(seconds=30)
+
+    def __init__(self, client: pylxd.Client, profiles: List[str], pools: List[PoolConfig], interval: timedelta,
+                 templates: Optional[TemplateManager]=None, images: Optional[ImageManager]=None,
+                 janitor: Optional[Janitor]=None) -> None:
+        self._client = client
+        self._janitor = janitor
+        self._templates = templates
+        self._images = images
+        self._profiles = profiles
+        self._pools = pools
+        self._interval = interval
+        self._ready = {pool.image: [] for pool in pools}  # type: Dict[str, List[str]]
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='container-pool', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops refilling and deletes all unclaimed containers.
+        """
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+        with self._lock:
+            names = [name for ready in self._ready.values() for name in ready]
+            for ready in self._ready.values():
+                ready.clear()
+
+        if self._janitor is not None:
+            for name in names:
+                self._janitor.discard(name)
+            return
+
+        for name in names:
+            try:
+                container = self._client.containers.get(name)
+                container.stop(wait=True)
+                container.delete()
+            except LXDAPIException as e:
+                LOG.warning('Failed to delete pooled LXD container "{}". Raw: {}'.format(name, e))
+
+    def claim(self, image: str) -> Optional[str]:
+        """
+        Returns name of a running container created from `image` or None if there is none ready.
+        """
+        with self._lock:
+            ready = self._ready.get(image)
+            if not ready:
+                return None
+
+            return ready.pop(0)
+
+    def available(self, image: str) -> int:
+        """
+        Returns number of ready containers created from `image`.
+        """
+        with self._lock:
+            return len(self._ready.get(image, []))
+
+    def refill(self) -> None:
+        for pool in self._pools:
+            with self._lock:
+                missing = pool.size - len(self._ready[pool.image])
+
+            for _ in range(min(missing, pool.rate)):
+                if self._stopped.is_set():
+                    return
+
+                try:
+                    name = self._create(pool.image)
+                except (LXDAPIException, PScriptException) as e:
+                    LOG.warning('Failed to create pooled LXD container from "{}". Raw: {}'.format(pool.image, e))
+                    break
+
+                with self._lock:
+                    self._ready[pool.image].append(name)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self.refill()
+            self._stopped.wait(self._interval.total_seconds())
+
+    def _create(self, image: str) -> str:
+        name = 'piper' + uuid.uuid4().hex
+        if self._janitor is not None:
+            self._janitor.track(name)
+        container_config = {
+            'name': name,
+            'profiles': self._profiles,
+            'source': lxd_source(image),
+        }
+        if self._images is not None:
+            self._images.use(image)
+            container_config['source'] = self._images.source(image)
+        if self._templates is not None and image in self._templates:
+            with self._templates.source(image) as source:
+                container_config['source'] = source
+                container = self._client.containers.create(container_config, wait=True)
+        else:
+            container = self._client.containers.create(container_config, wait=True)
+
+        try:
+            container.start(wait=True)
+            if not wait_for_network(container, self.NETWORK_TIMEOUT):
+                raise PScriptException('Pooled LXD container "{}" did not get network in time'.format(name))
+        except (LXDAPIException, PScriptException):
+            try:
+                container.stop(wait=True)
+            except LXDAPIException:
+                pass
+            container.delete()
+            if self._janitor is not None:
+                self._janitor.untrack(name)
+            raise
+
+        LOG.debug('Pooled LXD container "{}" from "{}" is ready'.format(name, image))
+
+        return name
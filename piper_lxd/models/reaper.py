@@ -0,0 +1,87 @@
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Set
+
+from piper_lxd.models import metrics
+from piper_lxd.models.connection import Connection
+from piper_lxd.models.errors import PConnectionException
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.job import RequestJobStatus
+from piper_lxd.models.journal import Journal, JournalJob
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class Reaper:
+    """
+    Cleans up after Jobs interrupted by a dead Executor process or runner, as recorded in the `Journal`: their
+    directories are deleted, their containers handed over to the `Janitor` of their host and PiperCore is told
+    the Jobs failed. Interrupted Jobs are cleaned up in parallel.
+
+    On start-up of the runner every journaled container is an orphan, pooled ones and those of finished Jobs
+    that were not deleted yet included. Later on, a container of a finished Job that is still journaled in two
+    consecutive passes is handed over again, its deletion failed. Containers without a Job belong to a pool.
+    """
+
+    INTERVAL = timedelta(minutes=1)
+
+    WORKERS = 4
+
+    def __init__(self, journal: Journal, connection: Connection, janitors: Dict[str, Janitor]) -> None:
+        self._journal = journal
+        self._connection = connection
+        self._janitors = janitors
+        # containers of finished Jobs seen in the last pass
+        self._leftover = set()  # type: Set[str]
+
+    def reap(self, running: Set[str], startup: bool=False) -> None:
+        """
+        Cleans up journaled Jobs other than `running` (secrets of Jobs being executed or waiting for it).
+        """
+        jobs = self._journal.jobs()
+        active = {job.secret for job in jobs} | running
+        interrupted = [job for job in jobs if job.secret not in running]
+        secrets = {job.secret for job in interrupted}
+
+        leftover = set()  # type: Set[str]
+        for container in self._journal.containers():
+            finished = container.secret is not None and container.secret not in active
+            if finished:
+                leftover.add(container.name)
+            # container of a just finished Job may be being deleted by the Janitor
+            finished = finished and container.name in self._leftover
+            if not startup and container.secret not in secrets and not finished:
+                continue
+
+            janitor = self._janitors.get(container.endpoint)
+            if janitor is None:
+                LOG.warning('LXD container "{}" is on unknown host {}, forgetting it'.format(
+                    container.name, container.endpoint
+                ))
+                self._journal.forget([container.name])
+                continue
+
+            LOG.info('Deleting orphaned LXD container "{}"'.format(container.name))
+            janitor.discard(container.name)
+        self._leftover = leftover
+
+        if interrupted:
+            with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+                list(pool.map(self._clean, interrupted))
+
+    def _clean(self, job: JournalJob) -> None:
+        LOG.warning('Job "{}" was interrupted'.format(job.secret))
+        for path in job.workspaces:
+            shutil.rmtree(str(path), ignore_errors=True)
+
+        try:
+            self._connection.report(job.secret, RequestJobStatus.ERROR)
+        except PConnectionException as e:
+            # reported next time
+            LOG.warning('Failed to report interrupted job "{}". Raw: {}'.format(job.secret, e))
+            return
+        metrics.JOBS.inc(status=RequestJobStatus.ERROR.value)
+        self._journal.finish(job.secret)
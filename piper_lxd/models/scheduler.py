@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Set, Tuple
+
+from piper_lxd.models.executor import Executor
+from piper_lxd.models.job import Job
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class ProcessScheduler:
+    """
+    Runs every Executor in its own process.
+    """
+
+    def __init__(self, instances: int) -> None:
+        self._instances = instances
+
+    @property
+    def free(self) -> int:
+        return self._instances - len(multiprocessing.active_children())
+
+    @property
+    def running(self) -> List[Executor]:
+        return [child for child in multiprocessing.active_children() if isinstance(child, Executor)]
+
+    def submit(self, executor: Executor) -> None:
+        executor.start()
+
+    def join(self) -> None:
+        for child in multiprocessing.active_children():
+            child.join()
+
+
+class ThreadScheduler:
+    """
+    Runs Executors in threads of this process, so concurrent jobs share one LXD client and one Connection
+    instead of paying for a forked process each.
+    """
+
+    def __init__(self, instances: int) -> None:
+        self._instances = instances
+        self._threads = ThreadPoolExecutor(max_workers=instances)
+        self._active = set()  # type: Set[Executor]
+        self._lock = threading.Lock()
+
+    @property
+    def free(self) -> int:
+        with self._lock:
+            return self._instances - len(self._active)
+
+    @property
+    def running(self) -> List[Executor]:
+        with self._lock:
+            return list(self._active)
+
+    def submit(self, executor: Executor) -> None:
+        with self._lock:
+            self._active.add(executor)
+
+        future = self._threads.submit(self._run, executor)
+        future.add_done_callback(lambda _: self._done(executor))
+
+    def join(self) -> None:
+        self._threads.shutdown(wait=True)
+
+    def _done(self, executor: Executor) -> None:
+        with self._lock:
+            self._active.discard(executor)
+
+    @staticmethod
+    def _run(executor: Executor) -> None:
+        threading.current_thread().name = executor.name
+        try:
+            executor.run()
+        except Exception:
+            LOG.exception('Executor of job "{}" failed'.format(executor.name))
+
+
+class JobQueue:
+    """
+    Acquired Jobs waiting to be started, highest priority first, Jobs of the same priority in order of arrival.
+    Every Job is kept with the (monotonic) time it was acquired at, so its Executor measures the whole wait.
+    """
+
+    def __init__(self) -> None:
+        self._heap = list()  # type: List[Tuple[int, int, float, Job]]
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self) -> Iterator[Job]:
+        return iter([job for _, _, _, job in self._heap])
+
+    def push(self, job: Job) -> None:
+        heapq.heappush(self._heap, (-job.priority, next(self._counter), time.monotonic(), job))
+
+    def peek(self) -> Optional[Job]:
+        return self._heap[0][3] if self._heap else None
+
+    def pop(self) -> Tuple[Job, float]:
+        """
+        Returns the first Job and the time it was acquired at.
+        """
+        _, _, acquired, job = heapq.heappop(self._heap)
+
+        return job, acquired
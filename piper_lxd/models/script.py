@@ -1,7 +1,9 @@
-from time import sleep
-from io import StringIO
+import logging
+import threading
+from collections import defaultdict
+from time import monotonic
 import uuid
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import timedelta
 from pathlib import Path
 
@@ -11,28 +13,128 @@ from ws4py.client import WebSocketBaseClient
 from ws4py.manager import WebSocketManager
 import ws4py.messaging
 
+from piper_lxd.models import metrics
+from piper_lxd.models.buffer import SegmentBuffer
 from piper_lxd.models.job import Job
+from piper_lxd.models.log import LogRecord
+from piper_lxd.models.lxd import wait_for_network
 from piper_lxd.models.errors import PScriptException
+from piper_lxd.models.events import EventListener
+from piper_lxd.models.image import ImageManager
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.steps import MarkerParser, Step
+from piper_lxd.models.template import TemplateManager
 
 
-class BufferHandler:
+LOG = logging.getLogger('piper-lxd')
 
-    def __init__(self):
-        self._mem = StringIO()
 
-    def handle_message(self, data: str) -> None:
-        self._mem.write(data)
+class BufferHandler:
+    """
+    Collects raw output of `streams` websockets into a SegmentBuffer. Waiting readers are woken up once `flush_size`
+    bytes are buffered, buffered output is `flush_latency` old, or all streams are closed.
+
+    In "framed" `log_format` every message is stored as a LogRecord, keeping its stream and time of arrival.
+    Standard output is fed to `parser` on arrival.
+    """
+
+    def __init__(self, flush_size: int, flush_latency: timedelta, streams: int=2,
+                 memory_limit: int=8 * 1024 * 1024, size_limit: int=256 * 1024 * 1024,
+                 spill_dir: Optional[Path]=None, log_format: str='raw',
+                 parser: Optional[MarkerParser]=None) -> None:
+        self._parser = parser
+        self._framed = log_format == 'framed'
+        marker = self._truncated if self._framed else None
+        self._buffer = SegmentBuffer(memory_limit, size_limit, spill_dir, marker)
+        self._offsets = defaultdict(int)  # type: Dict[int, int]
+        self._flush_size = flush_size
+        self._flush_latency = flush_latency.total_seconds()
+        self._oldest = None  # type: Optional[float]
+        self._open = streams
+        self._condition = threading.Condition()
+
+    def handle_message(self, data: bytes, stream: int=LogRecord.STDOUT) -> None:
+        if self._parser is not None and stream == LogRecord.STDOUT:
+            self._parser.feed(data)
+
+        with self._condition:
+            if self._framed:
+                header = LogRecord.header(stream, self._timestamp(), self._offsets[stream], len(data))
+                self._buffer.write(header, data)
+            else:
+                self._buffer.write(data)
+            self._offsets[stream] += len(data)
+            if self._oldest is None:
+                self._oldest = monotonic()
+                self._condition.notify_all()
+            elif len(self._buffer) >= self._flush_size:
+                self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._open -= 1
+            self._condition.notify_all()
 
-    def pop(self) -> str:
-        data = self._mem.getvalue()
-        self._mem.truncate(0)
-        self._mem.seek(0)
-        return data
+    @property
+    def closed(self) -> bool:
+        return self._open <= 0
+
+    def wait(self, timeout: timedelta) -> None:
+        """
+        Blocks until buffered output should be flushed or `timeout` elapses.
+        """
+        deadline = monotonic() + timeout.total_seconds()
+        with self._condition:
+            while not self.closed and len(self._buffer) < self._flush_size:
+                wake = deadline
+                if self._oldest is not None:
+                    wake = min(wake, self._oldest + self._flush_latency)
+                remaining = wake - monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+    def pop(self) -> List[memoryview]:
+        """
+        Returns buffered output segments, valid until the next `pop` or `release`.
+        """
+        with self._condition:
+            if self._buffer.dropped:
+                LOG.warning('Output buffer is full, {} bytes of output were dropped'.format(self._buffer.dropped))
+            segments = self._buffer.pop()
+            self._oldest = None
+        return segments
+
+    def release(self) -> None:
+        with self._condition:
+            self._buffer.close()
+
+    def _truncated(self, dropped: int) -> bytes:
+        data = SegmentBuffer.TRUNCATED.format(dropped).encode()
+        header = LogRecord.header(LogRecord.RUNNER, self._timestamp(), self._offsets[LogRecord.RUNNER], len(data))
+        self._offsets[LogRecord.RUNNER] += len(data)
+
+        return header + data
+
+    @staticmethod
+    def _timestamp() -> int:
+        return int(monotonic() * 1000000000)
 
 
 class Script:
 
-    POLL_TIMEOUT = timedelta(milliseconds=100)
+    FLUSH_SIZE = 64 * 1024
+
+    FLUSH_LATENCY = timedelta(milliseconds=500)
+
+    BUFFER_MEMORY = 8 * 1024 * 1024
+
+    BUFFER_SIZE = 256 * 1024 * 1024
+
+    NETWORK_TIMEOUT = timedelta(seconds=30)
+
+    # how long to wait for the event of the finished command before asking LXD
+    EVENT_TIMEOUT = timedelta(seconds=5)
 
     class NullWebSocket(WebSocketBaseClient):
 
@@ -40,57 +142,106 @@ class Script:
             self.close()
 
     class WebSocket(WebSocketBaseClient):
-        def __init__(self, manager: WebSocketManager, handler: BufferHandler, *args, **kwargs) -> None:
+        def __init__(self, manager: WebSocketManager, handler: BufferHandler, log_stream: int,
+                     *args, **kwargs) -> None:
             self.manager = manager
             self.handler = handler
+            # `stream` is taken by ws4py
+            self.log_stream = log_stream
+            self.finished = False
             super(Script.WebSocket, self).__init__(*args, **kwargs)
 
-        def handshake_ok(self) -> None:
-            self.manager.add(self)
+        def connect(self) -> None:
+            # data received together with the handshake response is processed by `connect`, the manager must not
+            # read the socket before that
+            super(Script.WebSocket, self).connect()
+            if self.stream.closing is not None:
+                self.terminate()
+            elif not self.finished:
+                self.manager.add(self)
 
         def received_message(self, message: ws4py.messaging.TextMessage) -> None:
             if len(message.data) == 0:
+                # removed from manager, `closed` will not be called
+                self.finish()
                 self.close()
                 self.manager.remove(self)
-
-            if message.encoding:
-                decoded = message.data.decode(message.encoding)
-            else:
-                decoded = message.data.decode('utf-8')
-
-            self.handler.handle_message(decoded)
-
-    def __init__(self, job: Job, repository_path: Path, lxd_client: pylxd.Client, lxd_profiles: List[str]) -> None:
+                return
+
+            # output is passed on undecoded, a multi-byte character may be split between two messages
+            self.handler.handle_message(message.data, self.log_stream)
+
+        def closed(self, code: int, reason: Optional[str]=None) -> None:
+            # LXD closes output websockets once the command exits
+            self.finish()
+
+        def finish(self) -> None:
+            if not self.finished:
+                self.finished = True
+                self.handler.close()
+
+    def __init__(self, job: Job, repository_path: Path, lxd_client: pylxd.Client, lxd_profiles: List[str], *,
+                 container_name: Optional[str]=None, templates: Optional[TemplateManager]=None,
+                 flush_size: int=FLUSH_SIZE, flush_latency: timedelta=FLUSH_LATENCY,
+                 buffer_memory: int=BUFFER_MEMORY, buffer_size: int=BUFFER_SIZE,
+                 spill_dir: Optional[Path]=None, log_format: str='raw',
+                 events: Optional[EventListener]=None, images: Optional[ImageManager]=None,
+                 volumes: Optional[Dict[str, Path]]=None, limits: Optional[Dict[str, str]]=None,
+                 janitor: Optional[Janitor]=None) -> None:
         self._job = job
         self._lxd_client = lxd_client
         self._repository_path = repository_path
         self._lxd_profiles = lxd_profiles
+        self._pooled_container_name = container_name
+        self._templates = templates
+        self._flush_size = flush_size
+        self._flush_latency = flush_latency
+        self._buffer_memory = buffer_memory
+        self._buffer_size = buffer_size
+        self._spill_dir = spill_dir
+        self._log_format = log_format
+        self._events = events
+        self._images = images
+        self._volumes = volumes if volumes is not None else dict()
+        self._limits = limits if limits is not None else dict()
+        self._janitor = janitor
+        self._parser = MarkerParser()
+        self._status = None  # type: Optional[int]
 
     def __enter__(self):
+        """
+        Provisions running container, the repository is attached and the script executed by `start`. Clone of the
+        repository may run in the meantime.
+        """
+        started = monotonic()
         self._container = None
-        self._container_name = 'piper' + uuid.uuid4().hex
-        container_config = {
-            'name': self._container_name,
-            'profiles': self._lxd_profiles,
-            'source': self._job.lxd_source,
-            'devices': {
-                'piper_repository': {
-                    'type': 'disk',
-                    'path': '/piper',
-                    'source': str(self._repository_path),
-                }
-            }
-        }
-
+        self.manager = None
         try:
-            self._container = self._lxd_client.containers.create(container_config, wait=True)
-        except LXDAPIException as e:
-            raise PScriptException('Failed to create LXD container. Raw: ' + str(e))
+            if self._pooled_container_name is not None:
+                self._claim(self._pooled_container_name)
+
+            if self._container is None:
+                self._create()
+        except Exception:
+            # __exit__ is not called when __enter__ fails
+            try:
+                self.__exit__(None, None, None)
+            except PScriptException as e:
+                LOG.warning(str(e))
+            raise
+        metrics.SCRIPT.observe(monotonic() - started, phase='provision')
+
+        return self
+
+    def start(self) -> None:
+        """
+        Attaches the cloned repository to the container and executes the Job script in it.
+
+        :raises PScriptException:
+        """
+        started = monotonic()
+        self._attach()
 
-        try:
-            self._container.start(wait=True)
-        except LXDAPIException as e:
-            raise PScriptException('Failed to start LXD container. Raw: ' + str(e))
         env = {k: str(v) for k, v in self._job.env.items()}
         config = {
             'command': ['/bin/sh', '-c', self._job.script],
@@ -100,12 +251,15 @@ class Script:
         }
 
         try:
-            response = self._lxd_client.api.containers[self._container_name].exec.post(json=config)
+            with metrics.CONTAINER.time(operation='exec'):
+                response = self._lxd_client.api.containers[self._container_name].exec.post(json=config)
         except LXDAPIException as e:
             raise PScriptException('Failed to execute command. Raw: ' + str(e))
 
         fds = response.json()['metadata']['metadata']['fds']
         self.operation_id = response.json()['operation'].split('/')[-1]
+        if self._events is not None:
+            self._events.register(self.operation_id)
 
         websocket_url = '/1.0/operations/{}/websocket'.format(self.operation_id)
         stdin_url = '{}?secret={}'.format(websocket_url, fds['0'])
@@ -119,49 +273,164 @@ class Script:
         self.manager = WebSocketManager()
         self.manager.start()
 
-        self._handler = BufferHandler()
-        stdout = self.WebSocket(self.manager, self._handler, self._lxd_client.websocket_url)
+        self._handler = BufferHandler(
+            self._flush_size, self._flush_latency, memory_limit=self._buffer_memory, size_limit=self._buffer_size,
+            spill_dir=self._spill_dir, log_format=self._log_format, parser=self._parser,
+        )
+        stdout = self.WebSocket(self.manager, self._handler, LogRecord.STDOUT, self._lxd_client.websocket_url)
         stdout.resource = stdout_url
         stdout.connect()
 
-        stderr = self.WebSocket(self.manager, self._handler, self._lxd_client.websocket_url)
+        stderr = self.WebSocket(self.manager, self._handler, LogRecord.STDERR, self._lxd_client.websocket_url)
         stderr.resource = stderr_url
         stderr.connect()
+        metrics.SCRIPT.observe(monotonic() - started, phase='start')
 
-        return self
+    def _create(self) -> None:
+        self._container_name = 'piper' + uuid.uuid4().hex
+        if self._janitor is not None:
+            self._janitor.track(self._container_name, self._job.secret)
+        container_config = {
+            'name': self._container_name,
+            'profiles': self._lxd_profiles,
+            'source': self._job.lxd_source,
+            'config': dict(self._limits),
+        }
+        if self._images is not None:
+            container_config['source'] = self._images.source(self._job.image)
+
+        try:
+            if self._templates is not None and self._job.image in self._templates:
+                with self._templates.source(self._job.image) as source:
+                    container_config['source'] = source
+                    with metrics.CONTAINER.time(operation='create'):
+                        self._container = self._lxd_client.containers.create(container_config, wait=True)
+            else:
+                with metrics.CONTAINER.time(operation='create'):
+                    self._container = self._lxd_client.containers.create(container_config, wait=True)
+        except LXDAPIException as e:
+            raise PScriptException('Failed to create LXD container. Raw: ' + str(e))
+
+        try:
+            with metrics.CONTAINER.time(operation='start'):
+                self._container.start(wait=True)
+        except LXDAPIException as e:
+            raise PScriptException('Failed to start LXD container. Raw: ' + str(e))
+
+        # pooled containers got network before they were handed out
+        try:
+            ready = wait_for_network(self._container, self.NETWORK_TIMEOUT)
+        except LXDAPIException as e:
+            raise PScriptException('Failed to get state of LXD container. Raw: ' + str(e))
+        if not ready:
+            raise PScriptException('LXD container "{}" did not get network in time'.format(self._container_name))
+
+    def _claim(self, name: str) -> None:
+        """
+        Takes running container from ContainerPool, falls back to creating new container when it is gone.
+        """
+        try:
+            self._container = self._lxd_client.containers.get(name)
+        except LXDAPIException as e:
+            LOG.warning('Pooled LXD container "{}" is not available. Raw: {}'.format(name, e))
+            return
+
+        self._container_name = name
+        if self._janitor is not None:
+            self._janitor.track(name, self._job.secret)
+
+    def _attach(self) -> None:
+        """
+        Hot-attaches repository and dependency cache volumes to the running container, applies resource limits to
+        pooled container.
+        """
+        try:
+            if self._limits:
+                config = dict(self._container.config)
+                config.update(self._limits)
+                self._container.config = config
+            devices = dict(self._container.devices)
+            devices['piper_repository'] = self._repository_device
+            for idx, (path, source) in enumerate(sorted(self._volumes.items())):
+                devices['piper_cache_{}'.format(idx)] = {'type': 'disk', 'path': path, 'source': str(source)}
+            self._container.devices = devices
+            with metrics.CONTAINER.time(operation='attach'):
+                self._container.save(wait=True)
+        except LXDAPIException as e:
+            message = 'Failed to attach repository to LXD container "{}". Raw: '.format(self._container_name)
+            raise PScriptException(message + str(e))
+
+    @property
+    def _repository_device(self) -> Dict[str, str]:
+        return {
+            'type': 'disk',
+            'path': '/piper',
+            'source': str(self._repository_path),
+        }
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._container is not None:
-            try:
+        with metrics.SCRIPT.time(phase='exit'):
+            if self.manager is not None:
+                self.manager.close_all()
+                self.manager.stop()
+                self._handler.release()
+
+            if self._container is not None and self._janitor is not None:
+                # the Job is over, its slot does not wait for the container to go away
+                self._janitor.discard(self._container_name)
+            elif self._container is not None:
+                self._delete()
+
+    def _delete(self) -> None:
+        try:
+            with metrics.CONTAINER.time(operation='stop'):
                 self._container.stop(wait=True)
-            except pylxd.exceptions.LXDAPIException:
-                pass
+        except pylxd.exceptions.LXDAPIException:
+            pass
 
-            try:
+        try:
+            with metrics.CONTAINER.time(operation='delete'):
                 self._container.delete()
-            except pylxd.exceptions.LXDAPIException as e:
-                message = 'Failed to delete LXD container "{}". Raw: '.format(self._container_name) + str(e)
-                raise PScriptException(message)
+        except pylxd.exceptions.LXDAPIException as e:
+            message = 'Failed to delete LXD container "{}". Raw: '.format(self._container_name) + str(e)
+            raise PScriptException(message)
 
-    def poll(self, timeout: timedelta) -> str:
-        while timeout > timedelta(0):
-            if len(self.manager.websockets.values()) == 0:
-                break
+    def poll(self, timeout: timedelta) -> List[memoryview]:
+        """
+        Returns output once there is enough of it or it is old enough, the command exited, or `timeout` elapsed.
+        """
+        with metrics.SCRIPT.time(phase='poll'):
+            self._handler.wait(timeout)
 
-            if timeout > self.POLL_TIMEOUT:
-                sleep(self.POLL_TIMEOUT.total_seconds())
-            else:
-                sleep(timeout.total_seconds())
+            return self._handler.pop()
 
-            timeout -= self.POLL_TIMEOUT
+    @property
+    def steps(self) -> List[Step]:
+        return self._parser.steps
 
-        return self._handler.pop()
+    @property
+    def running(self) -> bool:
+        return not self._handler.closed
 
     @property
     def status(self) -> Optional[int]:
-        if not self.operation_id:
-            return None
-
-        result = self._lxd_client.operations.get(self.operation_id)
+        """
+        LXD status code of the command operation, 103 while it is running.
+        """
+        if self.running:
+            return 103
+
+        if self._status is None and self._events is not None:
+            operation = self._events.wait(self.operation_id, self.EVENT_TIMEOUT)
+            if operation is not None:
+                self._status = operation['status_code']
+
+        if self._status is None:
+            try:
+                response = self._lxd_client.api.operations[self.operation_id].wait.get()
+            except LXDAPIException as e:
+                LOG.warning('Failed to get status of LXD operation "{}". Raw: {}'.format(self.operation_id, e))
+                return None
+            self._status = response.json()['metadata']['status_code']
 
-        return result.status_code
+        return self._status
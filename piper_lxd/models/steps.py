@@ -0,0 +1,140 @@
+import logging
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from piper_lxd.models import metrics
+from piper_lxd.models.job import Job
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class Step:
+    """
+    One command (or after_failure command) of a Job script. `started` and `finished` are runner monotonic times
+    of its markers, `started_at` and `finished_at` UNIX times printed by the container.
+    """
+
+    def __init__(self, kind: str, index: int) -> None:
+        self.kind = kind
+        self.index = index
+        self.started = None  # type: Optional[float]
+        self.started_at = None  # type: Optional[int]
+        self.finished = None  # type: Optional[float]
+        self.finished_at = None  # type: Optional[int]
+        self.exit_code = None  # type: Optional[int]
+
+    @property
+    def status(self) -> str:
+        if self.exit_code is None:
+            return 'running'
+
+        return 'succeeded' if self.exit_code == 0 else 'failed'
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started is None or self.finished is None:
+            return None
+
+        return self.finished - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'kind': self.kind,
+            'index': self.index,
+            'status': self.status,
+            'exit_code': self.exit_code,
+            'started_at': self.started_at,
+            'duration': round(self.duration, 3) if self.duration is not None else None,
+        }
+
+
+class MarkerParser:
+    """
+    Tracks Job steps by `::piper:<kind>:<index>:start|end:...::` markers in standard output of the Job script.
+
+    Output is fed as it arrives. A marker split between messages is joined from the unfinished part kept from
+    the previous message, so every byte of output is looked at a constant number of times.
+    """
+
+    PREFIX = ('::' + Job.COMMAND_PREFIX + ':').encode()
+
+    MAX_LENGTH = 128
+
+    MARKER = re.compile(
+        ('^::' + Job.COMMAND_PREFIX + r':(command|after_failure):(\d+):(start|end):(\d+)(?::(-?\d+))?::\r?$').encode()
+    )
+
+    def __init__(self, clock: Callable[[], float]=monotonic) -> None:
+        self._clock = clock
+        self._pending = b''
+        self._steps = OrderedDict()  # type: Dict[Tuple[str, int], Step]
+        self._lock = threading.Lock()
+
+    @property
+    def steps(self) -> List[Step]:
+        with self._lock:
+            return list(self._steps.values())
+
+    def feed(self, data: bytes) -> None:
+        if self._pending:
+            data = self._pending + data
+            self._pending = b''
+
+        position = 0
+        while True:
+            start = data.find(self.PREFIX, position)
+            if start < 0:
+                self._pending = self._partial(data, position)
+                return
+
+            end = data.find(b'\n', start, start + self.MAX_LENGTH)
+            if end < 0:
+                if len(data) - start < self.MAX_LENGTH:
+                    self._pending = bytes(data[start:])
+                    return
+                # too long to be a marker
+                position = start + 1
+                continue
+
+            self._marker(data[start:end])
+            position = end + 1
+
+    def _partial(self, data: bytes, position: int) -> bytes:
+        """
+        Returns end of `data` that may be beginning of a marker.
+        """
+        for length in range(min(len(self.PREFIX) - 1, len(data) - position), 0, -1):
+            if data.endswith(self.PREFIX[:length]):
+                return bytes(data[-length:])
+
+        return b''
+
+    def _marker(self, line: bytes) -> None:
+        match = self.MARKER.match(line)
+        if match is None:
+            return
+
+        kind = match.group(1).decode()
+        index = int(match.group(2))
+        timestamp = int(match.group(4))
+        with self._lock:
+            step = self._steps.get((kind, index))
+            if step is None:
+                step = self._steps[(kind, index)] = Step(kind, index)
+            if match.group(3) == b'start':
+                step.started = self._clock()
+                step.started_at = timestamp
+                return
+
+            step.finished = self._clock()
+            step.finished_at = timestamp
+            step.exit_code = int(match.group(5)) if match.group(5) is not None else None
+
+        if step.duration is not None:
+            metrics.STEPS.observe(step.duration, kind=kind, status=step.status)
+        duration = '{:.3f}s'.format(step.duration) if step.duration is not None else 'unknown time'
+        LOG.info('Step {} {} finished with exit code {} in {}'.format(kind, index, step.exit_code, duration))
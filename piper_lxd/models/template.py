@@ -0,0 +1,163 @@
+import hashlib
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pylxd
+from pylxd.exceptions import LXDAPIException, NotFound
+
+from piper_lxd.models.config import TemplateConfig
+from piper_lxd.models.errors import PScriptException
+from piper_lxd.models.job import lxd_source
+from piper_lxd.models.lock import FileLock
+from piper_lxd.models.lxd import wait_for_network
+
+
+LOG = logging.getLogger('piper-lxd')
+
+
+class TemplateManager:
+    """
+    Maintains one stopped, pre-provisioned "template" container per image fingerprint. Job containers are copies
+    of its snapshot, which is nearly instant on copy-on-write storage pools (ZFS, btrfs).
+
+    Template is rebuilt when the image alias starts pointing to a new fingerprint, templates of previous
+    fingerprints are deleted once nobody copies from them. Building is serialized between processes by a file lock
+    in `lock_dir`.
+    """
+
+    _PREFIX = 'piper-tpl-'
+
+    _SNAPSHOT = 'piper'
+
+    _NETWORK_TIMEOUT = timedelta(seconds=30)
+
+    def __init__(self, client: pylxd.Client, profiles: List[str], templates: List[TemplateConfig],
+                 lock_dir: Path) -> None:
+        self._client = client
+        self._profiles = profiles
+        self._templates = {template.image: template for template in templates}
+        self._lock_dir = lock_dir
+
+    def __contains__(self, image: str) -> bool:
+        return image in self._templates
+
+    @contextmanager
+    def source(self, image: str) -> Iterator[Dict[str, str]]:
+        """
+        Yields LXD container source copying from template of `image`, building the template first if needed.
+        Template is not deleted until the context is left.
+
+        :raises PScriptException:
+        """
+        try:
+            fingerprint = self._fingerprint(image)
+        except LXDAPIException as e:
+            raise PScriptException('Failed to resolve LXD image "{}". Raw: {}'.format(image, e))
+
+        name = self._PREFIX + hashlib.sha1((image + fingerprint).encode()).hexdigest()[:20]
+        self._lock_dir.mkdir(parents=True, exist_ok=True)
+        lock = FileLock(self._lock_dir / (name + '.lock'))
+
+        lock.acquire()
+        try:
+            if not self._is_built(name):
+                self._build(name, image, fingerprint)
+                self._prune(image, name)
+        except LXDAPIException as e:
+            raise PScriptException('Failed to build LXD template "{}". Raw: {}'.format(name, e))
+        finally:
+            lock.release()
+
+        lock.acquire(shared=True)
+        try:
+            yield {
+                'type': 'copy',
+                'source': '{}/{}'.format(name, self._SNAPSHOT),
+            }
+        finally:
+            lock.release()
+
+    def _fingerprint(self, image: str) -> str:
+        source = lxd_source(image)
+        if 'fingerprint' in source:
+            return source['fingerprint']
+
+        return self._client.images.get_by_alias(source['alias']).fingerprint
+
+    def _is_built(self, name: str) -> bool:
+        if not self._client.containers.exists(name):
+            return False
+
+        container = self._client.containers.get(name)
+        try:
+            container.snapshots.get(self._SNAPSHOT)
+        except NotFound:
+            # build was interrupted
+            LOG.debug('Deleting incomplete LXD template "{}"'.format(name))
+            self._delete(container)
+            return False
+
+        return True
+
+    def _build(self, name: str, image: str, fingerprint: str) -> None:
+        LOG.info('Building LXD template "{}" of "{}" ({})'.format(name, image, fingerprint))
+        container_config = {
+            'name': name,
+            'profiles': self._profiles,
+            'source': lxd_source('fingerprint:' + fingerprint),
+            'config': {
+                'user.piper.image': image,
+            },
+        }
+        container = self._client.containers.create(container_config, wait=True)
+
+        try:
+            container.start(wait=True)
+            if not wait_for_network(container, self._NETWORK_TIMEOUT):
+                raise PScriptException('LXD template "{}" did not get network in time'.format(name))
+
+            for command in self._templates[image].commands:
+                result = container.execute(['/bin/sh', '-c', command])
+                if result[0] != 0:
+                    message = 'Template command "{}" failed with {}. Output: {}'.format(command, result[0], result[2])
+                    raise PScriptException(message)
+
+            container.stop(wait=True)
+            container.snapshots.create(self._SNAPSHOT, wait=True)
+        except (LXDAPIException, PScriptException):
+            self._delete(container)
+            raise
+
+    def _prune(self, image: str, current: str) -> None:
+        """
+        Deletes templates of `image` built from previous fingerprints.
+        """
+        for container in self._client.containers.all():
+            if not container.name.startswith(self._PREFIX) or container.name == current:
+                continue
+
+            container = self._client.containers.get(container.name)
+            if container.config.get('user.piper.image') != image:
+                continue
+
+            lock = FileLock(self._lock_dir / (container.name + '.lock'))
+            if not lock.acquire(blocking=False):
+                continue
+
+            try:
+                LOG.info('Deleting outdated LXD template "{}"'.format(container.name))
+                self._delete(container)
+            finally:
+                lock.release()
+
+    @staticmethod
+    def _delete(container) -> None:
+        try:
+            container.stop(wait=True)
+        except LXDAPIException:
+            pass
+
+        container.delete(wait=True)
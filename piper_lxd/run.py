@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 import argparse
 import logging.config
+import signal
+import threading
 import time
+from datetime import timedelta
 from pathlib import Path
-import multiprocessing
+from typing import Dict, List, Union
 
+import requests
 import yaml
-from pykwalify.errors import SchemaError
+from pylxd.exceptions import ClientConnectionFailed
 
+from piper_lxd.models import lxd, metrics
 from piper_lxd.models.executor import Executor
-from piper_lxd.models.config import Config
+from piper_lxd.models.image import ImageManager
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.journal import Journal
+from piper_lxd.models.job import Job
+from piper_lxd.models.config import Config, LxdConfig
 from piper_lxd.models.connection import Connection
 from piper_lxd.models.errors import PConnectionException
+from piper_lxd.models.events import EventListener
+from piper_lxd.models.placement import Placement
+from piper_lxd.models.poller import JobPoller
+from piper_lxd.models.pool import ContainerPool
+from piper_lxd.models.reaper import Reaper
+from piper_lxd.models.scheduler import JobQueue, ProcessScheduler, ThreadScheduler
+from piper_lxd.models.template import TemplateManager
 
 LOG = logging.getLogger('piper-lxd')
 
@@ -26,29 +42,175 @@ def main() -> None:
 
     parsed = vars(parser.parse_args())
     path = parsed['config'].expanduser()
-    config = Config(yaml.load(path.open()))
-    connection = Connection(config.runner.endpoint)
+    config = Config(yaml.safe_load(path.open()))
+    connection = Connection(
+        config.runner.endpoint,
+        pool_size=config.runner.http_pool_size,
+        retries=config.runner.http_retries,
+        backoff=config.runner.http_backoff,
+    )
     logging.config.dictConfig(config.logging.config)
 
-    while True:
-        if len(multiprocessing.active_children()) == config.runner.instances:
-            time.sleep(config.runner.interval.total_seconds())
-            continue
+    server = None
+    if config.runner.metrics is not None:
+        metrics_host, _, metrics_port = config.runner.metrics.rpartition(':')
+        # before any Executor process is forked, so they report to this one
+        metrics.REGISTRY.enable()
+        server = metrics.MetricsServer(metrics_host, int(metrics_port))
+        server.start()
+    metrics.SLOTS.set(config.runner.instances)
+
+    images = dict()  # type: Dict[str, ImageManager]
+    for host in config.hosts if config.images.server is not None else []:
+        images[host.endpoint] = ImageManager(host, config.images)
+        images[host.endpoint].start()
+
+    # containers of finished Jobs are deleted by this process, also for forked Executors
+    journal = Journal(config.runner.state_dir / 'journal.sqlite')
+    janitors = dict()  # type: Dict[str, Janitor]
+    for host in config.hosts:
+        janitors[host.endpoint] = Janitor(host, journal)
+        janitors[host.endpoint].start()
+
+    # before new containers are journaled, every journaled one is left from the previous run
+    reaper = Reaper(journal, connection, janitors)
+    reaper.reap(set(), startup=True)
+    reaped = time.monotonic()
+
+    if config.runner.mode == 'thread':
+        scheduler = ThreadScheduler(config.runner.instances)  # type: Union[ThreadScheduler, ProcessScheduler]
+    else:
+        scheduler = ProcessScheduler(config.runner.instances)
+
+    pools = dict()  # type: Dict[str, ContainerPool]
+    events = dict()  # type: Dict[str, EventListener]
 
-        job = None
+    def connect(host: LxdConfig) -> bool:
+        """
+        Starts container pool and (in thread mode) events subscription of `host`, returns False if it is unreachable.
+        """
         try:
-            job = connection.fetch_job(config.runner.token)
-        except PConnectionException as e:
-            LOG.warning('Job fetch from failed: {}'.format(e))
-        except SchemaError as e:
-            LOG.warning('Fetched Job has invalid schema: {}'.format(e))
-
-        if job is None:
-            LOG.debug('No job available')
-            time.sleep(config.runner.interval.total_seconds())
-            continue
-
-        Executor(connection, config.runner.interval, config.lxd, job, name=job.secret).start()
+            client = lxd.client(host)
+        except (ClientConnectionFailed, requests.RequestException) as e:
+            LOG.warning('Failed to connect to LXD host {}, trying again later. Raw: {}'.format(host.endpoint, e))
+            return False
+
+        # containers are pooled on every host
+        if config.pool:
+            templates = None
+            if config.templates:
+                lock_dir = config.runner.state_dir / 'templates'
+                templates = TemplateManager(client, host.profiles, config.templates, lock_dir)
+            pools[host.endpoint] = ContainerPool(
+                client, host.profiles, config.pool, config.runner.interval, templates, images.get(host.endpoint),
+                janitors[host.endpoint],
+            )
+            pools[host.endpoint].start()
+
+        # single subscription per host dispatches finished commands to all threads
+        if config.runner.mode == 'thread':
+            # kept even if subscribing failed, it is retried and Scripts use REST API meanwhile
+            events[host.endpoint] = EventListener(client)
+            events[host.endpoint].start()
+
+        return True
+
+    disconnected = [host for host in config.hosts if not connect(host)]
+
+    placement = Placement(config.hosts, pools, config.resources.reserve)
+    queue = JobQueue()
+
+    # SIGTERM drains the runner: no more Jobs are fetched, acquired ones are finished, then it exits
+    draining = threading.Event()
+
+    def drain(signum, frame) -> None:
+        LOG.info('Draining, waiting for {} running jobs'.format(len(scheduler.running) + len(queue)))
+        draining.set()
+
+    signal.signal(signal.SIGTERM, drain)
+    long_poll = config.runner.long_poll if config.runner.long_poll > timedelta(0) else None
+    poller = JobPoller(connection, config.runner.token, config.runner.interval, config.runner.max_interval, long_poll)
+
+    try:
+        while True:
+            # strictly by priority, Job waiting for resources holds back the ones behind it
+            while scheduler.free > 0:
+                job = queue.peek()
+                if job is None:
+                    break
+                resources = config.resources.get(job.resources)
+                target = placement.select(job.image, scheduler.running, resources)
+                if target is None:
+                    break
+
+                job, acquired = queue.pop()
+                if target.endpoint in images:
+                    images[target.endpoint].use(job.image)
+                pool = pools.get(target.endpoint)
+                container = pool.claim(job.image) if pool is not None else None
+                # Executor connects on its own, threads share the Client of this process
+                executor = Executor(
+                    connection, config.runner.interval, target, job, git_config=config.git, container=container,
+                    templates=config.templates, state_dir=config.runner.state_dir,
+                    flush_size=config.runner.flush_size, flush_latency=config.runner.flush_latency,
+                    log_compression=config.runner.log_compression, log_spool=config.runner.log_spool,
+                    buffer_memory=config.runner.buffer_memory, buffer_size=config.runner.buffer_size,
+                    log_format=config.runner.log_format, events=events.get(target.endpoint),
+                    images=images.get(target.endpoint), cache_config=config.cache, resources=resources,
+                    janitor=janitors[target.endpoint], journal=journal, acquired=acquired, name=job.secret,
+                )
+                scheduler.submit(executor)
+            metrics.QUEUED.set(len(queue))
+
+            if time.monotonic() - reaped >= Reaper.INTERVAL.total_seconds():
+                running = {executor.name for executor in scheduler.running} | {job.secret for job in queue}
+                reaper.reap(running)
+                # hosts unreachable so far get their pool and subscription once they are back
+                disconnected = [host for host in disconnected if not connect(host)]
+                reaped = time.monotonic()
+
+            if draining.is_set():
+                if not queue:
+                    break
+                time.sleep(config.runner.interval.total_seconds())
+                continue
+
+            # Jobs behind the waiting one could not start anyway
+            free = min(scheduler.free, placement.free(scheduler.running))
+            if free <= 0 or queue:
+                time.sleep(config.runner.interval.total_seconds())
+                continue
+
+            jobs = list()  # type: List[Job]
+            failed = False
+            try:
+                jobs = poller.fetch(free)
+            except PConnectionException as e:
+                LOG.warning('Job fetch from failed: {}'.format(e))
+                failed = True
+
+            if not jobs:
+                LOG.debug('No job available')
+                poller.idle(failed)
+                continue
+
+            for job in jobs:
+                journal.begin(job.secret)
+                queue.push(job)
+
+        scheduler.join()
+        LOG.info('Drained')
+    finally:
+        for listener in events.values():
+            listener.stop()
+        for pool in pools.values():
+            pool.stop()
+        for manager in images.values():
+            manager.stop()
+        for janitor in janitors.values():
+            janitor.stop()
+        if server is not None:
+            server.stop()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
 from piper_lxd.schemas.config import schema as config
 from piper_lxd.schemas.job import schema as job
+from piper_lxd.schemas.jobs import schema as jobs
 
-__all__ = ['config', 'job']
+__all__ = ['config', 'job', 'jobs']
@@ -17,15 +17,60 @@ schema = {
           "required": True
         },
         "cert": {
-          "type": "str",
-          "required": True
+          "type": "str"
         },
         "key": {
-          "type": "str",
-          "required": True
+          "type": "str"
         },
         "verify": {
           "type": "bool"
+        },
+        "pool_size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "capacity": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "hosts": {
+          "type": "seq",
+          "sequence": [
+            {
+              "type": "map",
+              "mapping": {
+                "endpoint": {
+                  "type": "str",
+                  "required": True
+                },
+                "cert": {
+                  "type": "str"
+                },
+                "key": {
+                  "type": "str"
+                },
+                "verify": {
+                  "type": "bool"
+                },
+                "pool_size": {
+                  "type": "int",
+                  "range": {
+                    "min": 1
+                  }
+                },
+                "capacity": {
+                  "type": "int",
+                  "range": {
+                    "min": 1
+                  }
+                }
+              }
+            }
+          ]
         }
       }
     },
@@ -51,9 +96,254 @@ schema = {
         "endpoint": {
           "type": "str",
           "required": True
+        },
+        "state_dir": {
+          "type": "str"
+        },
+        "mode": {
+          "type": "str",
+          "enum": ["process", "thread"]
+        },
+        "http_pool_size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "http_retries": {
+          "type": "int",
+          "range": {
+            "min": 0
+          }
+        },
+        "http_backoff": {
+          "type": "number",
+          "range": {
+            "min": 0
+          }
+        },
+        "long_poll": {
+          "type": "int",
+          "range": {
+            "min": 0
+          }
+        },
+        "max_interval": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "flush_size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "flush_latency": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "log_compression": {
+          "type": "str",
+          "enum": ["none", "gzip", "zstd"]
+        },
+        "log_spool": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "buffer_memory": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "buffer_size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "log_format": {
+          "type": "str",
+          "enum": ["raw", "framed"]
+        },
+        "metrics": {
+          "type": "str",
+          "pattern": "^(none|.*:[0-9]+)$"
+        }
+      }
+    },
+    "cache": {
+      "type": "map",
+      "mapping": {
+        "path": {
+          "type": "str"
+        },
+        "size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        }
+      }
+    },
+    "git": {
+      "type": "map",
+      "mapping": {
+        "cache": {
+          "type": "str"
+        },
+        "cache_size": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "strategy": {
+          "type": "str",
+          "enum": ["full", "shallow", "partial"]
+        },
+        "sparse": {
+          "type": "seq",
+          "sequence": [
+            {
+              "type": "str"
+            }
+          ]
+        },
+        "jobs": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        }
+      }
+    },
+    "images": {
+      "type": "map",
+      "mapping": {
+        "server": {
+          "type": "str"
+        },
+        "protocol": {
+          "type": "str",
+          "enum": ["simplestreams", "lxd"]
+        },
+        "refresh": {
+          "type": "int",
+          "range": {
+            "min": 1
+          }
+        },
+        "budget": {
+          "type": "int",
+          "range": {
+            "min": 0
+          }
+        },
+        "pinned": {
+          "type": "seq",
+          "sequence": [
+            {
+              "type": "str"
+            }
+          ]
+        }
+      }
+    },
+    "resources": {
+      "type": "map",
+      "mapping": {
+        "default": {
+          "type": "str"
+        },
+        "reserve": {
+          "type": "int",
+          "range": {
+            "min": 0
+          }
+        },
+        "classes": {
+          "type": "map",
+          "matching-rule": "all",
+          "mapping": {
+            "regex;(.+)": {
+              "type": "map",
+              "mapping": {
+                "cpu": {
+                  "type": "int",
+                  "required": True,
+                  "range": {
+                    "min": 1
+                  }
+                },
+                "memory": {
+                  "type": "int",
+                  "required": True,
+                  "range": {
+                    "min": 1
+                  }
+                }
+              }
+            }
+          }
         }
       }
     },
+    "pool": {
+      "type": "seq",
+      "sequence": [
+        {
+          "type": "map",
+          "mapping": {
+            "image": {
+              "type": "str",
+              "required": True
+            },
+            "size": {
+              "type": "int",
+              "required": True,
+              "range": {
+                "min": 1
+              }
+            },
+            "rate": {
+              "type": "int",
+              "range": {
+                "min": 1
+              }
+            }
+          }
+        }
+      ]
+    },
+    "templates": {
+      "type": "seq",
+      "sequence": [
+        {
+          "type": "map",
+          "mapping": {
+            "image": {
+              "type": "str",
+              "required": True
+            },
+            "commands": {
+              "type": "seq",
+              "sequence": [
+                {
+                  "type": "str"
+                }
+              ]
+            }
+          }
+        }
+      ]
+    },
     "logging": {
       "type": "map",
       "allowempty": True
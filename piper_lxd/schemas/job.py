@@ -36,6 +36,31 @@ schema = {
         }
       }
     },
+    "resources": {
+      "type": "str"
+    },
+    "priority": {
+      "type": "int"
+    },
+    "cache": {
+      "type": "map",
+      "mapping": {
+        "key": {
+          "type": "str",
+          "required": True
+        },
+        "paths": {
+          "type": "seq",
+          "required": True,
+          "sequence": [
+            {
+              "type": "str",
+              "pattern": "^/"
+            }
+          ]
+        }
+      }
+    },
     "repository": {
       "type": "map",
       "mapping": {
@@ -0,0 +1,8 @@
+from piper_lxd.schemas.job import schema as job
+
+schema = {
+  "type": "seq",
+  "sequence": [
+    job
+  ]
+}
@@ -7,7 +7,7 @@ setup(
     version='0.11',
     description='Piper CI LXD Runner',
     long_description=long_description,
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     package_dir={'piper_lxd': 'piper_lxd'},
     author='Martin Franc',
     author_email='francma6@fit.cvut.cz',
@@ -39,6 +39,10 @@ setup(
         'pykwalify',
     ],
     extras_require={
+        # zstd compression of job output
+        'zstd': [
+            'zstandard',
+        ],
         'dev': [
             # type checking
             'mypy',
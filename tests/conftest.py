@@ -9,6 +9,7 @@ import pytest
 
 from piper_lxd.models.config import Config
 from piper_lxd.models.job import ResponseJobStatus, RequestJobStatus, Job
+from piper_lxd.models.log import LogChunk
 
 logging.basicConfig()
 logging.getLogger('piper-lxd').setLevel(logging.DEBUG)
@@ -26,6 +27,7 @@ class FakeConnection:
         self.jobs = list()
         self.statuses = defaultdict(list)
         self.logs = defaultdict(str)
+        self.steps = defaultdict(dict)
 
     def fetch_job(self, token: str) -> Job:
         if len(self.jobs) == 0:
@@ -37,12 +39,23 @@ class FakeConnection:
         with open('tests/jobs/{}.json'.format(job)) as fd:
             self.jobs.append(Job(json.load(fd)))
 
-    def report(self, secret: str, status: RequestJobStatus, log: Optional[str] = None) -> ResponseJobStatus:
+    def report(self, secret: str, status: RequestJobStatus, log: Optional[str] = None,
+               steps=None) -> ResponseJobStatus:
         self.statuses[secret].append(status)
+        for step in steps or []:
+            self.steps[secret][(step.kind, step.index)] = step.to_dict()
         self.logs[secret] += '' if log is None else log
 
         return ResponseJobStatus.OK
 
+    def report_chunk(self, secret: str, status: RequestJobStatus, chunk: LogChunk, steps=None):
+        self.statuses[secret].append(status)
+        for step in steps or []:
+            self.steps[secret][(step.kind, step.index)] = step.to_dict()
+        self.logs[secret] += chunk.decode().decode()
+
+        return ResponseJobStatus.OK, chunk.offset + chunk.length
+
 
 @pytest.fixture()
 def connection():
@@ -73,4 +86,4 @@ def config():
 
 @pytest.fixture()
 def empty_clone(monkeypatch):
-    monkeypatch.setattr('piper_lxd.models.git.clone', lambda a, b, c, d, e=None: None)
+    monkeypatch.setattr('piper_lxd.models.git.clone', lambda a, b, c, d, e=None, **kwargs: None)
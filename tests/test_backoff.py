@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from piper_lxd.models.backoff import Backoff
+
+
+def test_backoff():
+    backoff = Backoff(timedelta(seconds=1), timedelta(seconds=8))
+
+    delays = [backoff.next() for _ in range(10)]
+    assert all(timedelta(seconds=1) <= delay <= timedelta(seconds=8) for delay in delays)
+    assert delays[-1] >= timedelta(seconds=4)
+
+    backoff.reset()
+    assert backoff.next() == timedelta(seconds=1)
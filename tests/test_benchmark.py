@@ -0,0 +1,16 @@
+import pytest
+
+from benchmarks.harness import run
+
+
+@pytest.mark.parametrize('mode', ['process', 'thread'])
+def test_smoke(mode):
+    result = run(jobs=3, commands=2, instances=2, mode=mode, output_size=16 * 1024, timeout=60)
+
+    assert result['finished']
+    assert result['completed'] == 3
+    assert result['containers_left'] == 0
+    assert result['log_bytes'] >= 3 * 16 * 1024
+    assert result['jobs_per_second'] > 0
+    assert result['log_latency']['p50'] is not None
+    assert result['cpu_seconds'] > 0
@@ -0,0 +1,39 @@
+from piper_lxd.models.buffer import SegmentBuffer
+
+
+def test_memory():
+    buffer = SegmentBuffer(memory_limit=8, size_limit=64)
+    data = b'1234'
+    buffer.write(data)
+    buffer.write(b'56')
+    segments = buffer.pop()
+    assert b''.join(segments) == b'123456'
+    assert segments[0].obj is data
+    assert len(buffer) == 0
+    assert buffer.pop() == []
+
+
+def test_spill(tmpdir):
+    buffer = SegmentBuffer(memory_limit=8, size_limit=64, spill_dir=tmpdir)
+    for i in range(10):
+        buffer.write(str(i).encode() * 3)
+    assert len(buffer) == 30
+    assert len(tmpdir.listdir()) == 0
+    assert b''.join(buffer.pop()) == b''.join(str(i).encode() * 3 for i in range(10))
+    buffer.write(b'abc')
+    assert b''.join(buffer.pop()) == b'abc'
+    buffer.close()
+
+
+def test_truncate():
+    buffer = SegmentBuffer(memory_limit=8, size_limit=16)
+    buffer.write(b'0123456789')
+    buffer.write(b'abcdefghij')
+    buffer.write(b'ABCDEFGHIJ')
+    assert len(buffer) == 16
+    assert buffer.dropped == 14
+    assert b''.join(buffer.pop()) == b'0123456789ab::piper:truncated:14::\nGHIJ'
+    assert buffer.dropped == 0
+    buffer.write(b'0123456789')
+    assert b''.join(buffer.pop()) == b'0123456789'
+    buffer.close()
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from piper_lxd.models.cache import DependencyCache
+
+
+PIP = '/root/.cache/pip'
+
+
+def test_checkout_empty(tmpdir):
+    cache = DependencyCache(Path(str(tmpdir)), 1024 ** 2)
+    workspace = cache.checkout('pip', [PIP])
+
+    assert list(workspace.volumes) == [PIP]
+    assert workspace.volumes[PIP].is_dir()
+    assert not any(workspace.volumes[PIP].iterdir())
+
+
+def test_commit(tmpdir):
+    cache = DependencyCache(Path(str(tmpdir)), 1024 ** 2)
+    workspace = cache.checkout('pip', [PIP])
+    (workspace.volumes[PIP] / 'wheel').write_text('a')
+    workspace.commit()
+    workspace.release()
+
+    first = cache.checkout('pip', [PIP])
+    second = cache.checkout('pip', [PIP])
+    assert (first.volumes[PIP] / 'wheel').read_text() == 'a'
+
+    # workspaces are isolated, failed Job does not change the entry
+    (first.volumes[PIP] / 'wheel').write_text('b')
+    first.release()
+    assert not first.volumes[PIP].exists()
+    assert (second.volumes[PIP] / 'wheel').read_text() == 'a'
+    assert (cache.checkout('pip', [PIP]).volumes[PIP] / 'wheel').read_text() == 'a'
+
+    # other keys do not see the entry
+    assert not any(cache.checkout('npm', [PIP]).volumes[PIP].iterdir())
+
+
+def test_evict(tmpdir):
+    cache = DependencyCache(Path(str(tmpdir)), 1536)
+    for key in ['old', 'new']:
+        workspace = cache.checkout(key, [PIP])
+        (workspace.volumes[PIP] / 'wheel').write_bytes(b'x' * 1024)
+        workspace.commit()
+
+    assert not any(cache.checkout('old', [PIP]).volumes[PIP].iterdir())
+    assert (cache.checkout('new', [PIP]).volumes[PIP] / 'wheel').exists()
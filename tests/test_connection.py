@@ -1,3 +1,4 @@
+import gzip
 from wsgiref.simple_server import make_server
 from threading import Thread, Lock
 
@@ -6,6 +7,7 @@ import json
 
 from piper_lxd.models.connection import Connection
 from piper_lxd.models.job import RequestJobStatus, ResponseJobStatus
+from piper_lxd.models.log import LogChunk
 from piper_lxd.models.errors import PConnectionInvalidResponseError, PConnectionRequestError
 
 
@@ -52,8 +54,14 @@ def response_valid_status(env, start_response):
     return [json.dumps({'status': ResponseJobStatus.OK.value}).encode()]
 
 
-def server(responses, lock):
-    httpd = make_server('', 9999, lambda x, y: responses.pop(0)(x, y))
+def response_unavailable(env, start_response):
+    start_response('503 Service Unavailable', [])
+
+    return []
+
+
+def server(responses, lock, port=9999):
+    httpd = make_server('', port, lambda x, y: responses.pop(0)(x, y))
     lock.release()
     while len(responses):
         httpd.handle_request()
@@ -123,3 +131,152 @@ def test_one():
     connection.fetch_job('token')
 
     th.join()
+
+
+def test_retry():
+    lock = Lock()
+    lock.acquire()
+
+    responses = [
+        response_unavailable,
+        response_unavailable,
+        response_valid_job,
+        response_unavailable,
+        response_unavailable,
+    ]
+
+    th = Thread(target=server, args=(responses, lock, 9998))
+    th.start()
+    lock.acquire()
+
+    connection = Connection('http://localhost:9998', retries=2, backoff=0)
+
+    # retried until valid response
+    assert connection.fetch_job('token') is not None
+
+    # retries exhausted
+    with pytest.raises(PConnectionRequestError):
+        connection.fetch_job('token')
+
+    th.join()
+
+
+def test_session_after_fork(monkeypatch):
+    connection = Connection('http://localhost:9999')
+    session = connection._http
+    assert connection._http is session
+
+    monkeypatch.setattr('os.getpid', lambda: -1)
+    assert connection._http is not session
+
+
+def response_batch(env, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+
+    assert 'limit=3' in env['QUERY_STRING']
+    jobs = list()
+    for name in ['ok', 'fail', 'no_image']:
+        with open('tests/jobs/{}.json'.format(name)) as fp:
+            jobs.append(json.load(fp))
+
+    return [json.dumps(jobs).encode()]
+
+
+def response_batch_over_limit(env, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+
+    jobs = list()
+    for name in ['ok', 'fail', 'cd']:
+        with open('tests/jobs/{}.json'.format(name)) as fp:
+            jobs.append(json.load(fp))
+
+    return [json.dumps(jobs).encode()]
+
+
+def response_rejected(secret):
+    def response(env, start_response):
+        assert env['PATH_INFO'] == '/jobs/report/{}'.format(secret)
+        assert env['QUERY_STRING'] == 'status={}'.format(RequestJobStatus.ERROR.value)
+
+        return response_valid_status(env, start_response)
+
+    return response
+
+
+def test_batch():
+    lock = Lock()
+    lock.acquire()
+
+    responses = [
+        response_empty,
+        response_valid_job,
+        response_batch,
+        response_rejected('no_image'),
+        response_batch_over_limit,
+        response_rejected('cd'),
+        response_not_json,
+    ]
+
+    th = Thread(target=server, args=(responses, lock, 9996))
+    th.start()
+    lock.acquire()
+
+    connection = Connection('http://localhost:9996')
+
+    # empty response
+    assert connection.fetch_jobs('token', 3) == []
+
+    # core without batch support
+    jobs = connection.fetch_jobs('token', 3)
+    assert [job.secret for job in jobs] == ['ok']
+
+    # invalid jobs are reported failed
+    jobs = connection.fetch_jobs('token', 3)
+    assert [job.secret for job in jobs] == ['ok', 'fail']
+
+    # so are jobs over the limit
+    jobs = connection.fetch_jobs('token', 2)
+    assert [job.secret for job in jobs] == ['ok', 'fail']
+
+    # response not json
+    with pytest.raises(PConnectionInvalidResponseError):
+        connection.fetch_jobs('token', 3)
+
+    th.join()
+
+
+def response_chunk_acknowledged(env, start_response):
+    start_response('200 OK', [('Content-Type', 'application/json')])
+
+    assert env['HTTP_CONTENT_ENCODING'] == 'gzip'
+    assert env['HTTP_X_PIPER_OFFSET'] == '10'
+    assert env['HTTP_X_PIPER_SEQUENCE'] == '2'
+    body = env['wsgi.input'].read(int(env['CONTENT_LENGTH']))
+    assert gzip.decompress(body) == b'LOG LOG LOG'
+
+    return [json.dumps({'status': ResponseJobStatus.OK.value, 'offset': 14}).encode()]
+
+
+def test_report_chunk():
+    lock = Lock()
+    lock.acquire()
+
+    responses = [
+        response_chunk_acknowledged,
+        response_valid_status,
+    ]
+
+    th = Thread(target=server, args=(responses, lock, 9995))
+    th.start()
+    lock.acquire()
+
+    connection = Connection('http://localhost:9995')
+    chunk = LogChunk(gzip.compress(b'LOG LOG LOG'), 10, 11, 2, 'gzip')
+
+    # acknowledged part of the chunk
+    assert connection.report_chunk('secret', RequestJobStatus.RUNNING, chunk) == (ResponseJobStatus.OK, 14)
+
+    # core not telling offset
+    assert connection.report_chunk('secret', RequestJobStatus.RUNNING, chunk) == (ResponseJobStatus.OK, None)
+
+    th.join()
@@ -0,0 +1,122 @@
+import json
+import threading
+from datetime import timedelta
+from time import monotonic, sleep
+
+import pylxd
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.events import EventListener
+
+
+def event(operation_id, status_code, event_type='operation'):
+    return json.dumps({
+        'type': event_type,
+        'metadata': {'id': operation_id, 'status_code': status_code},
+    }).encode()
+
+
+def listener():
+    events = EventListener(None)
+    events._connected = True
+
+    return events
+
+
+def test_wait():
+    events = listener()
+    events.register('a')
+    events.register('b')
+    events.dispatch(event('a', 103))
+    events.dispatch(event('b', 200, 'logging'))
+    events.dispatch(b'garbage')
+    events.dispatch(event('a', 400))
+
+    assert events.wait('b', timedelta(0)) is None
+    assert events.wait('a', timedelta(0))['status_code'] == 400
+    # consumed
+    assert events.wait('a', timedelta(0)) is None
+
+
+def test_wait_blocks():
+    events = listener()
+    events.register('a')
+    threading.Timer(0.05, events.dispatch, args=(event('a', 200),)).start()
+
+    assert events.wait('a', timedelta(seconds=5))['status_code'] == 200
+
+
+def test_register():
+    events = listener()
+    # finished before its Script registered it
+    events.dispatch(event('a', 200))
+    events.register('a')
+    events.register('b')
+    for i in range(EventListener.RECENT + 1):
+        events.dispatch(event(str(i), 200))
+    events.dispatch(event('b', 200))
+
+    assert events.wait('a', timedelta(0)) is not None
+    assert events.wait('b', timedelta(0)) is not None
+    # unregistered operations are kept only until newer ones push them out
+    assert len(events._recent) == EventListener.RECENT
+    assert events._finished == {}
+    assert events._registered == set()
+
+
+def test_disconnected():
+    events = listener()
+    threading.Timer(0.05, events.disconnected, args=(1006,)).start()
+
+    assert events.wait('a', timedelta(seconds=5)) is None
+    assert not events.connected
+    # no resubscription attempted
+    events.stop()
+
+
+def test_subscribe():
+    # the operation finishes once the subscription surely reached the server
+    lxd = FakeLxd(create_latency=0.2)
+    lxd.start()
+    events = EventListener(pylxd.Client(endpoint=lxd.url))
+    try:
+        assert events.start()
+        response = events._client.api.containers.post(json={'name': 'test'})
+        operation_id = response.json()['metadata']['id']
+        events.register(operation_id)
+
+        assert events.wait(operation_id, timedelta(seconds=5))['status_code'] == 200
+    finally:
+        events.stop()
+        lxd.stop()
+
+    assert not events.connected
+
+
+def test_resubscribe(monkeypatch):
+    monkeypatch.setattr(EventListener, 'RECONNECT', timedelta(seconds=0.05))
+    lxd = FakeLxd()
+    lxd.start()
+    port = int(lxd.url.rsplit(':', 1)[1])
+    events = EventListener(pylxd.Client(endpoint=lxd.url))
+    try:
+        assert events.start()
+        lxd.stop()
+        deadline = monotonic() + 5
+        while events.connected and monotonic() < deadline:
+            sleep(0.01)
+        assert not events.connected
+
+        lxd = FakeLxd(port=port, create_latency=0.2)
+        lxd.start()
+        while not events.connected and monotonic() < deadline + 5:
+            sleep(0.01)
+        assert events.connected
+
+        response = events._client.api.containers.post(json={'name': 'test'})
+        operation_id = response.json()['metadata']['id']
+        events.register(operation_id)
+        assert events.wait(operation_id, timedelta(seconds=5))['status_code'] == 200
+    finally:
+        events.stop()
+        lxd.stop()
@@ -1,10 +1,16 @@
 import re
 import io
 import urllib3
+from datetime import timedelta
+from pathlib import Path
 
 import pytest
+import pylxd
 
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.config import LxdConfig, PoolConfig, TemplateConfig
 from piper_lxd.models.executor import Executor
+from piper_lxd.models.pool import ContainerPool
 from piper_lxd.models.job import Job, RequestJobStatus, ResponseJobStatus
 from piper_lxd.models.errors import PConnectionException
 
@@ -124,3 +130,58 @@ def test_not_responding(connection, config, empty_clone):
     job = connection.fetch_job('token')
     exe = Executor(connection, config.runner.interval, config.lxd, job)
     exe.run()
+
+
+def test_pool(connection, config, empty_clone):
+    cert = (str(config.lxd.cert.expanduser()), str(config.lxd.key.expanduser()))
+    client = pylxd.Client(cert=cert, endpoint=config.lxd.endpoint, verify=config.lxd.verify)
+    pool = ContainerPool(client, config.lxd.profiles, [PoolConfig('alpine/3.5', 1, 1)], config.runner.interval)
+    pool.refill()
+
+    connection.push_job('ok')
+    job = connection.fetch_job('token')
+    container = pool.claim(job.image)
+    assert container is not None
+    assert pool.claim(job.image) is None
+
+    exe = Executor(connection, config.runner.interval, config.lxd, job, container=container)
+    exe.run()
+
+    statuses = connection.statuses['ok']
+    assert statuses[-1] is RequestJobStatus.COMPLETED
+    assert 'I want to die' in connection.logs['ok']
+    assert not client.containers.exists(container)
+    pool.stop()
+
+
+def test_pool_cancel(connection):
+    lxd = FakeLxd()
+    lxd.start()
+    try:
+        client = pylxd.Client(endpoint=lxd.url)
+        client.containers.create({'name': 'pooled', 'source': {'type': 'none'}}, wait=True)
+        connection.report = lambda a, b, c, d=None: ResponseJobStatus.CANCEL
+        connection.push_job('ok')
+        job = connection.fetch_job('token')
+        # certificate files are only checked to exist over plain HTTP
+        host = LxdConfig(False, [], lxd.url, Path(__file__), Path(__file__))
+        exe = Executor(connection, timedelta(seconds=1), host, job, container='pooled')
+        exe.run()
+
+        # cancelled before Script claimed it
+        assert lxd.containers == {}
+    finally:
+        lxd.stop()
+
+
+def test_template(connection, config, empty_clone, tmpdir):
+    templates = [TemplateConfig('alpine/3.5', ['echo template > /root/template'])]
+    connection.push_job('ok')
+    job = connection.fetch_job('token')
+    state_dir = Path(str(tmpdir))
+    exe = Executor(connection, config.runner.interval, config.lxd, job, templates=templates, state_dir=state_dir)
+    exe.run()
+
+    statuses = connection.statuses['ok']
+    assert statuses[-1] is RequestJobStatus.COMPLETED
+    assert 'I want to die' in connection.logs['ok']
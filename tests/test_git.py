@@ -1,6 +1,7 @@
 import tempfile
 import os
 import subprocess
+import time
 from pathlib import Path
 import pytest
 
@@ -49,3 +50,144 @@ def test_fail_2():
     with tempfile.TemporaryDirectory() as td:
         with pytest.raises(PCloneException):
             git.clone(origin, branch, commit, Path(td))
+
+
+def _git(cwd, *args):
+    command = ['git', '-c', 'protocol.file.allow=always', '-c', 'user.name=piper', '-c', 'user.email=piper@localhost']
+    process = subprocess.Popen(command + list(args), cwd=str(cwd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    assert process.returncode == 0, err
+    return out.decode().strip()
+
+
+def _commit(repository, name):
+    (repository / name).write_text(name)
+    _git(repository, 'add', name)
+    _git(repository, 'commit', '-m', name)
+    return _git(repository, 'rev-parse', 'HEAD')
+
+
+@pytest.fixture()
+def local_origin(tmpdir, monkeypatch):
+    # submodules are cloned over file:// transport which is disabled by default since git 2.38.1
+    monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+    monkeypatch.setenv('GIT_CONFIG_KEY_0', 'protocol.file.allow')
+    monkeypatch.setenv('GIT_CONFIG_VALUE_0', 'always')
+    root = Path(str(tmpdir))
+    submodule = root / 'submodule'
+    origin = root / 'origin'
+    for repository in (submodule, origin):
+        repository.mkdir()
+        _git(repository, 'init', '-b', 'master')
+    _commit(submodule, 'README.md')
+    _commit(origin, 'README.md')
+    _git(origin, 'submodule', 'add', 'file://' + str(submodule), 'submodule')
+    _git(origin, 'commit', '-m', 'submodule')
+
+    return origin
+
+
+def test_cache(local_origin, tmpdir):
+    cache = git.MirrorCache(Path(str(tmpdir)) / 'cache', 1024 * 1024 * 1024)
+    commit = _git(local_origin, 'rev-parse', 'HEAD')
+
+    for _ in range(2):
+        with tempfile.TemporaryDirectory() as td:
+            git.clone(str(local_origin), 'master', commit, Path(td), cache)
+            assert _git(td, 'rev-parse', 'HEAD') == commit
+            assert _git(td, 'remote', 'get-url', 'origin') == str(local_origin)
+            assert sorted(['submodule', 'README.md', '.gitmodules', '.git']) == sorted(os.listdir(td))
+            assert sorted(['README.md', '.git']) == sorted(os.listdir(os.path.join(td, 'submodule')))
+
+    assert len(list(cache.path.glob('*.git'))) == 2
+
+    commit = _commit(local_origin, 'NEW')
+    with tempfile.TemporaryDirectory() as td:
+        git.clone(str(local_origin), 'master', commit, Path(td), cache)
+        assert _git(td, 'rev-parse', 'HEAD') == commit
+
+
+def test_cache_eviction(local_origin, tmpdir):
+    cache = git.MirrorCache(Path(str(tmpdir)) / 'cache', 1)
+    commit = _git(local_origin, 'rev-parse', 'HEAD')
+
+    with tempfile.TemporaryDirectory() as td:
+        git.clone(str(local_origin), 'master', commit, Path(td), cache)
+        assert _git(td, 'rev-parse', 'HEAD') == commit
+        assert (Path(td) / 'submodule' / 'README.md').exists()
+
+    assert len(list(cache.path.glob('*.git'))) == 0
+
+
+def test_cache_fail(tmpdir):
+    cache = git.MirrorCache(Path(str(tmpdir)) / 'cache', 1024 * 1024 * 1024)
+
+    with tempfile.TemporaryDirectory() as td:
+        with pytest.raises(PCloneException):
+            git.clone(str(Path(str(tmpdir)) / 'NONEXISTENT'), 'master', 'HEAD', Path(td), cache)
+
+    assert len(list(cache.path.glob('*'))) == 1  # lock file only
+
+
+@pytest.mark.parametrize('strategy', [git.CloneStrategy.SHALLOW, git.CloneStrategy.PARTIAL])
+def test_shallow(local_origin, strategy):
+    first = _git(local_origin, 'rev-parse', 'HEAD')
+    commit = _commit(local_origin, 'NEW')
+
+    with tempfile.TemporaryDirectory() as td:
+        git.clone(str(local_origin), 'master', first, Path(td), strategy=strategy, jobs=2)
+        assert _git(td, 'rev-parse', 'HEAD') == first
+        assert _git(td, 'rev-parse', '--is-shallow-repository') == 'true'
+        assert sorted(['submodule', 'README.md', '.gitmodules', '.git']) == sorted(os.listdir(td))
+        assert sorted(['README.md', '.git']) == sorted(os.listdir(os.path.join(td, 'submodule')))
+
+    with tempfile.TemporaryDirectory() as td:
+        git.clone(str(local_origin), 'master', commit, Path(td), strategy=strategy)
+        assert _git(td, 'rev-parse', 'HEAD') == commit
+
+
+def test_partial_sparse(local_origin):
+    _git(local_origin, 'config', 'uploadpack.allowFilter', 'true')
+    commit = _commit(local_origin, 'NEW')
+
+    with tempfile.TemporaryDirectory() as td:
+        git.clone(str(local_origin), 'master', commit, Path(td), strategy=git.CloneStrategy.PARTIAL, sparse=['/NEW'])
+        assert _git(td, 'rev-parse', 'HEAD') == commit
+        assert (Path(td) / 'NEW').exists()
+        assert not (Path(td) / 'README.md').exists()
+
+
+def test_shallow_fail(local_origin):
+    commit = 'e7a4739755a81a06242bc3249e36b133b3783f9b'
+
+    with tempfile.TemporaryDirectory() as td:
+        with pytest.raises(PCloneException):
+            git.clone(str(local_origin), 'master', commit, Path(td), strategy=git.CloneStrategy.SHALLOW)
+
+
+def test_task(local_origin):
+    commit = _git(local_origin, 'rev-parse', 'HEAD')
+
+    with tempfile.TemporaryDirectory() as td:
+        task = git.CloneTask(str(local_origin), 'master', commit, Path(td))
+        task.start()
+        task.result()
+        task.cancel()
+        assert _git(td, 'rev-parse', 'HEAD') == commit
+
+
+def test_task_cancel(monkeypatch):
+    # origin that never answers
+    monkeypatch.setenv('GIT_CONFIG_COUNT', '1')
+    monkeypatch.setenv('GIT_CONFIG_KEY_0', 'protocol.ext.allow')
+    monkeypatch.setenv('GIT_CONFIG_VALUE_0', 'always')
+
+    with tempfile.TemporaryDirectory() as td:
+        task = git.CloneTask('ext::sleep 60', 'master', 'HEAD', Path(td))
+        task.start()
+        time.sleep(0.5)
+        started = time.monotonic()
+        task.cancel()
+        assert time.monotonic() - started < 10
+        with pytest.raises(PCloneException):
+            task.result()
@@ -0,0 +1,82 @@
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.config import ImageConfig, LxdConfig
+from piper_lxd.models.image import ImageManager
+
+
+@pytest.fixture
+def server():
+    server = FakeLxd(remote={'alpine/3.5': 'a' * 64, 'debian/9': 'd' * 64})
+    server.start()
+    yield server
+    server.stop()
+
+
+def manager(server, budget=10 * 1024 ** 2, pinned=None):
+    config = ImageConfig('https://images.example.com', 'simplestreams', timedelta(hours=1), budget, pinned or [])
+    # certificate files are only checked to exist over plain HTTP
+    host = LxdConfig(False, [], server.url, Path(__file__), Path(__file__))
+
+    return ImageManager(host, config)
+
+
+def test_source(server):
+    images = manager(server)
+    assert images.source('alpine/3.5') == {
+        'type': 'image', 'alias': 'alpine/3.5', 'mode': 'pull', 'server': 'https://images.example.com',
+        'protocol': 'simplestreams',
+    }
+
+    images.use('alpine/3.5')
+    images.refresh()
+    assert server.aliases == {'alpine/3.5': 'a' * 64}
+    assert images.source('alpine/3.5') == {'type': 'image', 'fingerprint': 'a' * 64}
+
+
+def test_no_server():
+    config = ImageConfig(None, 'simplestreams', timedelta(hours=1), 0, [])
+    with pytest.raises(ValueError):
+        ImageManager(LxdConfig(False, [], 'http://127.0.0.1:1', Path(__file__), Path(__file__)), config)
+
+
+def test_refresh(server):
+    images = manager(server)
+    images.use('alpine/3.5')
+    images.refresh()
+
+    server.remote['alpine/3.5'] = 'c' * 64
+    images.refresh()
+    assert server.aliases == {'alpine/3.5': 'c' * 64}
+    # outdated image is deleted
+    assert set(server.images) == {'c' * 64}
+    assert images.source('alpine/3.5') == {'type': 'image', 'fingerprint': 'c' * 64}
+
+
+def test_refresh_failure(server):
+    images = manager(server)
+    images.use('ubuntu/16.04')
+    images.use('alpine/3.5')
+    # unknown image does not stop refresh of the others
+    images.refresh()
+
+    assert set(server.images) == {'a' * 64}
+
+
+def test_evict(server):
+    images = manager(server, budget=1024 ** 2, pinned=['debian/9'])
+    images.use('alpine/3.5')
+    images.refresh()
+    assert set(server.images) == {'a' * 64, 'd' * 64}
+
+    # alpine is still hot
+    images.refresh()
+    assert set(server.images) == {'a' * 64, 'd' * 64}
+
+    images._used['alpine/3.5'] = 0.0
+    images.refresh()
+    assert set(server.images) == {'d' * 64}
+    assert images.source('alpine/3.5')['alias'] == 'alpine/3.5'
@@ -0,0 +1,30 @@
+from pathlib import Path
+
+import pylxd
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.config import LxdConfig
+from piper_lxd.models.janitor import Janitor
+
+
+def test_discard():
+    lxd = FakeLxd(stop_latency=0.1, delete_latency=0.1)
+    lxd.start()
+    # certificate files are only checked to exist over plain HTTP
+    janitor = Janitor(LxdConfig(False, [], lxd.url, Path(__file__), Path(__file__)))
+    try:
+        client = pylxd.Client(endpoint=lxd.url)
+        for name in ['a', 'b', 'c']:
+            client.containers.create({'name': name, 'source': {'type': 'none'}}, wait=True)
+        client.containers.get('a').start(wait=True)
+
+        janitor.discard('a')
+        janitor.discard('b')
+        janitor.discard('unknown')
+        janitor.start()
+        janitor.stop()
+
+        assert set(lxd.containers) == {'c'}
+        assert lxd.deleted == 2
+    finally:
+        lxd.stop()
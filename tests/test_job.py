@@ -34,3 +34,27 @@ def test_image_not_str():
 def test_after_failure_not_list():
     with pytest.raises(SchemaError):
         Job(load_dict('after_failure_not_list'))
+
+
+def test_cache():
+    job = load_dict('ok')
+    assert Job(job).cache_key is None
+    assert Job(job).cache_paths == []
+
+    job['cache'] = {'key': 'pip', 'paths': ['/root/.cache/pip']}
+    assert Job(job).cache_key == 'pip'
+    assert Job(job).cache_paths == ['/root/.cache/pip']
+
+    job['cache']['paths'] = ['relative']
+    with pytest.raises(SchemaError):
+        Job(job)
+
+
+def test_resources():
+    job = load_dict('ok')
+    assert Job(job).resources is None
+    assert Job(job).priority == 0
+
+    job.update(resources='large', priority=10)
+    assert Job(job).resources == 'large'
+    assert Job(job).priority == 10
@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pylxd
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.config import LxdConfig
+from piper_lxd.models.errors import PConnectionRequestError
+from piper_lxd.models.janitor import Janitor
+from piper_lxd.models.job import RequestJobStatus
+from piper_lxd.models.journal import Journal
+from piper_lxd.models.reaper import Reaper
+
+
+class FakeConnection:
+
+    def __init__(self, fail=False):
+        self.reports = list()
+        self.fail = fail
+
+    def report(self, secret, status, log=None, steps=None):
+        if self.fail:
+            raise PConnectionRequestError('unreachable')
+        self.reports.append((secret, status))
+
+
+class FakeJanitor:
+
+    def __init__(self):
+        self.discarded = list()
+
+    def discard(self, name):
+        self.discarded.append(name)
+
+
+def test_journal(tmpdir):
+    journal = Journal(Path(str(tmpdir)) / 'state' / 'journal.sqlite')
+    journal.begin('a')
+    journal.workspace('a', Path('/tmp/a'))
+    journal.workspace('a', Path('/tmp/b'))
+    journal.workspace('unknown', Path('/tmp/c'))
+    journal.begin('b')
+    journal.finish('b')
+    assert journal.jobs() == [('a', [Path('/tmp/a'), Path('/tmp/b')])]
+
+    journal.track('piper1', 'https://lxd', 'a')
+    journal.track('piper2', 'https://lxd')
+    journal.forget(['piper1'])
+    assert journal.containers() == [('piper2', 'https://lxd', None)]
+
+
+def test_reap(tmpdir):
+    lxd = FakeLxd()
+    lxd.start()
+    # certificate files are only checked to exist over plain HTTP
+    host = LxdConfig(False, [], lxd.url, Path(__file__), Path(__file__))
+    journal = Journal(Path(str(tmpdir)) / 'journal.sqlite')
+    janitor = Janitor(host, journal)
+    try:
+        client = pylxd.Client(endpoint=lxd.url)
+        for name, secret in [('dead', 'a'), ('alive', 'b'), ('pooled', None)]:
+            janitor.track(name, secret)
+            client.containers.create({'name': name, 'source': {'type': 'none'}}, wait=True)
+        workspace = Path(str(tmpdir)) / 'workspace'
+        workspace.mkdir()
+        for secret in ['a', 'b']:
+            journal.begin(secret)
+        journal.workspace('a', workspace)
+
+        connection = FakeConnection(fail=True)
+        reaper = Reaper(journal, connection, {host.endpoint: janitor})
+        reaper.reap({'b'})
+        janitor.start()
+        janitor.stop()
+
+        # cleaned up, but PiperCore is told next time
+        assert set(lxd.containers) == {'alive', 'pooled'}
+        assert not workspace.exists()
+        assert [job.secret for job in journal.jobs()] == ['a', 'b']
+
+        connection.fail = False
+        reaper.reap({'b'})
+        assert connection.reports == [('a', RequestJobStatus.ERROR)]
+        assert [job.secret for job in journal.jobs()] == ['b']
+
+        janitor = Janitor(host, journal)
+        Reaper(journal, connection, {host.endpoint: janitor}).reap(set(), startup=True)
+        janitor.start()
+        janitor.stop()
+        assert lxd.containers == {}
+        assert journal.containers() == []
+        assert journal.jobs() == []
+    finally:
+        lxd.stop()
+
+
+def test_reap_leftover(tmpdir):
+    journal = Journal(Path(str(tmpdir)) / 'journal.sqlite')
+    janitor = FakeJanitor()
+    reaper = Reaper(journal, FakeConnection(), {'https://lxd': janitor})
+    journal.begin('running')
+    journal.track('pooled', 'https://lxd')
+    journal.track('running', 'https://lxd', 'running')
+    journal.track('finished', 'https://lxd', 'finished')
+
+    # Janitor may still be deleting it
+    reaper.reap({'running'})
+    assert janitor.discarded == []
+
+    # its deletion failed
+    reaper.reap({'running'})
+    assert janitor.discarded == ['finished']
@@ -0,0 +1,141 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from piper_lxd.models.errors import PConnectionException, PConnectionRequestError
+from piper_lxd.models.job import RequestJobStatus, ResponseJobStatus
+from piper_lxd.models.log import LogRecord, LogShipper
+from piper_lxd.models.steps import Step
+
+
+class FakeCore:
+
+    def __init__(self):
+        self.log = b''
+        self.chunks = list()
+        self.heartbeats = 0
+        self.steps = list()
+        self.reachable = True
+        # acknowledge at most this many bytes per chunk
+        self.limit = None
+
+    def report(self, secret, status, log=None, steps=None):
+        if not self.reachable:
+            raise PConnectionRequestError('unreachable')
+        self.heartbeats += 1
+        self.steps.append([(step.kind, step.index) for step in steps or []])
+
+        return ResponseJobStatus.OK
+
+    def report_chunk(self, secret, status, chunk, steps=None):
+        if not self.reachable:
+            raise PConnectionRequestError('unreachable')
+        assert status is RequestJobStatus.RUNNING
+        self.chunks.append(chunk)
+        self.steps.append([(step.kind, step.index) for step in steps or []])
+        data = chunk.decode()
+        assert chunk.offset <= len(self.log)
+        if self.limit is not None:
+            data = data[:self.limit]
+        self.log = self.log[:chunk.offset] + data
+
+        return ResponseJobStatus.OK, len(self.log)
+
+
+@pytest.fixture()
+def spool(tmpdir):
+    return Path(str(tmpdir))
+
+
+def test_send(spool):
+    core = FakeCore()
+    shipper = LogShipper(core, 'secret', spool, 1024)
+
+    assert shipper.send(b'') is ResponseJobStatus.OK
+    assert core.heartbeats == 1
+    shipper.send(b'hello ')
+    shipper.send(b'world')
+    assert core.log == b'hello world'
+    assert [chunk.sequence for chunk in core.chunks] == [0, 1]
+    assert [chunk.offset for chunk in core.chunks] == [0, 6]
+    assert shipper.pending == 0
+
+
+def test_send_views(spool):
+    core = FakeCore()
+    shipper = LogShipper(core, 'secret', spool, 1024, compression='gzip')
+
+    # SegmentBuffer hands out views of its memory and spill file
+    data = b'hello world'
+    shipper.send(memoryview(data)[:6], memoryview(data)[6:])
+    assert core.log == data
+    assert shipper.pending == 0
+
+
+def test_gzip(spool):
+    core = FakeCore()
+    shipper = LogShipper(core, 'secret', spool, 1024, 'gzip')
+
+    shipper.send(b'a' * 100)
+    assert core.chunks[0].encoding == 'gzip'
+    assert gzip.decompress(core.chunks[0].data) == b'a' * 100
+    assert len(core.chunks[0].data) < 100
+
+
+def test_spool(spool):
+    core = FakeCore()
+    shipper = LogShipper(core, 'secret', spool, 10)
+
+    core.reachable = False
+    assert shipper.send(b'hello ') is ResponseJobStatus.OK
+    assert shipper.pending == 6
+
+    core.reachable = True
+    shipper.send(b'world')
+    assert core.log == b'hello world'
+    assert shipper.pending == 0
+
+    core.reachable = False
+    with pytest.raises(PConnectionException):
+        shipper.send(b'a' * 11)
+
+
+def test_resume(spool):
+    core = FakeCore()
+    core.limit = 4
+    shipper = LogShipper(core, 'secret', spool, 1024, chunk_size=8)
+
+    shipper.send(b'0123456789')
+    assert core.log == b'0123456789'
+    assert [chunk.offset for chunk in core.chunks] == [0, 4, 8]
+
+
+def test_records():
+    data = LogRecord.header(LogRecord.STDOUT, 10, 0, 3) + b'out' + LogRecord.header(LogRecord.STDERR, 20, 0, 0)
+    records = LogRecord.parse(data)
+    assert [(r.stream, r.timestamp, r.offset, r.data) for r in records] == [
+        (LogRecord.STDOUT, 10, 0, b'out'),
+        (LogRecord.STDERR, 20, 0, b''),
+    ]
+
+
+def test_steps(spool, monkeypatch):
+    core = FakeCore()
+    shipper = LogShipper(core, 'secret', spool, 1024)
+    steps = [Step('command', i) for i in range(3)]
+
+    shipper.send(b'a', steps=steps)
+    steps[1].exit_code = 0
+    shipper.send(b'b', steps=steps)
+    shipper.send(b'', steps=steps)
+    assert core.steps == [[('command', 0), ('command', 1), ('command', 2)], [('command', 1)], []]
+    assert shipper.reported(steps)
+
+    # steps that do not fit one request follow in next ones
+    core.steps.clear()
+    monkeypatch.setattr(LogShipper, 'STEPS_SIZE', 250)
+    for step in steps:
+        step.exit_code = 1
+    shipper.send(b'c', steps=steps)
+    assert core.steps == [[('command', 0), ('command', 1)], [('command', 2)]]
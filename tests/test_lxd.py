@@ -0,0 +1,62 @@
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models import lxd
+from piper_lxd.models.config import LxdConfig
+
+
+State = namedtuple('State', ['network'])
+
+
+class FakeContainer:
+
+    def __init__(self, polls):
+        # state has network after `polls` calls
+        self.polls = polls
+        self.calls = 0
+
+    def state(self):
+        self.calls += 1
+        network = {'lo': {'addresses': [{'address': '127.0.0.1', 'scope': 'local'}]}}
+        if self.calls > self.polls:
+            addresses = [{'address': 'fe80::1', 'scope': 'link'}, {'address': '10.0.3.2', 'scope': 'global'}]
+            network['eth0'] = {'addresses': addresses}
+
+        return State(network)
+
+
+def test_has_network():
+    assert not lxd.has_network(FakeContainer(1))
+    assert lxd.has_network(FakeContainer(0))
+
+
+def test_wait_for_network(monkeypatch):
+    monkeypatch.setattr(lxd, 'NETWORK_POLL', timedelta(milliseconds=1))
+    container = FakeContainer(3)
+
+    assert lxd.wait_for_network(container, timedelta(seconds=5))
+    assert container.calls == 4
+    assert not lxd.wait_for_network(FakeContainer(10 ** 6), timedelta(milliseconds=20))
+
+
+def test_client(monkeypatch):
+    server = FakeLxd()
+    server.start()
+    try:
+        # certificate files are only checked to exist over plain HTTP
+        config = LxdConfig(False, [], server.url, Path(__file__), Path(__file__))
+        client = lxd.client(config)
+        assert lxd.client(config) is client
+
+        # forked process
+        monkeypatch.setattr(lxd.os, 'getpid', lambda: -1)
+        assert lxd.client(config) is not client
+    finally:
+        server.stop()
+
+
+def test_is_unix_socket():
+    assert lxd.is_unix_socket('/var/lib/lxd/unix.socket')
+    assert not lxd.is_unix_socket('https://127.0.0.1:8443')
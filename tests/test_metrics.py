@@ -0,0 +1,72 @@
+import multiprocessing
+import time
+
+import requests
+
+from piper_lxd.models.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+def test_render():
+    registry = Registry()
+    counter = Counter('test_total', 'Test counter.', ['kind'], registry=registry)
+    gauge = Gauge('test_gauge', 'Test gauge.', registry=registry)
+    histogram = Histogram('test_seconds', 'Test histogram.', ['kind'], buckets=[0.1, 1], registry=registry)
+
+    counter.inc(kind='a')
+    counter.inc(2, kind='a"b')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    histogram.observe(0.05, kind='a')
+    histogram.observe(0.5, kind='a')
+    histogram.observe(5, kind='a')
+
+    assert registry.render() == '\n'.join([
+        '# HELP test_gauge Test gauge.',
+        '# TYPE test_gauge gauge',
+        'test_gauge 1',
+        '# HELP test_seconds Test histogram.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{kind="a",le="0.1"} 1',
+        'test_seconds_bucket{kind="a",le="1"} 2',
+        'test_seconds_bucket{kind="a",le="+Inf"} 3',
+        'test_seconds_sum{kind="a"} 5.55',
+        'test_seconds_count{kind="a"} 3',
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{kind="a"} 1',
+        'test_total{kind="a\\"b"} 2',
+    ]) + '\n'
+
+
+def test_processes():
+    registry = Registry()
+    counter = Counter('test_total', 'Test counter.', registry=registry)
+    registry.enable()
+
+    processes = [multiprocessing.Process(target=counter.inc) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    counter.inc()
+
+    for _ in range(50):
+        if 'test_total 4' in registry.render():
+            break
+        time.sleep(0.1)
+    assert 'test_total 4' in registry.render()
+
+
+def test_server():
+    registry = Registry()
+    Counter('test_total', 'Test counter.', registry=registry).inc()
+    server = MetricsServer('127.0.0.1', 0, registry)
+    server.start()
+    try:
+        response = requests.get('http://127.0.0.1:{}/metrics'.format(server.port))
+        assert response.status_code == 200
+        assert 'test_total 1' in response.text
+        assert requests.get('http://127.0.0.1:{}/'.format(server.port)).status_code == 404
+    finally:
+        server.stop()
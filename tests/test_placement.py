@@ -0,0 +1,112 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_lxd import FakeLxd
+from piper_lxd.models.config import LxdConfig, ResourceClass
+from piper_lxd.models.placement import Placement
+
+
+class FakeExecutor:
+
+    def __init__(self, endpoint, resources=None):
+        self.endpoint = endpoint
+        self.resources = resources
+
+
+class FakePool:
+
+    def __init__(self, image):
+        self.image = image
+
+    def available(self, image):
+        return 1 if image == self.image else 0
+
+
+@pytest.fixture
+def servers():
+    servers = [FakeLxd(), FakeLxd()]
+    for server in servers:
+        server.start()
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def hosts(servers, capacity=2):
+    # certificate files are only checked to exist over plain HTTP
+    return [LxdConfig(False, [], s.url, Path(__file__), Path(__file__), capacity=capacity) for s in servers]
+
+
+def test_free(servers):
+    a, b = hosts(servers)
+    placement = Placement([a, b])
+
+    assert placement.free([]) == 4
+    assert placement.free([FakeExecutor(a.endpoint)] * 3) == 2
+
+
+def test_select_slots(servers):
+    a, b = hosts(servers)
+    placement = Placement([a, b])
+
+    assert placement.select('alpine', [FakeExecutor(a.endpoint)]) is b
+    assert placement.select('alpine', [FakeExecutor(b.endpoint)]) is a
+    # full host is skipped even though it is less loaded otherwise
+    servers[1].memory_used = 1024 ** 3
+    placement = Placement([a, b])
+    assert placement.select('alpine', [FakeExecutor(a.endpoint)] * 2) is b
+
+
+def test_select_memory(servers):
+    a, b = hosts(servers)
+    servers[0].memory_used = 512 * 1024 ** 2
+    placement = Placement([a, b])
+
+    assert placement.select('alpine', []) is b
+
+
+def test_select_pool(servers):
+    a, b = hosts(servers)
+    placement = Placement([a, b], {b.endpoint: FakePool('alpine')})
+
+    assert placement.select('alpine', [FakeExecutor(b.endpoint)]) is b
+    assert placement.select('debian', [FakeExecutor(b.endpoint)]) is a
+
+
+def test_select_resources(servers):
+    a, b = hosts(servers, capacity=4)
+    small = ResourceClass('small', 1, 256 * 1024 ** 2)
+    large = ResourceClass('large', 3, 512 * 1024 ** 2)
+    placement = Placement([a], reserve=128 * 1024 ** 2)
+
+    # idle host admits any class
+    assert placement.select('alpine', [], ResourceClass('huge', 8, 1024 ** 3)) is a
+    assert placement.select('alpine', [FakeExecutor(a.endpoint, small)], large) is a
+    # out of cores
+    assert placement.select('alpine', [FakeExecutor(a.endpoint, large)], large) is None
+    assert placement.select('alpine', [FakeExecutor(a.endpoint, large)], small) is a
+    # unlimited Job takes only a slot
+    assert placement.select('alpine', [FakeExecutor(a.endpoint, large)] * 3) is a
+
+    # memory is actually used on the host
+    servers[0].memory_used = 768 * 1024 ** 2
+    placement = Placement([a, b], reserve=128 * 1024 ** 2)
+    assert placement.select('alpine', [FakeExecutor(a.endpoint, small), FakeExecutor(b.endpoint, small)], small) is b
+
+
+def test_unreachable(servers):
+    a, b = hosts(servers)
+    servers[1].stop()
+    placement = Placement([a, b])
+
+    assert placement.free([]) == 2
+    assert placement.select('alpine', [FakeExecutor(a.endpoint)]) is a
+    assert placement.select('alpine', [FakeExecutor(a.endpoint)] * 2) is None
+
+    # tried again once the cached resources expire
+    servers[1] = FakeLxd(port=int(b.endpoint.rsplit(':', 1)[1]))
+    servers[1].start()
+    assert placement.free([]) == 2
+    placement._resources.clear()
+    assert placement.free([]) == 4
@@ -0,0 +1,115 @@
+import json
+import queue
+import time
+from datetime import timedelta
+from threading import Thread, Timer
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server
+
+from piper_lxd.models.connection import Connection
+from piper_lxd.models.poller import JobPoller
+
+
+def load_job(name):
+    with open('tests/jobs/{}.json'.format(name), mode='rb') as fp:
+        return fp.read()
+
+
+class FakeConnection:
+
+    def __init__(self, supports_long_poll: bool) -> None:
+        self.supports_long_poll = supports_long_poll
+        self.waits = list()
+
+    def fetch_jobs(self, token, limit, wait=None):
+        self.waits.append(wait)
+        if wait is not None and self.supports_long_poll:
+            time.sleep(wait.total_seconds())
+
+        return []
+
+
+def test_fallback():
+    connection = FakeConnection(supports_long_poll=False)
+    poller = JobPoller(connection, 'token', timedelta(seconds=1), timedelta(seconds=1), timedelta(seconds=1))
+
+    # single fast answer may be a coincidence
+    for _ in range(JobPoller.FALLBACK_AFTER):
+        assert poller.long_poll
+        assert poller.fetch() == []
+    assert not poller.long_poll
+    assert poller.fetch() == []
+    assert connection.waits == [timedelta(seconds=1)] * JobPoller.FALLBACK_AFTER + [None]
+
+
+def test_fallback_probe():
+    connection = FakeConnection(supports_long_poll=False)
+    wait = timedelta(milliseconds=100)
+    poller = JobPoller(connection, 'token', timedelta(seconds=1), timedelta(seconds=1), wait)
+    for _ in range(JobPoller.FALLBACK_AFTER):
+        poller.fetch()
+    assert not poller.long_poll
+
+    # PiperCore got upgraded
+    connection.supports_long_poll = True
+    poller._probe_at = time.monotonic()
+    assert poller.fetch() == []
+    assert poller.long_poll
+    assert connection.waits[-1] == wait
+
+    # fell back again, single fast answer to the next probe is enough
+    connection.supports_long_poll = False
+    for _ in range(JobPoller.FALLBACK_AFTER):
+        poller.fetch()
+    poller._probe_at = time.monotonic()
+    assert poller.fetch() == []
+    assert not poller.long_poll
+
+
+def test_long_poll_supported():
+    connection = FakeConnection(supports_long_poll=True)
+    wait = timedelta(milliseconds=100)
+    poller = JobPoller(connection, 'token', timedelta(seconds=1), timedelta(seconds=1), wait)
+
+    assert poller.fetch() == []
+    assert poller.long_poll
+
+    started = time.monotonic()
+    poller.idle()
+    assert time.monotonic() - started < 0.1
+
+
+def fake_core(jobs: queue.Queue, requests: int):
+    def app(env, start_response):
+        wait = int(parse_qs(env['QUERY_STRING']).get('wait', ['0'])[0])
+        try:
+            job = jobs.get(timeout=wait) if wait else jobs.get_nowait()
+        except queue.Empty:
+            start_response('200 OK', [])
+            return []
+
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [job]
+
+    httpd = make_server('', 9997, app)
+    for _ in range(requests):
+        httpd.handle_request()
+
+
+def test_long_poll_pickup():
+    jobs = queue.Queue()
+    th = Thread(target=fake_core, args=(jobs, 1))
+    th.start()
+
+    connection = Connection('http://localhost:9997')
+    poller = JobPoller(connection, 'token', timedelta(seconds=1), timedelta(seconds=1), timedelta(seconds=5))
+
+    Timer(0.2, lambda: jobs.put(load_job('ok'))).start()
+    started = time.monotonic()
+    jobs = poller.fetch(4)
+    assert len(jobs) == 1
+    assert jobs[0].secret == json.loads(load_job('ok').decode())['secret']
+    assert time.monotonic() - started < 2
+    assert poller.long_poll
+
+    th.join()
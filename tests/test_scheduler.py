@@ -0,0 +1,89 @@
+import multiprocessing
+import threading
+
+from piper_lxd.models.scheduler import JobQueue, ProcessScheduler, ThreadScheduler
+
+
+class FakeJob:
+
+    def __init__(self, secret: str, priority: int) -> None:
+        self.secret = secret
+        self.priority = priority
+
+
+class FakeExecutor:
+
+    def __init__(self, name: str, event: threading.Event) -> None:
+        self.name = name
+        self.event = event
+        self.done = False
+
+    def run(self) -> None:
+        self.event.wait()
+        self.done = True
+
+
+class FakeProcessExecutor(multiprocessing.Process):
+
+    def __init__(self, event, **kwargs) -> None:
+        self.event = event
+        super().__init__(**kwargs)
+
+    def run(self) -> None:
+        self.event.wait()
+
+
+def test_thread():
+    event = threading.Event()
+    scheduler = ThreadScheduler(2)
+    assert scheduler.free == 2
+
+    executors = [FakeExecutor('a', event), FakeExecutor('b', event)]
+    for executor in executors:
+        scheduler.submit(executor)
+    assert scheduler.free == 0
+    assert set(scheduler.running) == set(executors)
+
+    event.set()
+    scheduler.join()
+    assert scheduler.free == 2
+    assert scheduler.running == []
+    assert all(executor.done for executor in executors)
+
+
+def test_thread_exception():
+    class FailingExecutor(FakeExecutor):
+        def run(self):
+            raise RuntimeError
+
+    scheduler = ThreadScheduler(1)
+    scheduler.submit(FailingExecutor('a', threading.Event()))
+    scheduler.join()
+    assert scheduler.free == 1
+
+
+def test_process():
+    event = multiprocessing.Event()
+    scheduler = ProcessScheduler(1)
+    assert scheduler.free == 1
+
+    scheduler.submit(FakeProcessExecutor(event, name='a'))
+    assert scheduler.free == 0
+
+    event.set()
+    scheduler.join()
+    assert scheduler.free == 1
+
+
+def test_queue():
+    queue = JobQueue()
+    for secret, priority in [('a', 0), ('b', 5), ('c', 0), ('d', 5)]:
+        queue.push(FakeJob(secret, priority))
+
+    assert len(queue) == 4
+    assert queue.peek().secret == 'b'
+    popped = [queue.pop() for _ in range(4)]
+    assert [job.secret for job, _ in popped] == ['b', 'd', 'a', 'c']
+    # acquired when pushed, "a" came first
+    assert popped[2][1] <= popped[0][1]
+    assert queue.peek() is None
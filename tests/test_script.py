@@ -0,0 +1,94 @@
+import time
+from datetime import timedelta
+from threading import Timer
+
+from ws4py.manager import WebSocketManager
+from ws4py.messaging import BinaryMessage
+
+from piper_lxd.models.log import LogRecord
+from piper_lxd.models.script import BufferHandler, Script
+
+
+def elapsed(handler, timeout):
+    started = time.monotonic()
+    handler.wait(timeout)
+    return time.monotonic() - started
+
+
+def popped(handler):
+    return b''.join(handler.pop())
+
+
+def test_buffer_size():
+    handler = BufferHandler(4, timedelta(seconds=10))
+    Timer(0.1, lambda: handler.handle_message(b'12345')).start()
+    assert elapsed(handler, timedelta(seconds=5)) < 1
+    assert popped(handler) == b'12345'
+    assert popped(handler) == b''
+
+
+def test_buffer_latency():
+    handler = BufferHandler(1024, timedelta(milliseconds=200))
+    handler.handle_message(b'1')
+    assert 0.1 < elapsed(handler, timedelta(seconds=5)) < 1
+    assert popped(handler) == b'1'
+
+
+def test_buffer_timeout():
+    handler = BufferHandler(1024, timedelta(milliseconds=200))
+    assert 0.2 < elapsed(handler, timedelta(milliseconds=300)) < 1
+    assert popped(handler) == b''
+
+
+def test_buffer_closed():
+    handler = BufferHandler(1024, timedelta(seconds=10), streams=2)
+    handler.handle_message(b'1')
+    handler.close()
+    assert not handler.closed
+
+    Timer(0.1, handler.close).start()
+    assert elapsed(handler, timedelta(seconds=5)) < 1
+    assert handler.closed
+    assert popped(handler) == b'1'
+
+
+def test_buffer_split_character():
+    handler = BufferHandler(1024, timedelta(seconds=10))
+    data = 'žluťoučký'.encode()
+    handler.handle_message(data[:1])
+    handler.handle_message(data[1:])
+    assert popped(handler).decode() == 'žluťoučký'
+
+
+def test_buffer_framed():
+    handler = BufferHandler(1024, timedelta(seconds=10), log_format='framed')
+    handler.handle_message(b'out', LogRecord.STDOUT)
+    handler.handle_message(b'err', LogRecord.STDERR)
+    handler.handle_message(b'put', LogRecord.STDOUT)
+    records = LogRecord.parse(popped(handler))
+    assert [(r.stream, r.offset, r.data) for r in records] == [
+        (LogRecord.STDOUT, 0, b'out'),
+        (LogRecord.STDERR, 0, b'err'),
+        (LogRecord.STDOUT, 3, b'put'),
+    ]
+    assert records[0].timestamp <= records[1].timestamp <= records[2].timestamp
+
+
+def test_buffer_framed_truncated():
+    handler = BufferHandler(1024, timedelta(seconds=10), memory_limit=64, size_limit=64, log_format='framed')
+    for i in range(10):
+        handler.handle_message(str(i).encode() * 10, LogRecord.STDOUT)
+    records = LogRecord.parse(popped(handler))
+    assert records[0].data == b'0' * 10
+    assert records[1].stream == LogRecord.RUNNER
+    assert records[1].data.startswith(b'::piper:truncated:')
+    assert records[-1].data == b'9' * 10
+    assert records[-1].offset == 90
+
+
+def test_websocket_stream():
+    handler = BufferHandler(1024, timedelta(seconds=10), log_format='framed')
+    websocket = Script.WebSocket(WebSocketManager(), handler, LogRecord.STDERR, 'ws://127.0.0.1:1')
+    websocket.received_message(BinaryMessage(b'err'))
+    records = LogRecord.parse(popped(handler))
+    assert [(r.stream, r.data) for r in records] == [(LogRecord.STDERR, b'err')]
@@ -0,0 +1,56 @@
+from piper_lxd.models.steps import MarkerParser
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_steps():
+    clock = Clock()
+    parser = MarkerParser(clock)
+    parser.feed(b'::piper:command:0:start:1500000000::\nhello\n')
+    assert [(s.index, s.status) for s in parser.steps] == [(0, 'running')]
+
+    clock.now = 1.25
+    parser.feed(b'::piper:command:0:end:1500000001:0::\n::piper:command:1:start:1500000001::\n')
+    clock.now = 2.0
+    parser.feed(b'no newline::piper:command:1:end:1500000002:3::\n')
+    parser.feed(b'::piper:after_failure:0:start:1500000002::\n')
+
+    steps = parser.steps
+    assert [(s.kind, s.index, s.status, s.exit_code) for s in steps] == [
+        ('command', 0, 'succeeded', 0),
+        ('command', 1, 'failed', 3),
+        ('after_failure', 0, 'running', None),
+    ]
+    assert steps[0].to_dict() == {
+        'kind': 'command',
+        'index': 0,
+        'status': 'succeeded',
+        'exit_code': 0,
+        'started_at': 1500000000,
+        'duration': 1.25,
+    }
+    assert steps[1].duration == 0.75
+
+
+def test_split():
+    data = b'output ::: :piper::piper:command:12:start:1500000000::\r\noutput ::piper:command:12:end:1500000009:1::\n'
+    for size in range(1, len(data)):
+        parser = MarkerParser()
+        for i in range(0, len(data), size):
+            parser.feed(data[i:i + size])
+        steps = parser.steps
+        assert [(s.index, s.started_at, s.finished_at, s.exit_code) for s in steps] == [(12, 1500000000, 1500000009, 1)]
+
+
+def test_not_marker():
+    parser = MarkerParser()
+    parser.feed(b'::piper:' + b'x' * 1000 + b'\n::piper:command:x:start:1::\n::piper:truncated:10::\n')
+    parser.feed(b'::piper:comm')
+    assert parser.steps == []